@@ -5,6 +5,15 @@ const LogModel = require('../models/log.model');
 // Setup WebSocket client for connecting to server.py
 let serverPyClient = null;
 const SERVER_PY_URL = process.env.GROQ_SERVER_WS;
+
+// Flow control: server.py grants credits (logs we may send) on connect and as it
+// processes them; logs wait here, bounded, until credits are available
+const MAX_PENDING_LOGS = parseInt(process.env.SERVER_PY_MAX_PENDING_LOGS || '10000', 10);
+const pendingLogs = [];
+let credits = 0;
+let pausedUntil = 0;
+let drainTimer = null;
+let droppedLogs = 0;
 //const SERVER_PY_URL = 'ws://127.0.0.1:5001/ws';
 // const SERVER_PY_URL = 'ws://127.0.0.1:5001/ws/application';
 function setupServerPyConnection() {
@@ -16,11 +25,24 @@ function setupServerPyConnection() {
 
     serverPyClient.on('open', () => {
         console.log('🔗 Connected to server.py analysis backend');
+        credits = 0; // Granted afresh by the server on every connection
     });
 
     serverPyClient.on('message', (data) => {
         try {
             const message = JSON.parse(data);
+            if (message.type === 'flow') {
+                credits += message.credits;
+                drainPendingLogs();
+                return;
+            }
+            if (message.type === 'shed') {
+                console.warn(`⚠️ server.py shed ${message.count} logs (${message.action})`);
+                if (message.action === 'rejected') {
+                    pausedUntil = Date.now() + message.retry_after_ms;
+                }
+                return;
+            }
             console.log('📨 Received from server.py:', message);
         } catch (err) {
             console.error('❌ Failed to parse message from server.py:', err);
@@ -46,24 +68,49 @@ function getServerPyClient() {
     return serverPyClient;
 }
 
-// Forward logs to server.py
-function forwardLogToServerPy(logData) {
+// Send queued logs while the connection is open and credits last
+function drainPendingLogs() {
     if (!serverPyClient || serverPyClient.readyState !== WebSocket.OPEN) {
-        console.log('⚠️ Cannot forward log to server.py: connection not open');
-        setTimeout(() => forwardLogToServerPy(logData), 1000); // Retry after 1 second
-        return false;
+        return;
+    }
+    const wait = pausedUntil - Date.now();
+    if (wait > 0) {
+        if (!drainTimer) {
+            drainTimer = setTimeout(() => {
+                drainTimer = null;
+                drainPendingLogs();
+            }, wait);
+        }
+        return;
     }
 
-    try {
-        serverPyClient.send(JSON.stringify({
-            log: logData
-        }));
-        console.log('📤 Forwarded log to server.py');
-        return true;
-    } catch (err) {
-        console.error('❌ Failed to forward log to server.py:', err.message);
-        return false;
+    while (credits > 0 && pendingLogs.length > 0) {
+        const logData = pendingLogs.shift();
+        try {
+            serverPyClient.send(JSON.stringify({
+                log: logData
+            }));
+            credits -= 1;
+        } catch (err) {
+            console.error('❌ Failed to forward log to server.py:', err.message);
+            pendingLogs.unshift(logData);
+            return;
+        }
+    }
+}
+
+// Forward logs to server.py
+function forwardLogToServerPy(logData) {
+    if (pendingLogs.length >= MAX_PENDING_LOGS) {
+        pendingLogs.shift();
+        droppedLogs += 1;
+        if (droppedLogs % 1000 === 1) {
+            console.warn(`⚠️ server.py backlog full, dropped ${droppedLogs} oldest logs so far`);
+        }
     }
+    pendingLogs.push(logData);
+    drainPendingLogs();
+    return true;
 }
 
 function setupWebSocket(server) {
@@ -0,0 +1,208 @@
+import bisect
+import hashlib
+import heapq
+import logging
+
+import numpy as np
+
+from ring_buffer import NAT, format_epoch_ns, to_epoch_ns
+
+logger = logging.getLogger(__name__)
+
+# === Sketches ===
+class SpaceSaving:
+    """Space-Saving heavy hitters: approximate top-k counts in O(k) memory.
+
+    Counts are never underestimated; ``errors`` holds the maximum overestimate
+    inherited when an item replaced the previous minimum.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []  # (count, item) entries, stale ones are skipped lazily
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            min_item, min_count = self._pop_min()
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + count
+            self.errors[item] = min_count
+        heapq.heappush(self._heap, (self.counts[item], repr(item), item))
+        if len(self._heap) > 8 * self.capacity:
+            self._heap = [(c, repr(i), i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def top(self, n):
+        """The ``n`` items with the highest estimated counts, as a dict"""
+        return dict(sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:n])
+
+    def merge(self, counts):
+        """Fold in another sketch's counts (approximate, like adding each item in one go)"""
+        for item, count in counts.items():
+            self.add(item, count)
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers"""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+        self._tail_bits = 64 - precision
+        self._tail_mask = (1 << self._tail_bits) - 1
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode("utf-8", "replace"), digest_size=8).digest()
+        h = int.from_bytes(digest, "big")
+        index = h >> self._tail_bits
+        rank = self._tail_bits - (h & self._tail_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def merge(self, registers):
+        """Union with another sketch of the same precision"""
+        np.maximum(self.registers, registers, out=self.registers)
+
+# === Streaming Aggregator ===
+class StreamingAggregator:
+    """Incrementally maintained summary statistics for the current summary interval.
+
+    Each scored log is folded in once as it is ingested, so producing a summary
+    is a snapshot of a few small counters rather than a scan over the buffer.
+    """
+
+    def __init__(self, top_k=64, top_n=5, hll_precision=14, max_anomaly_logs=200):
+        self.top_k = top_k
+        self.top_n = top_n
+        self.hll_precision = hll_precision
+        self.max_anomaly_logs = max_anomaly_logs
+        self.reset()
+
+    def reset(self):
+        self.total_logs = 0
+        self.anomaly_count = 0
+        self.method_counts = {}
+        self.status_counts = {}
+        self.endpoints = SpaceSaving(self.top_k)
+        self.distinct_ips = HyperLogLog(self.hll_precision)
+        self.min_ts = None
+        self.max_ts = None
+        self.anomaly_logs = []  # (timestamp, line) of the earliest anomalies, in time order
+
+    def __len__(self):
+        return self.total_logs
+
+    def update(self, log, ts=None):
+        """Fold one (scored) processed log into the running aggregates; ``ts`` is its
+        timestamp in epoch nanoseconds, if already parsed"""
+        self.total_logs += 1
+
+        method = log.get("method")
+        self.method_counts[method] = self.method_counts.get(method, 0) + 1
+        status = log.get("status_code")
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        self.endpoints.add(log.get("url"))
+        self.distinct_ips.add(log.get("ip"))
+
+        if ts is None:
+            ts = to_epoch_ns(log.get("timestamp"))
+        if ts != NAT:
+            if self.min_ts is None or ts < self.min_ts:
+                self.min_ts = ts
+            if self.max_ts is None or ts > self.max_ts:
+                self.max_ts = ts
+
+        if log.get("anomaly") == -1:
+            self.anomaly_count += 1
+            # Keep the earliest ones, so the list doesn't depend on arrival order
+            if len(self.anomaly_logs) < self.max_anomaly_logs or ts < self.anomaly_logs[-1][0]:
+                when = format_epoch_ns(ts) if ts != NAT else "unknown time"
+                line = f"{when[:19]} - ANOMALY: {log.get('method')} {log.get('url')} {status}"
+                bisect.insort(self.anomaly_logs, (ts, line))
+                del self.anomaly_logs[self.max_anomaly_logs:]
+
+    def update_many(self, logs):
+        for log in logs:
+            self.update(log)
+
+    def snapshot(self):
+        """Summary dict for everything folded in since the last reset"""
+        if not self.total_logs:
+            return {"message": "No logs to summarize"}
+        anomaly_logs = [line for _, line in self.anomaly_logs]
+        if self.anomaly_count > len(anomaly_logs):
+            anomaly_logs.append(f"... {self.anomaly_count - len(anomaly_logs)} more anomalies not listed")
+        return {
+            "time_range_start": format_epoch_ns(self.min_ts) if self.min_ts is not None else None,
+            "time_range_end": format_epoch_ns(self.max_ts) if self.max_ts is not None else None,
+            "total_logs": self.total_logs,
+            "distinct_ips": self.distinct_ips.count(),
+            "anomaly_count": self.anomaly_count,
+            "top_endpoints": self.endpoints.top(self.top_n),
+            "method_counts": dict(sorted(self.method_counts.items(), key=lambda kv: kv[1], reverse=True)),
+            "status_counts": dict(sorted(self.status_counts.items(), key=lambda kv: kv[1], reverse=True)),
+            "anomaly_logs": anomaly_logs,
+        }
+
+    def state(self):
+        """Plain-data copy of the aggregates, for merging in another process"""
+        return {
+            "total_logs": self.total_logs,
+            "anomaly_count": self.anomaly_count,
+            "method_counts": dict(self.method_counts),
+            "status_counts": dict(self.status_counts),
+            "endpoints": dict(self.endpoints.counts),
+            "distinct_ips": self.distinct_ips.registers.tobytes(),
+            "min_ts": self.min_ts,
+            "max_ts": self.max_ts,
+            "anomaly_logs": list(self.anomaly_logs),
+        }
+
+    def take_state(self):
+        state = self.state()
+        self.reset()
+        return state
+
+    def merge(self, state):
+        """Fold in the aggregates of another interval or process (from ``state``)"""
+        self.total_logs += state["total_logs"]
+        self.anomaly_count += state["anomaly_count"]
+        for mine, theirs in ((self.method_counts, state["method_counts"]), (self.status_counts, state["status_counts"])):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.endpoints.merge(state["endpoints"])
+        self.distinct_ips.merge(np.frombuffer(state["distinct_ips"], dtype=np.uint8))
+        for ts in (state["min_ts"], state["max_ts"]):
+            if ts is not None:
+                self.min_ts = ts if self.min_ts is None else min(self.min_ts, ts)
+                self.max_ts = ts if self.max_ts is None else max(self.max_ts, ts)
+        self.anomaly_logs = sorted(self.anomaly_logs + [tuple(entry) for entry in state["anomaly_logs"]])
+        del self.anomaly_logs[self.max_anomaly_logs:]
+
+    def snapshot_and_reset(self):
+        summary = self.snapshot()
+        self.reset()
+        return summary
@@ -0,0 +1,592 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+from features import DEFAULT_TENANT
+from ring_buffer import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, RECORD_FIELDS, format_epoch_ns, to_epoch_ns
+
+logger = logging.getLogger(__name__)
+
+# Columns stored in every segment besides the ring buffer's
+ARCHIVE_COLUMNS = {
+    **NUMERIC_COLUMNS,
+    "seq": np.int64,  # storage sequence number, increasing across segments
+    "stored_at": np.int64,  # nanoseconds since the epoch (UTC)
+    "model_version": np.int32,  # -1 = not recorded
+}
+
+# Categorical columns added after segments were first written, and the value older segments read as
+_ADDED_COLUMNS = {"tenant": DEFAULT_TENANT}
+
+_PARTITION_FORMAT = "%Y%m%dT%H"  # one partition directory per UTC hour of stored_at
+
+def _partition_for(stored_at_ns):
+    return datetime.fromtimestamp(stored_at_ns // 1_000_000_000, tz=timezone.utc).strftime(_PARTITION_FORMAT)
+
+def _partition_start(partition):
+    return datetime.strptime(partition, _PARTITION_FORMAT).replace(tzinfo=timezone.utc)
+
+# === Column Cache ===
+class ColumnCache:
+    """The most recently used segment columns (memory maps) and dictionaries, at most
+    ``capacity`` of them, shared by all segments of an archive so the number of open maps
+    doesn't grow with the number of segments"""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # (segment path, key) -> column or dictionary
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, path, key, load):
+        with self._lock:
+            value = self._entries.get((path, key))
+            if value is not None:
+                self._entries.move_to_end((path, key))
+                self.hits += 1
+                return value
+        value = load()
+        with self._lock:
+            self.loads += 1
+            self._entries[(path, key)] = value
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return value
+
+    def discard(self, path):
+        """Forget a removed segment's columns, so its files' space is freed"""
+        with self._lock:
+            for entry in [entry for entry in self._entries if entry[0] == path]:
+                del self._entries[entry]
+
+    def stats(self):
+        return {"open": len(self._entries), "capacity": self.capacity, "hits": self.hits, "loads": self.loads}
+
+# === Segments ===
+class ArchiveSegment:
+    """One immutable, column-per-file segment; columns are memory-mapped when read and
+    kept open in ``cache`` (a ColumnCache) while they are among the most recently used"""
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.partition = os.path.basename(os.path.dirname(path))
+        _, first, last = os.path.basename(path).split("-")
+        self.first_seq = int(first)
+        self.last_seq = int(last)
+        self.cache = cache if cache is not None else ColumnCache()
+        self._length = None
+        self._sources = None
+
+    def __repr__(self):
+        return f"ArchiveSegment({self.partition}/{self.first_seq}-{self.last_seq})"
+
+    def column(self, name):
+        """Raw column: a read-only memory map (dictionary codes for categorical columns)"""
+        return self.cache.get(self.path, name, lambda: self._load_column(name))
+
+    def _load_column(self, name):
+        suffix = ".codes.npy" if name in CATEGORICAL_COLUMNS else ".npy"
+        try:
+            return np.load(os.path.join(self.path, name + suffix), mmap_mode="r")
+        except FileNotFoundError:
+            if not self._predates(name):
+                raise
+            return np.zeros(len(self), dtype=np.int32)
+
+    def _predates(self, name):
+        """Whether a missing column is one this (still existing) segment was written without"""
+        return name in _ADDED_COLUMNS and os.path.exists(os.path.join(self.path, "seq.npy"))
+
+    def values(self, name):
+        """Dictionary of a categorical column"""
+        return self.cache.get(self.path, f"{name}.values", lambda: self._load_values(name))
+
+    def _load_values(self, name):
+        try:
+            with open(os.path.join(self.path, f"{name}.values.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            if not self._predates(name):
+                raise
+            return [_ADDED_COLUMNS[name]]
+
+    def sources(self):
+        """Names of the segments compacted into this one (empty if it wasn't compacted)"""
+        if self._sources is None:
+            try:
+                with open(os.path.join(self.path, "sources.json")) as f:
+                    self._sources = frozenset(json.load(f))
+            except FileNotFoundError:
+                self._sources = frozenset()
+        return self._sources
+
+    def __len__(self):
+        if self._length is None:
+            self._length = len(self.column("seq"))
+        return self._length
+
+    def decoded(self, name, rows=slice(None)):
+        """Column values for ``rows`` as a list, categorical codes decoded"""
+        if name in CATEGORICAL_COLUMNS:
+            values = self.values(name)
+            return [values[code] for code in self.column(name)[rows].tolist()]
+        return self.column(name)[rows].tolist()
+
+    def to_records(self, rows):
+        """Log dicts for the given row indices, in the order given"""
+        rows = np.asarray(rows, dtype=np.intp)
+        fields = {name: self.decoded(name, rows) for name in RECORD_FIELDS}
+        fields["timestamp"] = [format_epoch_ns(ns) for ns in fields["timestamp"]]
+        anomaly = self.decoded("anomaly", rows)
+        anomaly_score = self.decoded("anomaly_score", rows)
+        model_version = self.decoded("model_version", rows)
+        stored_at = self.decoded("stored_at", rows)
+        seq = self.decoded("seq", rows)
+
+        records = []
+        for i in range(len(rows)):
+            record = {name: fields[name][i] for name in RECORD_FIELDS}
+            if anomaly[i]:
+                record["anomaly"] = anomaly[i]
+                record["anomaly_score"] = anomaly_score[i]
+            record["model_version"] = model_version[i] if model_version[i] >= 0 else None
+            record["stored_at"] = format_epoch_ns(stored_at[i])
+            record["seq"] = seq[i]
+            records.append(record)
+        return records
+
+def _segment_name(seq):
+    return f"seg-{int(seq[0]):012d}-{int(seq[-1]):012d}"
+
+def _write_segment(partition_dir, columns, categorical, sources=None, cache=None):
+    """Write columns to a new segment directory, atomically renamed into place; ``sources``
+    names the segments a compacted one replaces"""
+    name = _segment_name(columns["seq"])
+    tmp_path = os.path.join(partition_dir, f".tmp-{name}-{os.getpid()}-{threading.get_ident()}")
+    os.makedirs(tmp_path)
+    for column, array in columns.items():
+        np.save(os.path.join(tmp_path, f"{column}.npy"), np.ascontiguousarray(array))
+    for column, (codes, values) in categorical.items():
+        np.save(os.path.join(tmp_path, f"{column}.codes.npy"), codes)
+        with open(os.path.join(tmp_path, f"{column}.values.json"), "w") as f:
+            json.dump(values, f, separators=(",", ":"))
+    if sources:
+        with open(os.path.join(tmp_path, "sources.json"), "w") as f:
+            json.dump(sources, f)
+    path = os.path.join(partition_dir, name)
+    os.rename(tmp_path, path)
+    return ArchiveSegment(path, cache)
+
+def _writer_alive(tmp_name):
+    """Whether the process that is writing ``.tmp-<segment>-<pid>-<thread>`` still runs"""
+    try:
+        pid = int(tmp_name.rsplit("-", 2)[1])
+        os.kill(pid, 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return pid != os.getpid()
+
+def dictionary_encode(values):
+    """``(codes, dictionary)`` for a categorical column: int32 codes into its distinct values"""
+    codes = {}
+    encoded = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int32, count=len(values))
+    return encoded, list(codes)
+
+# === Log Archive ===
+class LogArchive:
+    """Durable, append-only log archive partitioned by the hour logs were stored.
+
+    Every ``append`` writes one immutable segment: a directory with one ``.npy`` file
+    per column (categorical columns as int32 codes plus a JSON dictionary). Reads
+    memory-map only the columns they touch, and at most ``open_columns`` stay mapped, so
+    resident memory does not grow with the amount of history kept. ``compact`` merges
+    the segments of closed hours into one, and those of the open hour into segments of
+    up to ``segment_rows`` logs; ``enforce_retention`` drops whole hours once they are
+    older than the TTL.
+    """
+
+    def __init__(self, root, retention_hours=168, segment_rows=65_536, open_columns=1024):
+        self.root = root
+        self.retention_hours = retention_hours
+        self.segment_rows = segment_rows
+        self.cache = ColumnCache(open_columns)
+        self._lock = threading.Lock()
+        self._hidden = set()  # paths this process is writing or removing, skipped by refresh
+        self._writer_fd = None
+        self.last_compaction = None
+        self.last_retention = None
+        os.makedirs(root, exist_ok=True)
+        self._segments = self._scan()
+        logger.info(f"Log archive at {root}: {len(self._segments)} segments, "
+                    f"up to seq {self.last_seq}")
+
+    def _scan(self, cleanup=True):
+        """Load the segment list, cleaning up after writes or compactions that were interrupted"""
+        segments = []
+        for partition in sorted(os.listdir(self.root)):
+            partition_dir = os.path.join(self.root, partition)
+            if not os.path.isdir(partition_dir):
+                continue
+            found = []
+            for name in os.listdir(partition_dir):
+                path = os.path.join(partition_dir, name)
+                if name.startswith(".tmp-"):
+                    if cleanup and not _writer_alive(name):  # other workers may be writing to the archive
+                        shutil.rmtree(path, ignore_errors=True)
+                elif name.startswith("seg-"):
+                    found.append(ArchiveSegment(path, self.cache))
+            # A crash between writing a compacted segment and removing its inputs leaves
+            # both behind: drop inputs the compacted segment lists as merged. A segment
+            # inside another's seq range that it doesn't list holds other rows (seqs were
+            # handed out twice), so it is kept.
+            found.sort(key=lambda s: (s.first_seq, -s.last_seq))
+            widest = None
+            for segment in found:
+                if widest is not None and segment.last_seq <= widest.last_seq:
+                    if os.path.basename(segment.path) in widest.sources():
+                        if cleanup:
+                            shutil.rmtree(segment.path, ignore_errors=True)
+                        continue
+                    if cleanup:
+                        logger.warning(f"Archive segment {segment} overlaps {widest} without being merged "
+                                       f"into it; keeping both, their seqs are not unique")
+                else:
+                    widest = segment
+                segments.append(segment)
+        segments.sort(key=lambda s: s.first_seq)
+        return segments
+
+    def lock_writers(self, shared=False):
+        """Register this process as a writer of the archive for its lifetime.
+
+        Seqs must be unique across everything written to the archive. A process numbering
+        logs with its own counter needs the archive to itself; processes that reserve seqs
+        from one shared counter (``shared``, a SharedState) may write side by side. Raises
+        RuntimeError if another process holds the archive in a way that conflicts.
+        """
+        if self._writer_fd is not None:
+            return
+        if fcntl is None:
+            logger.warning("Can't lock the log archive without fcntl (POSIX); "
+                           "don't run a backfill while the server runs")
+            return
+        fd = os.open(os.path.join(self.root, "writers.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise RuntimeError(
+                f"The log archive {self.root} is in use by another process (a server or a backfill); "
+                f"stop it first, or give both the same SHARED_STATE_DIR so they share one seq counter"
+            )
+        self._writer_fd = fd
+
+    @property
+    def last_seq(self):
+        return self._segments[-1].last_seq if self._segments else 0
+
+    def append(self, logs, seqs, stored_at):
+        """Write scored logs stored at ``stored_at`` (naive times are UTC) as one new segment;
+        ``seqs`` must be increasing"""
+        if not logs:
+            return None
+        columns = {
+            "timestamp": np.fromiter((to_epoch_ns(log.get("timestamp")) for log in logs), dtype=np.int64, count=len(logs)),
+            "model_version": np.array(
+                [-1 if log.get("model_version") is None else log["model_version"] for log in logs], dtype=np.int32
+            ),
+        }
+        for name in ("status_code", "bytes_sent", "url_length", "url_depth",
+                     "num_encoded_chars", "num_special_chars", "anomaly"):
+            columns[name] = np.array([log.get(name) or 0 for log in logs], dtype=NUMERIC_COLUMNS[name])
+        columns["anomaly_score"] = np.array(
+            [np.nan if log.get("anomaly_score") is None else log["anomaly_score"] for log in logs], dtype=np.float64
+        )
+        categorical = {name: dictionary_encode([log.get(name) for log in logs]) for name in CATEGORICAL_COLUMNS}
+        return self.append_columns(columns, categorical, seqs, stored_at)
+
+    def append_columns(self, columns, categorical, seqs, stored_at):
+        """``append`` for logs that are already columns: NumPy arrays for the numeric
+        columns (timestamps as epoch nanoseconds) and ``dictionary_encode`` pairs for the
+        categorical ones"""
+        if not len(seqs):
+            return None
+        stored_at_ns = to_epoch_ns(stored_at)
+        columns = {name: np.asarray(values, dtype=ARCHIVE_COLUMNS[name]) for name, values in columns.items()}
+        columns["seq"] = np.asarray(seqs, dtype=np.int64)
+        columns["stored_at"] = np.full(len(seqs), stored_at_ns, dtype=np.int64)
+
+        partition_dir = os.path.join(self.root, _partition_for(stored_at_ns))
+        os.makedirs(partition_dir, exist_ok=True)
+        path = self._hide(os.path.join(partition_dir, _segment_name(columns["seq"])))
+        try:
+            segment = _write_segment(partition_dir, columns, categorical, cache=self.cache)
+            with self._lock:
+                # Workers sharing the archive write their segments out of seq order
+                bisect.insort(self._segments, segment, key=lambda s: s.first_seq)
+        finally:
+            self._unhide(path)
+        return segment
+
+    def _hide(self, *paths):
+        with self._lock:
+            self._hidden.update(paths)
+        return paths[0] if len(paths) == 1 else paths
+
+    def _unhide(self, *paths):
+        with self._lock:
+            self._hidden.difference_update(paths)
+
+    def segments(self):
+        with self._lock:
+            return list(self._segments)
+
+    def refresh(self):
+        """Pick up segments other processes wrote or compacted since the last scan.
+
+        Returns ``(added, dropped)`` segment lists; rows of an added segment that fall in
+        a dropped one's seq range were known already (it is their compacted copy).
+        """
+        found = self._scan(cleanup=False)
+        with self._lock:
+            known = {segment.path: segment for segment in self._segments}
+            # Segments this process is adding or removing right now keep their current state, and
+            # the scan ran unlocked, so a change it disagrees with is confirmed on disk
+            found_paths = {segment.path for segment in found}
+            current = [
+                known.get(segment.path, segment) for segment in found
+                if segment.path not in self._hidden and (segment.path in known or os.path.isdir(segment.path))
+            ]
+            current += [
+                segment for segment in self._segments
+                if segment.path in self._hidden or (segment.path not in found_paths and os.path.isdir(segment.path))
+            ]
+            current.sort(key=lambda s: s.first_seq)
+            paths = {segment.path for segment in current}
+            added = [segment for segment in current if segment.path not in known]
+            dropped = [segment for segment in self._segments if segment.path not in paths]
+            self._segments = current
+        for segment in dropped:
+            self.cache.discard(segment.path)
+        return added, dropped
+
+    def page(self, limit=100, before=None, anomaly_only=False, tenant=None):
+        """Newest-first page of archived logs with ``seq < before`` (only ``tenant``'s if given).
+
+        Returns ``(records, next_cursor)``; ``next_cursor`` is None on the last page.
+        """
+        for attempt in range(3):
+            try:
+                return self._page(limit, before, anomaly_only, tenant)
+            except FileNotFoundError:
+                # A compaction replaced a segment while we were reading, retry on the new list
+                if attempt == 2:
+                    raise
+
+    def _page(self, limit, before, anomaly_only, tenant):
+        records = []
+        wanted = limit + 1  # one extra row tells whether there is another page
+        for segment in reversed(self.segments()):
+            if before is not None and segment.first_seq >= before:
+                continue
+            mask = None
+            if before is not None and segment.last_seq >= before:
+                mask = segment.column("seq") < before
+            if anomaly_only:
+                anomalous = segment.column("anomaly") == -1
+                mask = anomalous if mask is None else mask & anomalous
+            if tenant is not None:
+                values = segment.values("tenant")
+                owned = np.isin(segment.column("tenant"), [code for code, value in enumerate(values) if value == tenant])
+                mask = owned if mask is None else mask & owned
+            rows = np.flatnonzero(mask) if mask is not None else np.arange(len(segment))
+            rows = rows[::-1][:wanted - len(records)]
+            if len(rows):
+                records.extend(segment.to_records(rows))
+            if len(records) >= wanted:
+                break
+        has_more = len(records) > limit
+        records = records[:limit]
+        return records, records[-1]["seq"] if has_more else None
+
+    def lookup(self, seqs):
+        """Records for the given seqs, in the order given; seqs no longer archived are skipped"""
+        for attempt in range(3):
+            try:
+                return self._lookup(seqs)
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def _lookup(self, seqs):
+        seqs = np.asarray(seqs, dtype=np.int64)
+        segments = self.segments()
+        if not len(seqs) or not segments:
+            return []
+        first_seqs = np.array([segment.first_seq for segment in segments], dtype=np.int64)
+        owners = np.searchsorted(first_seqs, seqs, side="right") - 1
+        found = {}
+        for owner in np.unique(owners[owners >= 0]).tolist():
+            segment = segments[owner]
+            wanted = seqs[owners == owner]
+            segment_seqs = segment.column("seq")
+            rows = np.minimum(np.searchsorted(segment_seqs, wanted), len(segment_seqs) - 1)
+            hit = segment_seqs[rows] == wanted
+            for record in segment.to_records(rows[hit]):
+                found[record["seq"]] = record
+        return [found[seq] for seq in seqs.tolist() if seq in found]
+
+    # === Compaction ===
+    def compact(self, now=None):
+        """Merge each closed hour's segments into one, and runs of the open hour's small
+        segments into segments of up to ``segment_rows`` logs; returns the number of
+        segments written"""
+        current = _partition_for(time.time_ns() if now is None else to_epoch_ns(now))
+        by_partition = {}
+        for segment in self.segments():
+            by_partition.setdefault(segment.partition, []).append(segment)
+
+        compacted = 0
+        for partition, segments in sorted(by_partition.items()):
+            if partition >= current:
+                for run in self._open_runs(segments):
+                    self._replace(partition, run)
+                    compacted += 1
+                continue
+            if len(segments) < 2:
+                continue
+            if any(b.first_seq <= a.last_seq for a, b in zip(segments, segments[1:])):
+                logger.warning(f"Not compacting archive partition {partition}: its segments' seqs overlap")
+                continue
+            self._replace(partition, segments)
+            compacted += 1
+        self.last_compaction = datetime.now()
+        return compacted
+
+    def _open_runs(self, segments):
+        """Runs of two or more consecutive segments of an hour still being written that are
+        smaller than ``segment_rows`` and together no larger. Seqs must follow on without a
+        gap: a missing seq may belong to a batch another worker hasn't written yet."""
+        runs, run, rows = [], [], 0
+        for segment in segments:
+            size = len(segment)
+            follows = run and segment.first_seq == run[-1].last_seq + 1 and rows + size <= self.segment_rows
+            if not follows:
+                runs.append(run)
+                run, rows = [], 0
+            if size < self.segment_rows:
+                run.append(segment)
+                rows += size
+        runs.append(run)
+        return [run for run in runs if len(run) >= 2]
+
+    def _replace(self, partition, segments):
+        """Write ``segments`` (seq ordered) as one merged segment and remove them"""
+        merged_path = os.path.join(self.root, partition, _segment_name([segments[0].first_seq, segments[-1].last_seq]))
+        removed = [segment.path for segment in segments]
+        self._hide(merged_path, *removed)
+        try:
+            merged = self._merge(partition, segments)
+            with self._lock:
+                replaced = {id(segment) for segment in segments}
+                self._segments = sorted(
+                    [s for s in self._segments if id(s) not in replaced] + [merged],
+                    key=lambda s: s.first_seq,
+                )
+            for segment in segments:
+                shutil.rmtree(segment.path, ignore_errors=True)
+                self.cache.discard(segment.path)
+        finally:
+            self._unhide(merged_path, *removed)
+        logger.info(f"Compacted {len(segments)} archive segments of {partition} ({len(merged)} logs)")
+        return merged
+
+    def _merge(self, partition, segments):
+        columns = {
+            name: np.concatenate([segment.column(name) for segment in segments])
+            for name in ARCHIVE_COLUMNS
+        }
+        categorical = {
+            name: dictionary_encode([value for segment in segments for value in segment.decoded(name)])
+            for name in CATEGORICAL_COLUMNS
+        }
+        return _write_segment(os.path.join(self.root, partition), columns, categorical,
+                              sources=[os.path.basename(segment.path) for segment in segments], cache=self.cache)
+
+    # === Retention ===
+    def enforce_retention(self, now=None):
+        """Drop hours older than the retention period; returns the highest seq dropped (or None)"""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(hours=self.retention_hours)
+        with self._lock:
+            expired = [s for s in self._segments if _partition_start(s.partition) + timedelta(hours=1) <= cutoff]
+            if not expired:
+                self.last_retention = datetime.now()
+                return None
+            self._segments = [s for s in self._segments if s not in expired]
+            self._hidden.update(segment.path for segment in expired)
+        for segment in expired:
+            self.cache.discard(segment.path)
+        for partition in sorted({segment.partition for segment in expired}):
+            shutil.rmtree(os.path.join(self.root, partition), ignore_errors=True)
+            logger.info(f"Dropped archive partition {partition} (older than {self.retention_hours}h)")
+        self._unhide(*(segment.path for segment in expired))
+        self.last_retention = datetime.now()
+        return max(segment.last_seq for segment in expired)
+
+    async def run_maintenance(self, interval_minutes, on_expired=None, compact_seconds=None):
+        """Apply retention every ``interval_minutes`` and compact every ``compact_seconds``
+        (by default with retention); ``on_expired(seq)`` runs in a thread with the highest
+        seq dropped, so other stores can expire the same logs"""
+        interval = interval_minutes * 60
+        step = min(interval, compact_seconds) if compact_seconds else interval
+        last_retention = time.monotonic()
+        while True:
+            await asyncio.sleep(step)
+            try:
+                await asyncio.to_thread(self.compact)
+                if time.monotonic() - last_retention >= interval - step / 2:
+                    last_retention = time.monotonic()
+                    expired_seq = await asyncio.to_thread(self.enforce_retention)
+                    if expired_seq is not None and on_expired is not None:
+                        await asyncio.to_thread(on_expired, expired_seq)
+            except Exception as e:
+                logger.error(f"Archive maintenance failed: {e}", exc_info=True)
+
+    def stats(self):
+        segments = self.segments()
+        disk_bytes = 0
+        for segment in segments:
+            try:
+                disk_bytes += sum(entry.stat().st_size for entry in os.scandir(segment.path))
+            except FileNotFoundError:
+                pass
+        return {
+            "partitions": len({segment.partition for segment in segments}),
+            "segments": len(segments),
+            "first_seq": segments[0].first_seq if segments else None,
+            "last_seq": segments[-1].last_seq if segments else None,
+            "disk_bytes": disk_bytes,
+            "segment_rows": self.segment_rows,
+            "column_cache": self.cache.stats(),
+            "retention_hours": self.retention_hours,
+            "last_compaction": self.last_compaction.isoformat() if self.last_compaction else None,
+            "last_retention": self.last_retention.isoformat() if self.last_retention else None,
+        }
@@ -0,0 +1,210 @@
+"""Backfill historical Nginx/Apache access logs (common or combined format) into the log store.
+
+Files are memory-mapped and split at line boundaries into chunks that a process pool
+parses, featurizes and scores with the current anomaly model; each scored chunk is
+written to the archive as one segment and indexed, keeping the logs' own timestamps.
+Live summaries, the in-memory buffer and refit samples are left alone.
+
+Every log needs a seq no other log in the archive has. A single server numbers its logs
+itself, so the backfill refuses to run while one uses the archive (and a server won't
+start during a backfill); with ``SHARED_STATE_DIR`` set for both, they reserve seqs from
+the same counter and can run side by side. A ``--chroma`` backfill without an archive
+has no such check: stop the server first.
+
+Run from the server directory, with the same environment as the server:
+
+    python backfill.py /var/log/nginx/access.log [more files] [--workers 8] [--chunk-mb 64] [--chroma]
+"""
+import argparse
+import collections
+import logging
+import mmap
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from archive import dictionary_encode
+from features import DEFAULT_TENANT, prepare_access_log_batch, tenant_id
+from ring_buffer import CATEGORICAL_COLUMNS, to_epoch_ns
+from scoring import MODEL_FEATURES, feature_matrix, load_model, make_scorer
+
+logger = logging.getLogger(__name__)
+
+# Logs per ChromaDB add() when --chroma is given
+CHROMA_BATCH_SIZE = 5000
+
+# === File Splitting ===
+def split_file(path, chunk_bytes):
+    """(start, end) byte ranges of about ``chunk_bytes`` covering the file, cut after newlines"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(size, start + chunk_bytes)
+            if end < size:
+                newline = mm.find(b"\n", end)
+                end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+# === Worker ===
+_worker_model = (None, None)  # (version, scorer), loaded once per worker process
+
+def timestamps_to_epoch_ns(timestamps):
+    """Epoch nanoseconds for ISO timestamps, vectorized for the "...T..:..:..+HH:MM" shape
+    the access-log parser produces; repeated timestamps are converted once"""
+    unique = list(set(timestamps))
+    out = np.empty(len(unique), dtype=np.int64)
+    try:
+        local = np.array([ts[:19] for ts in unique], dtype="datetime64[s]").astype(np.int64)
+        offsets = np.array(
+            [(int(ts[20:22]) * 3600 + int(ts[23:25]) * 60) * (-1 if ts[19] == "-" else 1) for ts in unique],
+            dtype=np.int64,
+        )
+        out[:] = (local - offsets) * 1_000_000_000
+    except (ValueError, IndexError):
+        out[:] = [to_epoch_ns(ts) for ts in unique]  # odd shapes, one at a time
+    epoch_ns = dict(zip(unique, out.tolist()))
+    return np.fromiter(map(epoch_ns.__getitem__, timestamps), dtype=np.int64, count=len(timestamps))
+
+def import_range(path, start, end, model_version, model_path, keep_records=False, tenant=DEFAULT_TENANT):
+    """Parse, featurize and score one byte range of an access-log file.
+
+    Categorical columns come back dictionary-encoded, which makes the result far
+    cheaper to send to the parent; the raw values are kept only when ``keep_records``.
+    """
+    global _worker_model
+    if _worker_model[0] != model_version:
+        _worker_model = (model_version, make_scorer(load_model(model_path)))
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8", "replace")
+    columns, skipped = prepare_access_log_batch(text, tenant)
+    del text
+    if columns["url"]:
+        labels, scores = _worker_model[1].score(feature_matrix(columns))
+    else:
+        labels, scores = np.zeros(0, dtype=np.int8), np.zeros(0)
+    columns["timestamp_ns"] = timestamps_to_epoch_ns(columns["timestamp"])
+    columns["anomaly"] = labels
+    columns["anomaly_score"] = scores
+    columns["encoded"] = {name: dictionary_encode(columns[name]) for name in CATEGORICAL_COLUMNS}
+    if not keep_records:
+        for name in ("timestamp", *CATEGORICAL_COLUMNS):
+            del columns[name]
+    return columns, skipped, end - start
+
+# === Import ===
+def _chroma_records(columns, model_version):
+    names = ("timestamp", "ip", "method", "url", "protocol", "user_agent", "tenant")
+    numeric = {name: columns[name].tolist() for name in (
+        "status_code", "bytes_sent", "url_length", "url_depth", "num_encoded_chars",
+        "num_special_chars", "anomaly", "anomaly_score")}
+    return [
+        {**{name: columns[name][i] for name in names},
+         **{name: values[i] for name, values in numeric.items()},
+         "model_version": model_version}
+        for i in range(len(columns["timestamp_ns"]))
+    ]
+
+def store_chunk(server, columns, model_version, stored_at, chroma):
+    """Write one scored chunk to the archive (one segment) and optionally ChromaDB"""
+    n = len(columns["timestamp_ns"])
+    if n == 0:
+        return
+    seqs = server.log_sequence.reserve(n)
+    if server.log_archive is not None:
+        numeric = {
+            "timestamp": columns["timestamp_ns"],
+            "model_version": np.full(n, model_version, dtype=np.int32),
+            **{name: columns[name] for name in (
+                "status_code", "bytes_sent", "url_length", "url_depth",
+                "num_encoded_chars", "num_special_chars", "anomaly", "anomaly_score")},
+        }
+        segment = server.log_archive.append_columns(numeric, columns["encoded"], seqs, stored_at)
+        server.log_index.add_segment(segment)
+    if chroma:
+        records = _chroma_records(columns, model_version)
+        for i in range(0, n, CHROMA_BATCH_SIZE):
+            server.store_logs_in_chromadb(records[i:i + CHROMA_BATCH_SIZE], seqs[i:i + CHROMA_BATCH_SIZE], stored_at)
+
+def run_backfill(server, paths, workers, chunk_bytes, chroma=False, tenant=DEFAULT_TENANT):
+    """Import ``paths`` in file order as ``tenant``'s logs; returns (logs stored, lines skipped)"""
+    model = server.model_manager.current
+    stored_at = datetime.now(timezone.utc)
+    jobs = [(path, start, end) for path in paths for start, end in split_file(path, chunk_bytes)]
+    total_bytes = sum(end - start for _, start, end in jobs)
+    stored = skipped = done_bytes = 0
+    started = time.perf_counter()
+    logger.info(f"Backfilling {total_bytes / 2**20:.0f} MiB from {len(paths)} files in {len(jobs)} chunks "
+                f"with {workers} workers (model v{model.version})")
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # A bounded window of chunks in flight, consumed in submission order so seqs follow file order
+        in_flight = collections.deque()
+        jobs = iter(jobs)
+        while True:
+            while len(in_flight) < 2 * workers:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                in_flight.append(pool.submit(import_range, *job, model.version, model.path, chroma, tenant))
+            if not in_flight:
+                break
+            columns, chunk_skipped, chunk_bytes_done = in_flight.popleft().result()
+            store_chunk(server, columns, model.version, stored_at, chroma)
+            stored += len(columns["timestamp_ns"])
+            skipped += chunk_skipped
+            done_bytes += chunk_bytes_done
+            elapsed = time.perf_counter() - started
+            logger.info(f"{done_bytes / total_bytes:6.1%}  {stored:,} logs stored, {skipped:,} lines skipped, "
+                        f"{done_bytes / 2**20 / elapsed:.1f} MiB/s")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return stored, skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="access-log files, imported in the order given")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-mb", type=float, default=64, help="bytes of log parsed per task")
+    parser.add_argument("--chroma", action="store_true",
+                        help="also add the logs to ChromaDB (slow: every log is embedded); needs CHROMA_PERSIST_DIR")
+    parser.add_argument("--api-key", help="API key of the tenant the logs belong to (default: no tenant)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    import main as server  # the server's stores and model, set up from the environment
+
+    if args.chroma and not (server.CHROMA_PERSIST_DIR or server.CHROMA_HOST):
+        parser.error("--chroma needs CHROMA_PERSIST_DIR or CHROMA_HOST, an in-memory ChromaDB is gone when the backfill exits")
+    if server.log_archive is None and not args.chroma:
+        parser.error("the archive is disabled (ARCHIVE_DIR is empty), pass --chroma to store in ChromaDB")
+
+    if server.log_archive is not None:
+        try:
+            server.lock_archive()
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    if server.model_manager.current.scorer.model.n_features_in_ > len(MODEL_FEATURES):
+        parser.error("the current model uses streaming window features (FEATURE_STORE_MODEL), "
+                     "which can't be computed for historical logs")
+
+    started = time.perf_counter()
+    stored, skipped = run_backfill(
+        server, args.paths, args.workers, int(args.chunk_mb * 2**20), args.chroma, tenant_id(args.api_key)
+    )
+    logger.info(f"Backfilled {stored:,} logs ({skipped:,} lines skipped) in {time.perf_counter() - started:.1f}s")
+    server.model_manager.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# === Micro-Batcher ===
+class MicroBatcher:
+    """Coalesces individually submitted items from any number of callers into batches.
+
+    A batch is cut when it reaches ``max_batch_size`` or when ``max_wait_ms`` has passed
+    since its first item. The wait is adaptive: while recent batches held a single item
+    (light traffic) items are dispatched immediately, so batching only adds latency when
+    there is concurrent traffic to gain from it. Items that arrive while a batch is being
+    processed are picked up by the next one. ``process_batch`` receives a list of items
+    and must return a list of results in the same order.
+    """
+
+    def __init__(self, process_batch, max_batch_size=256, max_wait_ms=5.0,
+                 max_queue=10_000, max_concurrent_batches=2):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue = None
+        self._runner = None
+        self._slots = None
+        self._batch = []  # batch being collected, kept here so stop() can still flush it
+        self._avg_batch_size = 1.0
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self):
+        if self._runner is None or self._runner.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._runner = asyncio.create_task(self._run())
+
+    async def submit(self, item):
+        """Queue an item and return a future for its result.
+
+        Only waits when the queue is full, so callers can keep reading input and
+        await the returned future separately.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return future
+
+    async def _collect(self):
+        batch = self._batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        wait = self.max_wait if self._avg_batch_size > 1.5 else 0
+        deadline = loop.time() + wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._avg_batch_size = 0.8 * self._avg_batch_size + 0.2 * len(batch)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            await self._slots.acquire()
+            self._batch = []
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            items = [item for item, _ in batch]
+            try:
+                results = await self.process_batch(items)
+            except Exception as e:
+                logger.error(f"Micro-batch of {len(items)} items failed: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.batches += 1
+            self.items += len(items)
+        finally:
+            self._slots.release()
+
+    async def stop(self):
+        """Dispatch whatever is still queued, then stop collecting"""
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        pending, self._batch = self._batch, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for start in range(0, len(pending), self.max_batch_size):
+            await self._slots.acquire()
+            await self._dispatch(pending[start:start + self.max_batch_size])
+        # Wait for batches that were already running
+        for _ in range(self.max_concurrent_batches):
+            await self._slots.acquire()
+        self._runner = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+        }
@@ -0,0 +1,88 @@
+"""Broadcast fan-out with slow and stuck subscribers.
+
+Connects fake WebSockets (most fast, a few slow, one that never finishes a send) and
+times ``ConnectionManager.broadcast`` against the old loop that awaited ``send_json`` on
+each connection in turn.
+
+Run from the server directory:
+
+    python benchmarks/bench_broadcast.py [--clients 1000] [--slow 10] [--broadcasts 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from broadcast import ConnectionManager  # noqa: E402
+
+class FakeWebSocket:
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def send_json(self, message):
+        await self.send_text(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+def make_clients(args):
+    clients = [FakeWebSocket(0) for _ in range(args.clients - args.slow - 1)]
+    clients += [FakeWebSocket(args.slow_ms / 1000) for _ in range(args.slow)]
+    clients.append(FakeWebSocket(3600))  # stuck
+    return clients
+
+def summary(i):
+    return {"type": "summary", "data": {"window": i, "endpoints": {f"/api/{n}": n for n in range(200)}}}
+
+async def sequential(args):
+    clients = make_clients(args)
+    start = time.perf_counter()
+    for i in range(args.broadcasts):
+        for client in clients[:-1]:  # the stuck client would block forever
+            await client.send_json(summary(i))
+    return (time.perf_counter() - start) / args.broadcasts
+
+async def fan_out(args):
+    manager = ConnectionManager(max_queue=args.queue, policy=args.policy)
+    clients = make_clients(args)
+    for n, client in enumerate(clients):
+        await manager.connect(client, str(n))
+    elapsed = 0.0
+    for i in range(args.broadcasts):
+        start = time.perf_counter()
+        await manager.broadcast(summary(i))
+        elapsed += time.perf_counter() - start
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.slow_ms / 1000 * 2)
+    fast = sum(c.received for c in clients[:-args.slow - 1]) / (len(clients) - args.slow - 1)
+    print(f"fast clients received {fast:.0f}/{args.broadcasts} broadcasts")
+    print({k: v for k, v in manager.stats().items()})
+    await manager.stop()
+    return elapsed / args.broadcasts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1_000)
+    parser.add_argument("--slow", type=int, default=10, help="clients taking --slow-ms per send")
+    parser.add_argument("--slow-ms", type=float, default=50.0)
+    parser.add_argument("--broadcasts", type=int, default=50)
+    parser.add_argument("--queue", type=int, default=64)
+    parser.add_argument("--policy", default="coalesce")
+    args = parser.parse_args()
+
+    per_broadcast = asyncio.run(fan_out(args))
+    print(f"fan-out: {per_broadcast * 1000:.2f} ms per broadcast")
+    per_broadcast = asyncio.run(sequential(args))
+    print(f"sequential send_json (stuck client skipped): {per_broadcast * 1000:.2f} ms per broadcast")
+
+if __name__ == "__main__":
+    main()
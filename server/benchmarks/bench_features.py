@@ -0,0 +1,70 @@
+"""Per-log cost of row-by-row vs batch feature extraction.
+
+Run from the server directory:
+
+    python benchmarks/bench_features.py [--sizes 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from features import (  # noqa: E402
+    feature_columns_to_records,
+    prepare_log_features,
+    prepare_log_features_batch,
+)
+
+PATHS = ["/", "/api/users", "/api/users/42", "/get/1", "/search", "/static/app.js", "/login"]
+QUERIES = ["", "?q=hello%20world", "?ids=1,2,3", "?a=1;b=2", "?x=%3Cscript%3E|%27", "?next=%2Fhome"]
+
+def make_logs(n, seed=0):
+    """Synthetic logs shaped like the ones the logger middleware sends"""
+    rng = random.Random(seed)
+    logs = []
+    for i in range(n):
+        url = rng.choice(PATHS) + rng.choice(QUERIES)
+        logs.append({
+            "ip": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}",
+            "timestamp": f"2025-04-27T10:{i // 60 % 60:02d}:{i % 60:02d}.000Z",
+            "method": rng.choice(["GET", "GET", "GET", "POST", "PUT", "DELETE"]),
+            "url": url,
+            "protocol": "http",
+            "statusCode": rng.choice([200, 200, 200, 201, 304, 404, 500]),
+            "bytesSent": str(rng.randrange(50_000)),
+            "userAgent": "Mozilla/5.0 (X11; Linux x86_64)",
+        })
+    return logs
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'batch size':>10} {'per-row us/log':>15} {'batch us/log':>13} {'speedup':>8}")
+    for size in args.sizes:
+        logs = make_logs(size)
+
+        # Both paths must agree on every row before the timing means anything
+        expected = [prepare_log_features(log) for log in logs]
+        actual = feature_columns_to_records(prepare_log_features_batch(logs))
+        assert actual == expected, "batch feature extraction differs from prepare_log_features"
+
+        per_row = best_of(args.repeat, lambda: [prepare_log_features(log) for log in logs])
+        batch = best_of(args.repeat, prepare_log_features_batch, logs)
+        print(f"{size:>10} {per_row / size * 1e6:>15.2f} {batch / size * 1e6:>13.2f} {per_row / batch:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
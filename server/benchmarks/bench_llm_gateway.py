@@ -0,0 +1,82 @@
+"""Load test of the LLM gateway against the local stub backend.
+
+Fires concurrent chat-style requests drawn from a small set of distinct questions and
+reports throughput, cache/coalescing counts and how long the event loop was stalled
+(which stays near zero because completions are awaited, never blocked on).
+
+Run from the server directory:
+
+    python benchmarks/bench_llm_gateway.py [--requests 2000] [--concurrency 200] [--distinct 20]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from llm_gateway import LLMGateway, StubBackend  # noqa: E402
+
+async def loop_lag(stop, samples, interval=0.005):
+    """Record how late the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+async def run(args):
+    backend = StubBackend(latency_ms=args.latency_ms)
+    gateway = LLMGateway(
+        backend,
+        max_concurrency=args.max_concurrency,
+        timeout_seconds=args.timeout,
+        cache_ttl_seconds=args.cache_ttl,
+    )
+    rng = random.Random(0)
+    questions = [f"What happened to endpoint /api/{i}?" for i in range(args.distinct)]
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one():
+        async with slots:
+            start = time.perf_counter()
+            question = rng.choice(questions)
+            try:
+                await gateway.complete(f"prompt for {question}", cache_key=(question, 1))
+            except asyncio.TimeoutError:
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    lag = []
+    lag_task = asyncio.create_task(loop_lag(stop, lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+
+    latencies.sort()
+    print(f"{args.requests} requests in {elapsed:.2f}s ({args.requests / elapsed:.0f} req/s), "
+          f"{backend.calls} backend calls")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"event loop lag max {max(lag) * 1000:.1f} ms")
+    print(gateway.stats())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20, help="distinct questions asked")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="stub completion latency")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="gateway completion slots")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--cache-ttl", type=float, default=300.0)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Scoring cost of sklearn predict + decision_function vs the fused ForestScorer.
+
+Run from the server directory:
+
+    python benchmarks/bench_scoring.py [--sizes 1 10 100 1000 10000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from bench_features import best_of, make_logs  # noqa: E402
+from features import prepare_log_features_batch  # noqa: E402
+from scoring import MODEL_FEATURES, ForestScorer, feature_matrix, load_model  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(__file__), "..", "models", "anamoly_Isolation_forest.pkl")
+
+def sklearn_scores(model, X):
+    """What detect_anomalies used to do: two passes over the forest"""
+    return model.predict(X), model.decision_function(X)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--fit", type=int, default=0, metavar="N",
+                        help="score with a fresh model fitted on N synthetic logs instead of --model")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.fit:
+        from sklearn.ensemble import IsolationForest
+        model = IsolationForest(contamination=0.01, random_state=0)
+        model.fit(feature_matrix(prepare_log_features_batch(make_logs(args.fit, seed=1))))
+    else:
+        model = load_model(args.model)
+    start = time.perf_counter()
+    scorer = ForestScorer(model)
+    print(f"flattened {len(model.estimators_)} trees ({len(scorer.feature)} nodes) "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print(f"{'batch size':>10} {'sklearn ms':>11} {'fused ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        columns = prepare_log_features_batch(make_logs(size))
+        X = feature_matrix(columns)
+        frame = pd.DataFrame(columns)[MODEL_FEATURES]
+
+        # Labels and scores must be identical before the timing means anything
+        expected_labels, expected_scores = sklearn_scores(model, frame)
+        labels, scores = scorer.score(X)
+        assert np.array_equal(labels, expected_labels), "labels differ from sklearn"
+        assert np.array_equal(scores, expected_scores), "scores differ from sklearn"
+
+        legacy = best_of(args.repeat, sklearn_scores, model, frame)
+        fused = best_of(args.repeat, scorer.score, X)
+        print(f"{size:>10} {legacy * 1000:>11.2f} {fused * 1000:>9.2f} {legacy / fused:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Cost of encoding scored batch replies: the old recursive timestamp walk plus
+``json.dumps`` versus ``serialization.dumps`` for each response profile.
+
+Run from the server directory:
+
+    python benchmarks/bench_serialization.py [--sizes 100 1000 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_features import make_logs  # noqa: E402
+from features import feature_columns_to_records, prepare_log_features_batch  # noqa: E402
+from scoring import attach_scores  # noqa: E402
+from serialization import RESPONSE_PROFILES, dumps, scored_batch_payload  # noqa: E402
+
+def convert_timestamps_to_iso(obj):
+    """The walk every reply used to go through before being encoded"""
+    if isinstance(obj, dict):
+        return {key: convert_timestamps_to_iso(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_timestamps_to_iso(item) for item in obj]
+    elif isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    elif hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return obj
+
+def old_reply(scored):
+    """Batch reply as /ws/application built it before response profiles"""
+    logs = []
+    for scored_log in scored:
+        log = dict(scored_log)
+        log["is_anomaly"] = log.pop("anomaly", 0) == -1
+        logs.append(log)
+    payload = convert_timestamps_to_iso({
+        "type": "logs_received",
+        "logs": logs,
+        "total_logs": len(logs),
+        "anomalies_detected": sum(1 for log in logs if log["is_anomaly"]),
+    })
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def new_reply(scored, profile):
+    return dumps({"type": "logs_received", **scored_batch_payload(scored, profile)})
+
+def scored_batch(n):
+    records = feature_columns_to_records(prepare_log_features_batch(make_logs(n)))
+    rng = np.random.default_rng(0)
+    labels = np.where(rng.random(n) < 0.05, -1, 1)
+    return attach_scores(records, labels, rng.normal(size=n), model_version=3)
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, len(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        scored = scored_batch(n)
+        seconds, size = best_of(lambda: old_reply(scored), args.repeat)
+        print(f"{n:>7} logs  old walk + json.dumps   {seconds * 1000:8.2f} ms  {size / 1024:9.1f} KiB")
+        for profile in RESPONSE_PROFILES:
+            seconds, size = best_of(lambda: new_reply(scored, profile), args.repeat)
+            print(f"{n:>7} logs  dumps, {profile:<9}        {seconds * 1000:8.2f} ms  {size / 1024:9.1f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import PIPELINE_STAGE_SECONDS, timed
+from serialization import dumps_text
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_POLICIES = ("drop_oldest", "coalesce")
+
+# === Subscriber ===
+class Subscriber:
+    """One connection's bounded outbound queue, drained by its own writer task.
+
+    ``offer`` never waits: when the queue is full the oldest message is dropped, and
+    with the ``coalesce`` policy a queued message of the same type is replaced by the
+    newer one first, so a slow dashboard only ever falls behind to the latest state.
+    """
+
+    def __init__(self, websocket, client_id=None, max_queue=64, policy="coalesce", tenant=None):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.tenant = tenant
+        self.max_queue = max_queue
+        self.policy = policy
+        self._queue = deque()  # (coalesce key, text, enqueued_at)
+        self._ready = asyncio.Event()
+        self._writer = None
+        self._sending_since = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self, on_failure):
+        self._writer = asyncio.create_task(self._run(on_failure))
+
+    def offer(self, text, key=None):
+        if self.closed:
+            return
+        if self.policy == "coalesce" and key is not None:
+            for i, (queued_key, _, _) in enumerate(self._queue):
+                if queued_key == key:
+                    del self._queue[i]
+                    self.coalesced += 1
+                    break
+        if len(self._queue) >= self.max_queue:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append((key, text, time.monotonic()))
+        self._ready.set()
+
+    async def _run(self, on_failure):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._queue:
+                _, text, enqueued_at = self._queue.popleft()
+                self._sending_since = time.monotonic()
+                try:
+                    await self.websocket.send_text(text)
+                except Exception as e:
+                    logger.debug(f"Broadcast to client {self.client_id} failed, dropping it: {e}")
+                    self.closed = True
+                    on_failure(self.websocket)
+                    return
+                finally:
+                    self._sending_since = None
+                self.sent += 1
+                self.last_lag = time.monotonic() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+
+    def close(self):
+        self.closed = True
+        self._queue.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    def stats(self):
+        return {
+            "client_id": self.client_id,
+            "tenant": self.tenant,
+            "queued": len(self),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalled_ms": round((time.monotonic() - self._sending_since) * 1000, 1) if self._sending_since else 0.0,
+        }
+
+# === Connected Clients Manager ===
+class ConnectionManager:
+    """Fans broadcasts out to every connected WebSocket without waiting on any of them.
+
+    ``broadcast`` serializes the message once and hands the text to each subscriber's
+    queue; delivery happens in the subscribers' writer tasks, so its cost does not
+    depend on how slow the slowest client is. A client that authenticated as a tenant
+    only gets that tenant's broadcasts; the others get the untenanted ones.
+    """
+
+    def __init__(self, max_queue=64, policy="coalesce"):
+        if policy not in BROADCAST_POLICIES:
+            raise ValueError(f"Unknown broadcast policy {policy!r}, expected one of {BROADCAST_POLICIES}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.active_connections = {}  # websocket -> Subscriber
+        self.broadcasts = 0
+        self.disconnected = 0
+
+    async def connect(self, websocket, client_id=None, tenant=None):
+        await websocket.accept()
+        subscriber = Subscriber(websocket, client_id, max_queue=self.max_queue, policy=self.policy, tenant=tenant)
+        self.active_connections[websocket] = subscriber
+        subscriber.start(self.disconnect)
+
+    def set_tenant(self, websocket, tenant):
+        subscriber = self.active_connections.get(websocket)
+        if subscriber is not None:
+            subscriber.tenant = tenant
+
+    def disconnect(self, websocket):
+        subscriber = self.active_connections.pop(websocket, None)
+        if subscriber is not None:
+            subscriber.close()
+            self.disconnected += 1
+
+    @timed(PIPELINE_STAGE_SECONDS.labels("broadcast"))
+    async def broadcast(self, message: dict, tenant=None):
+        text = dumps_text(message)
+        key = message.get("type")
+        for subscriber in list(self.active_connections.values()):
+            if subscriber.tenant == tenant:
+                subscriber.offer(text, key)
+        self.broadcasts += 1
+
+    async def stop(self):
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+
+    def stats(self, per_client=False):
+        subscribers = list(self.active_connections.values())
+        stats = {
+            "connections": len(subscribers),
+            "policy": self.policy,
+            "broadcasts": self.broadcasts,
+            "queued": sum(len(s) for s in subscribers),
+            "dropped": sum(s.dropped for s in subscribers),
+            "max_lag_ms": round(max((s.max_lag for s in subscribers), default=0.0) * 1000, 1),
+            "disconnected": self.disconnected,
+        }
+        if per_client:
+            stats["clients"] = [s.stats() for s in subscribers]
+        return stats
@@ -0,0 +1,201 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from serialization import dumps_text
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMATS = ("text", "json")
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Records at or above this level are never rate limited
+UNLIMITED_LEVEL = logging.ERROR
+
+# LogRecord attributes that aren't ``extra=`` fields
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+# === Formatters ===
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, ``extra=`` fields, and
+    the traceback if any"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return dumps_text(entry)
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+
+class TextFormatter(logging.Formatter):
+    """The usual text format, noting how many records from the same line were suppressed"""
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar suppressed)" if suppressed else text
+
+def parse_level(level):
+    """A level name (any case) or number as the number logging uses"""
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f"Unknown log level {level!r}")
+    return number
+
+def make_formatter(fmt):
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {fmt!r}, expected one of {LOG_FORMATS}")
+    return JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+
+# === Hot-Path Sampling ===
+class RateLimitFilter(logging.Filter):
+    """Lets through at most ``per_second`` records per second from each logging call
+    site (module and line), below ERROR; the next record let through carries the number
+    suppressed meanwhile. A per-message log line at full ingest rate costs a dict lookup
+    instead of a formatted write. ``per_second`` 0 lets everything through."""
+
+    def __init__(self, per_second=10):
+        super().__init__()
+        self.per_second = per_second
+        self._sites = {}  # (pathname, lineno) -> [second, count, suppressed]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.per_second or record.levelno >= UNLIMITED_LEVEL:
+            return True
+        second = int(record.created)
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self._sites[(record.pathname, record.lineno)] = [second, 0, 0]
+        if site[0] != second:
+            site[0], site[1] = second, 0
+        if site[1] >= self.per_second:
+            site[2] += 1
+            self.suppressed += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.suppressed, site[2] = site[2], 0
+        return True
+
+# === Non-Blocking Handler ===
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a bounded queue for a writer thread, never waiting: when the
+    writer falls behind, new records are dropped and counted instead. Formatting (message
+    arguments included) happens on the writer thread, off the event loop, so arguments
+    must not be changed after the logging call."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# === Runtime Control ===
+class LoggingControl:
+    """The process's logging pipeline (rate limit filter -> queue -> writer thread ->
+    stream) and the knobs changed at runtime through ``configure``"""
+
+    def __init__(self, level="INFO", fmt="text", rate_limit_per_second=10, queue_size=10_000, stream=None):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter(rate_limit_per_second)
+        self.handler.addFilter(self.rate_limit)
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.format = fmt
+        self.output.setFormatter(make_formatter(fmt))
+        self.listener = logging.handlers.QueueListener(self.queue, self.output)
+        self._lock = threading.Lock()
+        self._running = False
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(parse_level(level))
+
+    def start(self):
+        with self._lock:
+            self.listener.start()
+            self._running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Write out what is queued and stop the writer thread; later records are
+        written directly"""
+        with self._lock:
+            if self._running:
+                self.listener.stop()
+                self._running = False
+                root = logging.getLogger()
+                root.removeHandler(self.handler)
+                self.output.addFilter(self.rate_limit)
+                root.addHandler(self.output)
+
+    def configure(self, level=None, loggers=None, fmt=None, rate_limit_per_second=None):
+        """Change levels (root, or per logger name; None resets one to the root's),
+        output format or rate limit; nothing changes if any value is invalid"""
+        formatter = make_formatter(fmt) if fmt is not None else None
+        level = parse_level(level) if level is not None else None
+        loggers = {
+            name: parse_level(logger_level) if logger_level is not None else logging.NOTSET
+            for name, logger_level in (loggers or {}).items()
+        }
+        if rate_limit_per_second is not None and rate_limit_per_second < 0:
+            raise ValueError("rate_limit_per_second can't be negative")
+        if formatter is not None:
+            self.output.setFormatter(formatter)
+            self.format = fmt
+        if level is not None:
+            logging.getLogger().setLevel(level)
+        for name, logger_level in loggers.items():
+            logging.getLogger(name).setLevel(logger_level)
+        if rate_limit_per_second is not None:
+            self.rate_limit.per_second = rate_limit_per_second
+        logger.info("Logging configured: %s", self.stats())
+
+    def stats(self):
+        levels = {
+            name: logging.getLevelName(named.level)
+            for name, named in list(logging.Logger.manager.loggerDict.items())
+            if isinstance(named, logging.Logger) and named.level != logging.NOTSET
+        }
+        return {
+            "level": logging.getLevelName(logging.getLogger().level),
+            "loggers": levels,
+            "format": self.format,
+            "rate_limit_per_second": self.rate_limit.per_second,
+            "queued": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_limit.suppressed,
+        }
+
+def configure_logging(level="INFO", fmt="text", rate_limit_per_second=10, queue_size=10_000):
+    """Route the root logger through a LoggingControl, unless logging is already set up
+    (like ``logging.basicConfig``, so a script importing the server keeps its own);
+    returns it, or None"""
+    if logging.getLogger().handlers:
+        return None
+    control = LoggingControl(level, fmt, rate_limit_per_second, queue_size)
+    control.start()
+    return control
@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sliding windows the statistics are kept over, in seconds
+FEATURE_WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+# Fields with per-key rolling statistics
+FEATURE_KEYS = ("ip", "url", "user_agent")
+# Statistics per key and window
+FEATURE_STATS = ("requests", "error_ratio", "bytes")
+# Every window feature, named <field>_<stat>_<window>, e.g. ip_requests_1m
+WINDOW_FEATURES = tuple(
+    f"{field}_{stat}_{window}" for field in FEATURE_KEYS for stat in FEATURE_STATS for window in FEATURE_WINDOWS
+)
+# The window features joined onto scored logs, and appended to the model's inputs
+# when refits are allowed to use them
+JOINED_WINDOW_FEATURES = (
+    "ip_requests_1m", "ip_error_ratio_1m", "ip_requests_15m", "ip_error_ratio_15m",
+    "url_error_ratio_5m", "user_agent_requests_5m",
+)
+
+# === Rolling Counters ===
+class RollingCounters:
+    """Request, error and byte counts per key of one field over sliding windows.
+
+    Time is cut into buckets of ``bucket_seconds``. Each key owns one row of a fixed
+    ``(max_keys, buckets)`` ring per statistic, and running totals per window are kept
+    next to the rings, so recording a log and reading a key's totals are both O(1).
+    When time moves into a new bucket, the bucket leaving each window is subtracted
+    from the totals and its ring column is cleared, for all keys in one array
+    operation. A new key beyond ``max_keys`` takes the row of the least recently seen,
+    but never one already used by the same batch: a batch with more than ``max_keys``
+    distinct keys leaves the rest untracked (row -1), their statistics covering only
+    that batch.
+    """
+
+    def __init__(self, windows=FEATURE_WINDOWS, bucket_seconds=15, max_keys=10_000):
+        self.bucket_seconds = bucket_seconds
+        self.max_keys = max_keys
+        self.spans = {name: max(1, round(seconds / bucket_seconds)) for name, seconds in windows.items()}
+        self.n_buckets = max(self.spans.values())
+        shape = (max_keys, self.n_buckets)
+        self.requests = np.zeros(shape, dtype=np.uint32)
+        self.errors = np.zeros(shape, dtype=np.uint32)
+        self.bytes = np.zeros(shape, dtype=np.float64)
+        # window -> (requests, errors, bytes) totals by row
+        self.totals = {name: np.zeros((3, max_keys), dtype=np.float64) for name in self.spans}
+        self.rows = OrderedDict()  # key -> row, least recently seen first
+        self._free = list(range(max_keys - 1, -1, -1))
+        self.bucket = None
+        self.evicted = 0
+        self.untracked = 0
+        self._batch = 0
+        self._row_batch = np.zeros(max_keys, dtype=np.int64)  # last batch that used each row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def nbytes(self):
+        return (self.requests.nbytes + self.errors.nbytes + self.bytes.nbytes
+                + sum(totals.nbytes for totals in self.totals.values()))
+
+    def advance(self, now):
+        """Move the current bucket up to ``now``, expiring what falls out of each window"""
+        bucket = int(now // self.bucket_seconds)
+        if self.bucket is None or bucket >= self.bucket + self.n_buckets:
+            for array in (self.requests, self.errors, self.bytes, *self.totals.values()):
+                array.fill(0)
+        else:
+            for b in range(self.bucket + 1, bucket + 1):
+                for name, span in self.spans.items():
+                    leaving = (b - span) % self.n_buckets
+                    totals = self.totals[name]
+                    totals[0] -= self.requests[:, leaving]
+                    totals[1] -= self.errors[:, leaving]
+                    totals[2] -= self.bytes[:, leaving]
+                column = b % self.n_buckets
+                for ring in (self.requests, self.errors, self.bytes):
+                    ring[:, column] = 0
+        if self.bucket is None or bucket > self.bucket:
+            self.bucket = bucket
+
+    def _row_for(self, key):
+        row = self.rows.get(key)
+        if row is not None:
+            self.rows.move_to_end(key)
+            self._row_batch[row] = self._batch
+            return row
+        if self._free:
+            row = self._free.pop()
+        else:
+            # Rows of this batch were all moved to the end, so if the least recently seen
+            # one is from this batch, every row is
+            oldest = self.rows[next(iter(self.rows))]
+            if self._row_batch[oldest] == self._batch:
+                self.untracked += 1
+                return -1
+            _, row = self.rows.popitem(last=False)
+            for array in (self.requests, self.errors, self.bytes):
+                array[row] = 0
+            for totals in self.totals.values():
+                totals[:, row] = 0
+            self.evicted += 1
+        self.rows[key] = row
+        self._row_batch[row] = self._batch
+        return row
+
+    def record(self, keys, errors, nbytes):
+        """Count one batch in the current bucket; returns the row of each log's key (-1
+        if untracked) and the batch's own (requests, errors, bytes) for each log"""
+        self._batch += 1
+        positions = {}
+        inverse = np.fromiter(
+            (positions.setdefault(key, len(positions)) for key in keys), dtype=np.intp, count=len(keys)
+        )
+        rows = np.fromiter(map(self._row_for, positions), dtype=np.intp, count=len(positions))
+        requests = np.bincount(inverse, minlength=len(rows)).astype(np.float64)
+        error_counts = np.bincount(inverse, weights=errors, minlength=len(rows))
+        byte_counts = np.bincount(inverse, weights=nbytes, minlength=len(rows))
+
+        tracked = rows >= 0
+        column = self.bucket % self.n_buckets
+        tracked_rows = rows[tracked]
+        np.add.at(self.requests[:, column], tracked_rows, requests[tracked].astype(np.uint32))
+        np.add.at(self.errors[:, column], tracked_rows, error_counts[tracked].astype(np.uint32))
+        np.add.at(self.bytes[:, column], tracked_rows, byte_counts[tracked])
+        for totals in self.totals.values():
+            np.add.at(totals[0], tracked_rows, requests[tracked])
+            np.add.at(totals[1], tracked_rows, error_counts[tracked])
+            np.add.at(totals[2], tracked_rows, byte_counts[tracked])
+        own = np.stack([requests, error_counts, byte_counts])[:, inverse]
+        return rows[inverse], own
+
+    def window_stats(self, rows, window, own=None):
+        """(requests, error ratio, bytes) over ``window`` for each row; untracked rows (-1)
+        take their batch's own counts from ``own``"""
+        requests, errors, nbytes = self.totals[window][:, rows]
+        if own is not None and (rows < 0).any():
+            requests, errors, nbytes = np.where(rows < 0, own, (requests, errors, nbytes))
+        return requests, errors / np.maximum(requests, 1), nbytes
+
+# === Feature Store ===
+class FeatureStore:
+    """Streaming per-IP, per-URL and per-user-agent behaviour features.
+
+    ``update`` counts a batch of logs and returns, for each log, the request count, error
+    ratio (4xx/5xx) and bytes of its IP, URL and user agent over the last 1, 5 and 15
+    minutes, this batch included, as columns named like ``ip_requests_1m``. Cost follows
+    the batch, never the history, and memory is fixed by ``max_keys`` per field.
+    """
+
+    def __init__(self, bucket_seconds=15, max_keys=10_000, windows=FEATURE_WINDOWS, clock=time.time):
+        self.windows = windows
+        self.clock = clock
+        self.counters = {field: RollingCounters(windows, bucket_seconds, max_keys) for field in FEATURE_KEYS}
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.logs = 0
+
+    def update(self, logs_data):
+        """Count a batch (feature records or columns) and return its window feature columns"""
+        if isinstance(logs_data, dict):
+            keys = {field: logs_data[field] for field in FEATURE_KEYS}
+            status = np.asarray(logs_data["status_code"], dtype=np.int64)
+            nbytes = np.asarray(logs_data["bytes_sent"], dtype=np.float64)
+        else:
+            keys = {field: [log.get(field) for log in logs_data] for field in FEATURE_KEYS}
+            status = np.fromiter((log.get("status_code") or 0 for log in logs_data), dtype=np.int64, count=len(logs_data))
+            nbytes = np.fromiter((log.get("bytes_sent") or 0 for log in logs_data), dtype=np.float64, count=len(logs_data))
+        errors = (status >= 400).astype(np.float64)
+
+        columns = {}
+        now = self.clock()
+        with self._lock:
+            for field, counters in self.counters.items():
+                counters.advance(now)
+                rows, own = counters.record(keys[field], errors, nbytes)
+                for window in self.windows:
+                    requests, error_ratio, window_bytes = counters.window_stats(rows, window, own)
+                    columns[f"{field}_requests_{window}"] = requests.astype(np.float32)
+                    columns[f"{field}_error_ratio_{window}"] = error_ratio.astype(np.float32)
+                    columns[f"{field}_bytes_{window}"] = window_bytes.astype(np.float32)
+            self.updates += 1
+            self.logs += len(status)
+        return columns
+
+    def lookup(self, field, key):
+        """Current window statistics of one key, or None if it is not tracked"""
+        counters = self.counters[field]
+        with self._lock:
+            counters.advance(self.clock())
+            row = counters.rows.get(key)
+            if row is None:
+                return None
+            stats = {}
+            for window in self.windows:
+                requests, error_ratio, window_bytes = counters.window_stats(np.array([row]), window)
+                stats[window] = {
+                    "requests": int(requests[0]),
+                    "error_ratio": round(float(error_ratio[0]), 4),
+                    "bytes": int(window_bytes[0]),
+                }
+            return stats
+
+    def stats(self):
+        return {
+            "windows": list(self.windows),
+            "updates": self.updates,
+            "logs": self.logs,
+            "keys": {field: len(counters) for field, counters in self.counters.items()},
+            "evicted": {field: counters.evicted for field, counters in self.counters.items()},
+            "untracked": {field: counters.untracked for field, counters in self.counters.items()},
+            "max_keys": next(iter(self.counters.values())).max_keys,
+            "memory_bytes": sum(counters.nbytes() for counters in self.counters.values()),
+        }
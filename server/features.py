@@ -0,0 +1,254 @@
+import hashlib
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from metrics import PIPELINE_STAGE_SECONDS, timed
+
+# Columns produced by the feature extraction, in record order
+FEATURE_FIELDS = (
+    "timestamp", "ip", "method", "url", "protocol", "status_code", "bytes_sent",
+    "user_agent", "url_length", "url_depth", "num_encoded_chars", "num_special_chars", "tenant",
+)
+
+# Tenant of logs sent without an API key
+DEFAULT_TENANT = "default"
+
+# Code points used by the vectorized URL features
+_PERCENT, _SLASH = ord("%"), ord("/")
+_SPECIAL = np.array([ord(c) for c in "|,;"], dtype=np.uint32)
+
+# Normalized spelling of field names seen so far (bounded, field names are few)
+_NORMALIZED_KEYS = {}
+
+# Nginx/Apache access-log line in the "common" format, optionally followed by the
+# "combined" format's referer and user agent. Quoted fields may contain \" escapes
+# (matched as runs of plain characters between escapes, which keeps the regex fast).
+ACCESS_LOG_PATTERN = re.compile(
+    r'^(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<url>\S+)(?: (?P<protocol>[^"\s]+))?" '
+    r'(?P<status>\d{3}) (?P<bytes>\d+|-)'
+    r'(?: "[^"\\]*(?:\\.[^"\\]*)*" "(?P<agent>[^"\\]*(?:\\.[^"\\]*)*)")?',
+    re.MULTILINE,
+)
+_BLANK_LINE = re.compile(r"^[ \t\r]*$", re.MULTILINE)
+_MONTHS = {name: f"{i:02d}" for i, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1)}
+
+# === Tenants ===
+@lru_cache(maxsize=4096)
+def tenant_id(api_key):
+    """Stable id of the tenant an API key belongs to: a hash, so keys are never stored"""
+    if not api_key:
+        return DEFAULT_TENANT
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()[:16]
+
+def _tenant_of(get, default_tenant):
+    api_key = get("apikey") or get("api_key")
+    return tenant_id(str(api_key)) if api_key else default_tenant
+
+# === Feature Engineering Functions ===
+def _normalize_key(key):
+    normalized = key.lower().replace(" ", "_")
+    if len(_NORMALIZED_KEYS) < 1024:
+        _NORMALIZED_KEYS[key] = normalized
+    return normalized
+
+def access_log_time_to_iso(value):
+    """"10/Oct/2000:13:55:36 -0700" -> "2000-10-10T13:55:36-07:00" (unchanged if not that shape)"""
+    month = _MONTHS.get(value[3:6])
+    if month is None or len(value) != 26:
+        return value
+    return f"{value[7:11]}-{month}-{value[0:2]}T{value[12:20]}{value[21:24]}:{value[24:26]}"
+
+def parse_access_log_line(line):
+    """Raw log dict for one common/combined access-log line, or None if it isn't one"""
+    match = ACCESS_LOG_PATTERN.match(line.strip())
+    if match is None:
+        return None
+    ip, time, method, url, protocol, status, size, agent = match.groups()
+    return {
+        "ip": ip,
+        "timestamp": access_log_time_to_iso(time),
+        "method": method,
+        "url": url,
+        "protocol": protocol or "HTTP/1.0",
+        "status_code": int(status),
+        "bytes_sent": 0 if size == "-" else int(size),
+        "user_agent": agent or "unknown",
+    }
+
+def _parse_raw_log(log_dict):
+    """Turn a raw log (dict, JSON string or access-log line) into a dict"""
+    if isinstance(log_dict, str):
+        try:
+            log_dict = json.loads(log_dict)
+        except:
+            # Not JSON: an access-log line keeps its fields, anything else is kept raw
+            log_dict = parse_access_log_line(log_dict) or {
+                "raw": log_dict,
+                "timestamp": datetime.now().isoformat()
+            }
+    return log_dict
+
+@timed(PIPELINE_STAGE_SECONDS.labels("prepare_features"))
+def prepare_log_features(log_dict, default_tenant=DEFAULT_TENANT):
+    """Extract and engineer features from a log entry; the tenant comes from its ``apiKey``
+    field, or is ``default_tenant``"""
+
+    # Handle different possible structures in the log data
+    log_dict = _parse_raw_log(log_dict)
+
+    # Normalize field names (handle both camelCase and snake_case)
+    normalized = {}
+    for k, v in log_dict.items():
+        key = k.lower().replace(" ", "_")
+        normalized[key] = v
+
+    # Create a feature dict with all relevant fields
+    features = {
+        "timestamp": normalized.get("timestamp", datetime.now().isoformat()),
+        "ip": normalized.get("ip", "unknown"),
+        "method": normalized.get("method", "GET"),
+        "url": normalized.get("url", normalized.get("originalurl", "/")),
+        "protocol": normalized.get("protocol", "HTTP/1.1"),
+        "status_code": int(normalized.get("statuscode", normalized.get("status_code", 200))),
+        "bytes_sent": int(normalized.get("bytessent", normalized.get("bytes_sent", 0))),
+        "user_agent": normalized.get("useragent", normalized.get("user_agent", "unknown")),
+    }
+
+    # Add engineered features
+    features["url_length"] = len(features["url"])
+    features["url_depth"] = features["url"].count("/")
+    features["num_encoded_chars"] = len(re.findall(r'%[0-9A-Fa-f]{2}', features["url"]))
+    features["num_special_chars"] = len(re.findall(r'[|,;]', features["url"]))
+    features["tenant"] = _tenant_of(normalized.get, default_tenant)
+
+    return features
+
+def _url_feature_columns(urls):
+    """Compute the URL features for many URLs at once.
+
+    All URLs are joined into one UTF-32 buffer so each character is one uint32
+    code point; the per-character masks are then summed per URL with a single
+    cumulative sum. Matches the regexes in ``prepare_log_features`` exactly.
+    """
+    n = len(urls)
+    lengths = np.fromiter(map(len, urls), dtype=np.int64, count=n)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return lengths, empty, empty, empty
+
+    # Separators/padding are NUL, which is neither hex, "%", "/" nor special
+    joined = "\0".join(urls) + "\0\0"
+    codes = np.frombuffer(joined.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    starts = np.zeros(n, dtype=np.int64)
+    np.cumsum(lengths[:-1] + 1, out=starts[1:])
+    ends = starts + lengths
+
+    def count_per_url(mask):
+        totals = np.zeros(len(mask) + 1, dtype=np.int64)
+        np.cumsum(mask, out=totals[1:])
+        return totals[ends] - totals[starts]
+
+    is_hex = (
+        ((codes >= ord("0")) & (codes <= ord("9")))
+        | ((codes >= ord("A")) & (codes <= ord("F")))
+        | ((codes >= ord("a")) & (codes <= ord("f")))
+    )
+    # "%" can't be a hex digit, so "%XX" matches never overlap and can be counted by their start
+    encoded = (codes[:-2] == _PERCENT) & is_hex[1:-1] & is_hex[2:]
+
+    url_depth = count_per_url(codes == _SLASH)
+    num_encoded_chars = count_per_url(encoded)
+    num_special_chars = count_per_url(np.isin(codes, _SPECIAL))
+    return lengths, url_depth, num_encoded_chars, num_special_chars
+
+@timed(PIPELINE_STAGE_SECONDS.labels("prepare_features"))
+def prepare_log_features_batch(raw_logs, default_tenant=DEFAULT_TENANT):
+    """Extract features for a batch of raw logs in one pass.
+
+    Returns a dict of columns (lists for string fields, NumPy arrays for numeric
+    ones) holding the same values ``prepare_log_features`` gives row by row.
+    """
+    now = datetime.now().isoformat()
+    cached_key = _NORMALIZED_KEYS.get
+    timestamps, ips, methods, urls, protocols = [], [], [], [], []
+    status_codes, bytes_sent, user_agents, tenants = [], [], [], []
+
+    for log_dict in raw_logs:
+        log_dict = _parse_raw_log(log_dict)
+        normalized = {(cached_key(k) or _normalize_key(k)): v for k, v in log_dict.items()}
+        get = normalized.get
+        timestamps.append(get("timestamp", now))
+        ips.append(get("ip", "unknown"))
+        methods.append(get("method", "GET"))
+        urls.append(get("url", get("originalurl", "/")))
+        protocols.append(get("protocol", "HTTP/1.1"))
+        status_codes.append(int(get("statuscode", get("status_code", 200))))
+        bytes_sent.append(int(get("bytessent", get("bytes_sent", 0))))
+        user_agents.append(get("useragent", get("user_agent", "unknown")))
+        tenants.append(_tenant_of(get, default_tenant))
+
+    url_length, url_depth, num_encoded_chars, num_special_chars = _url_feature_columns(urls)
+    return {
+        "timestamp": timestamps,
+        "ip": ips,
+        "method": methods,
+        "url": urls,
+        "protocol": protocols,
+        "status_code": np.array(status_codes, dtype=np.int64),
+        "bytes_sent": np.array(bytes_sent, dtype=np.int64),
+        "user_agent": user_agents,
+        "url_length": url_length,
+        "url_depth": url_depth,
+        "num_encoded_chars": num_encoded_chars,
+        "num_special_chars": num_special_chars,
+        "tenant": tenants,
+    }
+
+def prepare_access_log_batch(text, tenant=DEFAULT_TENANT):
+    """Feature columns, like ``prepare_log_features_batch``, for every common/combined
+    access-log line in ``text``, matched in one scan. Returns ``(columns, skipped)`` where
+    ``skipped`` counts the non-empty lines that did not parse."""
+    rows = ACCESS_LOG_PATTERN.findall(text)
+    skipped = text.count("\n") + (1 if text and not text.endswith("\n") else 0) - len(rows)
+    if skipped:  # telling blank lines from bad ones costs a scan, only pay it when needed
+        skipped -= len(_BLANK_LINE.findall(text)) - (1 if not text or text.endswith("\n") else 0)
+    ips, times, methods, urls, protocols, statuses, sizes, agents = zip(*rows) if rows else ((),) * 8
+    del rows
+    # Timestamps and status codes repeat a lot, so each distinct value is converted once
+    iso_times = {time: access_log_time_to_iso(time) for time in set(times)}
+    status_codes = {status: int(status) for status in set(statuses)}
+    url_length, url_depth, num_encoded_chars, num_special_chars = _url_feature_columns(urls)
+    return {
+        "timestamp": [iso_times[time] for time in times],
+        "ip": ips,
+        "method": methods,
+        "url": urls,
+        "protocol": [protocol or "HTTP/1.0" for protocol in protocols],
+        "status_code": np.fromiter(map(status_codes.__getitem__, statuses), dtype=np.int64, count=len(statuses)),
+        "bytes_sent": np.fromiter((0 if size == "-" else int(size) for size in sizes), dtype=np.int64, count=len(sizes)),
+        "user_agent": [agent or "unknown" for agent in agents],
+        "url_length": url_length,
+        "url_depth": url_depth,
+        "num_encoded_chars": num_encoded_chars,
+        "num_special_chars": num_special_chars,
+        "tenant": [tenant] * len(urls),
+    }, skipped
+
+def select_rows(columns, positions):
+    """The rows at ``positions`` of a dict of feature columns, as a dict of columns"""
+    return {
+        name: col[positions] if isinstance(col, np.ndarray) else [col[i] for i in positions]
+        for name, col in columns.items()
+    }
+
+def feature_columns_to_records(columns):
+    """Turn a dict of feature columns back into a list of per-log dicts"""
+    names = list(columns)
+    values = [col.tolist() if isinstance(col, np.ndarray) else col for col in columns.values()]
+    return [dict(zip(names, row)) for row in zip(*values)]
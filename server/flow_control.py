@@ -0,0 +1,179 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SHED_POLICIES = ("reject", "sample", "degrade")
+
+# === Flow Windows ===
+class FlowWindow:
+    """Credit state of one ingest connection.
+
+    ``credits`` is how many more logs the client may send; it is spent as frames arrive
+    and handed back (in grants of at least ``grant_step``) as admitted logs finish
+    processing, so a client that honours it never has more than ``window`` logs in flight.
+    """
+
+    def __init__(self, client_id, window):
+        self.client_id = client_id
+        self.window = window
+        self.grant_step = max(1, window // 4)
+        self.credits = window
+        self.outstanding = 0  # admitted logs not processed yet
+        self.returned = 0  # released credits not granted to the client yet
+
+    def grant_message(self, credits=None):
+        return {"type": "flow", "credits": self.window if credits is None else credits, "window": self.window}
+
+class Admission:
+    """What to do with one received frame: which logs to process, whether to store them
+    and what was shed"""
+
+    __slots__ = ("keep", "store", "shed_action", "shed_count")
+
+    def __init__(self, keep, store=True, shed_action=None, shed_count=0):
+        self.keep = keep  # indices of the frame's logs to process
+        self.store = store
+        self.shed_action = shed_action
+        self.shed_count = shed_count
+
+# === Ingest Limiter ===
+class IngestLimiter:
+    """Credit-based flow control and explicit load shedding for log ingestion.
+
+    Admitted-but-unprocessed logs across all connections are capped at ``max_pending``.
+    A frame is shed when it exceeds its connection's credits or arrives while ingestion
+    is saturated (pending logs above ``shed_threshold`` of the cap, or ``pressure()``
+    reporting a downstream backlog), according to ``policy``:
+
+    - ``reject``: none of its logs are processed
+    - ``sample``: one in every ``1 / sample_rate`` of its logs is processed
+    - ``degrade``: its logs are scored and summarized but not stored
+
+    Frames that would push pending logs past the cap are rejected whatever the policy,
+    so memory use stays bounded.
+    """
+
+    def __init__(self, max_pending=10_000, credit_window=512, policy="degrade",
+                 shed_threshold=0.8, sample_rate=0.1, pressure=None):
+        if policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shed policy {policy!r}, expected one of {SHED_POLICIES}")
+        self.max_pending = max_pending
+        self.credit_window = credit_window
+        self.policy = policy
+        self.shed_threshold = shed_threshold
+        self.sample_step = max(1, round(1 / sample_rate)) if sample_rate > 0 else None
+        self.pressure = pressure
+        self.pending = 0
+        self.windows = {}
+        self._sample_counter = 0
+        self.admitted = 0
+        self.processed = 0
+        self.over_credit = 0
+        self.rejected = 0
+        self.sampled_out = 0
+        self.degraded = 0
+        self.last_shed = None
+        self._rate = 0.0  # processed logs per second, smoothed
+        self._released_at = None
+
+    def open(self, client_id):
+        window = self.windows[client_id] = FlowWindow(client_id, self.credit_window)
+        return window
+
+    def close(self, window):
+        self.windows.pop(window.client_id, None)
+        # Logs still being processed release their pending slots when they finish
+
+    def saturated(self, incoming=0):
+        if self.pending + incoming > self.max_pending * self.shed_threshold:
+            return True
+        return self.pressure is not None and self.pressure()
+
+    def admit(self, window, count):
+        """Decide how a frame of ``count`` logs from ``window``'s client is handled"""
+        over_credit = count > window.credits
+        window.credits = max(0, window.credits - count)
+        if over_credit:
+            self.over_credit += 1
+
+        if not over_credit and not self.saturated(count):
+            admission = Admission(range(count))
+        elif self.policy == "reject":
+            admission = Admission((), shed_action="rejected", shed_count=count)
+        elif self.policy == "sample":
+            keep = []
+            for i in range(count):
+                if self.sample_step is not None and self._sample_counter % self.sample_step == 0:
+                    keep.append(i)
+                self._sample_counter += 1
+            admission = Admission(keep, shed_action="sampled", shed_count=count - len(keep))
+        else:
+            admission = Admission(range(count), store=False, shed_action="degraded", shed_count=count)
+
+        if self.pending + len(admission.keep) > self.max_pending:
+            admission = Admission((), shed_action="rejected", shed_count=count)
+
+        kept = len(admission.keep)
+        if admission.shed_action == "rejected":
+            self.rejected += admission.shed_count
+        elif admission.shed_action == "sampled":
+            self.sampled_out += admission.shed_count
+        elif admission.shed_action == "degraded":
+            self.degraded += admission.shed_count
+        if admission.shed_action is not None:
+            self.last_shed = time.time()
+        self.pending += kept
+        self.admitted += kept
+        window.outstanding += kept
+        # Shed logs never occupy a slot, their credits come back with the next grant
+        window.returned += count - kept
+        return admission
+
+    def release(self, window, count):
+        """Mark ``count`` admitted logs as processed; returns credits to grant, or 0"""
+        self.pending -= count
+        self.processed += count
+        now = time.monotonic()
+        if self._released_at is not None and now > self._released_at:
+            self._rate = 0.9 * self._rate + 0.1 * count / (now - self._released_at)
+        self._released_at = now
+        window.outstanding -= count
+        window.returned += count
+        return self.grant(window)
+
+    def grant(self, window):
+        """Credits to hand back to ``window``'s client now, or 0 to wait for more.
+
+        Grants are batched, except when nothing is in flight so a client never idles
+        waiting for credits it has already earned.
+        """
+        if window.returned >= window.grant_step or (window.outstanding == 0 and window.returned):
+            grant, window.returned = window.returned, 0
+            window.credits += grant
+            return grant
+        return 0
+
+    def retry_after_ms(self):
+        """Hint for shed clients: time for the pending backlog to drain to the shed threshold"""
+        excess = self.pending - self.max_pending * self.shed_threshold
+        if excess <= 0 or not self._rate:
+            return 100
+        return int(min(10_000, max(100, excess / self._rate * 1000)))
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "connections": len(self.windows),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "saturated": self.saturated(),
+            "admitted": self.admitted,
+            "processed": self.processed,
+            "over_credit_frames": self.over_credit,
+            "rejected": self.rejected,
+            "sampled_out": self.sampled_out,
+            "degraded": self.degraded,
+            "last_shed": self.last_shed,
+            "processed_per_second": round(self._rate, 1),
+        }
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import httpx
+from groq import AsyncGroq
+
+logger = logging.getLogger(__name__)
+
+# === Backends ===
+class GroqBackend:
+    """Groq chat completions over one pooled, keep-alive async HTTP client"""
+
+    def __init__(self, api_key, model="llama3-8b-8192", temperature=0.3, max_connections=10):
+        self.model = model
+        self.temperature = temperature
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        # Timeouts are enforced per call by the gateway; retries would only stretch them
+        self._client = AsyncGroq(api_key=api_key, http_client=self._http, max_retries=0)
+
+    async def complete(self, prompt):
+        response = await self._client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature,
+        )
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        await self._client.close()
+
+class StubBackend:
+    """Local stand-in for load testing without the network: fixed latency, canned answer"""
+
+    def __init__(self, latency_ms=200.0):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+
+    async def complete(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return f"[stub] {len(prompt)} prompt characters received"
+
+    async def aclose(self):
+        pass
+
+# === LLM Gateway ===
+class LLMGateway:
+    """Non-blocking front for an LLM backend.
+
+    At most ``max_concurrency`` completions run at once, and a call that has not been
+    answered within ``timeout_seconds`` (waiting for a slot included) is cancelled.
+    Answers are kept in an LRU cache for ``cache_ttl_seconds`` under the caller's cache
+    key, and callers asking for a key that is already being completed wait for that
+    completion instead of starting another one.
+    """
+
+    def __init__(self, backend, max_concurrency=4, timeout_seconds=30.0, cache_size=256, cache_ttl_seconds=300.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout_seconds
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl_seconds
+        self._cache = OrderedDict()  # key -> (expires_at, answer)
+        self._in_flight = {}  # key -> future shared by coalesced callers
+        self._slots = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.completions = 0
+        self.total_seconds = 0.0
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, answer = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return answer
+
+    def _remember(self, key, answer):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl, answer)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def complete(self, prompt, cache_key=None):
+        """Answer for ``prompt``; ``cache_key`` (default: the prompt) identifies equal requests.
+
+        Raises ``asyncio.TimeoutError`` when no answer arrives within the timeout.
+        """
+        key = prompt if cache_key is None else cache_key
+        answer = self._cached(key)
+        if answer is not None:
+            self.hits += 1
+            return answer
+
+        pending = self._in_flight.get(key)
+        if pending is None:
+            self.misses += 1
+            pending = self._in_flight[key] = asyncio.ensure_future(self._call(key, prompt))
+        else:
+            self.coalesced += 1
+        # Shielded so a caller that goes away doesn't cancel the completion for the others
+        return await asyncio.shield(pending)
+
+    async def _call(self, key, prompt):
+        try:
+            answer = await self._complete(prompt)
+        finally:
+            del self._in_flight[key]
+        self._remember(key, answer)
+        return answer
+
+    async def _complete(self, prompt):
+        try:
+            return await asyncio.wait_for(self._complete_in_slot(prompt), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"LLM completion timed out after {self.timeout}s")
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+    async def _complete_in_slot(self, prompt):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._slots:
+            start = time.perf_counter()
+            answer = await self.backend.complete(prompt)
+            self.completions += 1
+            self.total_seconds += time.perf_counter() - start
+            return answer
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "in_flight": len(self._in_flight),
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "avg_completion_ms": round(self.total_seconds / self.completions * 1000, 1) if self.completions else None,
+        }
@@ -0,0 +1,461 @@
+import bisect
+import logging
+import threading
+import time
+
+import numpy as np
+
+from ring_buffer import NAT, to_epoch_ns
+
+logger = logging.getLogger(__name__)
+
+# Rows buffered per field before they are sorted into a run
+INDEX_TAIL_ROWS = 65_536
+# Bytes of each ip / url / tenant kept in the index; longer url prefixes are checked on the records
+INDEX_KEY_BYTES = {"ip": 64, "url": 128, "tenant": 16}
+# Approximate memory per indexed log: the string keys, a seq per field, and the forward columns
+INDEX_BYTES_PER_ROW = sum(INDEX_KEY_BYTES.values()) + 8 * 6 + 8 + 4 + 1 + 8 + 4 + 1
+
+# Forward columns (value by seq) used to check candidates against the other filters
+_FORWARD_COLUMNS = {"timestamp": (np.int64, NAT), "status_code": (np.int32, -1), "anomaly": (np.int8, 0)}
+
+def _string_keys(values, width):
+    """Fixed-width byte keys; values that aren't strings (e.g. a numeric ip from JSON) as their str()"""
+    return np.array([str(value).encode("utf-8", "surrogatepass")[:width] if value is not None else b""
+                     for value in values], dtype=f"S{width}")
+
+# === Sorted Runs ===
+class _SortedRun:
+    """Immutable posting lists: distinct keys in order, and the seqs of each key in ``seqs``"""
+
+    __slots__ = ("keys", "offsets", "seqs", "max_seq")
+
+    def __init__(self, keys, offsets, seqs):
+        self.keys = keys
+        self.offsets = offsets
+        self.seqs = seqs
+        self.max_seq = int(seqs.max())
+
+    @classmethod
+    def from_key_index(cls, keys, key_index, seqs):
+        """Run from the position in the sorted ``keys`` of every row in ``seqs``"""
+        counts = np.bincount(key_index, minlength=len(keys))
+        used = counts > 0
+        if not used.all():
+            key_index = (np.cumsum(used) - 1)[key_index]
+            keys, counts = keys[used], counts[used]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(keys, offsets, seqs[np.argsort(key_index, kind="stable")])
+
+    @classmethod
+    def from_values(cls, values, seqs):
+        keys, key_index = np.unique(values, return_inverse=True)
+        return cls.from_key_index(keys, key_index, seqs)
+
+    @classmethod
+    def merge(cls, older, newer, min_seq=0):
+        """One run from two in linear time, dropping seqs below ``min_seq``"""
+        # Both key arrays are sorted, so a stable sort of the two is a merge
+        keys = np.concatenate([older.keys, newer.keys])
+        keys.sort(kind="stable")
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+
+        counts = np.zeros(len(keys), dtype=np.int64)
+        slots = []
+        for run in (older, newer):
+            slot = np.searchsorted(keys, run.keys)
+            slots.append(slot)
+            counts[slot] += np.diff(run.offsets)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # Each key's rows from the older run come first, then those from the newer one
+        seqs = np.empty(offsets[-1], dtype=np.int64)
+        filled = offsets[:-1].copy()
+        for run, slot in zip((older, newer), slots):
+            shift = filled[slot] - run.offsets[:-1]
+            seqs[np.arange(len(run.seqs)) + np.repeat(shift, np.diff(run.offsets))] = run.seqs
+            filled[slot] += np.diff(run.offsets)
+
+        live = seqs >= min_seq
+        if live.all():
+            return cls(keys, offsets, seqs)
+        if not live.any():
+            return None
+        key_index = np.repeat(np.arange(len(keys)), counts)
+        return cls.from_key_index(keys, key_index[live], seqs[live])
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def span(self, lo, hi):
+        """Slice of ``seqs`` holding the keys in [lo, hi]"""
+        start = self.offsets[np.searchsorted(self.keys, lo, side="left")]
+        stop = self.offsets[np.searchsorted(self.keys, hi, side="right")]
+        return start, stop
+
+class _FieldIndex:
+    """Secondary index of one field: log-structured sorted runs plus a small unsorted tail.
+
+    New rows go to the tail; a full tail is sorted into a run, and runs of similar size
+    are merged, so a lookup is a binary search in O(log n) runs plus a scan of the tail.
+    """
+
+    def __init__(self):
+        self.runs = []
+        self._tail_values = []
+        self._tail_seqs = []
+        self._tail_rows = 0
+        self.min_seq = 0
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs) + self._tail_rows
+
+    def add(self, values, seqs):
+        self._tail_values.append(values)
+        self._tail_seqs.append(seqs)
+        self._tail_rows += len(seqs)
+        if self._tail_rows >= INDEX_TAIL_ROWS:
+            self.flush()
+
+    def _tail(self):
+        if len(self._tail_seqs) > 1:
+            self._tail_values = [np.concatenate(self._tail_values)]
+            self._tail_seqs = [np.concatenate(self._tail_seqs)]
+        return self._tail_values[0], self._tail_seqs[0]
+
+    def flush(self):
+        """Sort the tail into a run and merge runs of similar size"""
+        if self._tail_rows:
+            values, seqs = self._tail()
+            self.runs.append(_SortedRun.from_values(values, seqs))
+            self._tail_values, self._tail_seqs, self._tail_rows = [], [], 0
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            newer = self.runs.pop()
+            merged = _SortedRun.merge(self.runs.pop(), newer, self.min_seq)
+            if merged is not None:
+                self.runs.append(merged)
+
+    def count(self, lo, hi):
+        """Rows with a key in [lo, hi] (tail included), without materializing them"""
+        total = 0
+        for run in self.runs:
+            start, stop = run.span(lo, hi)
+            total += stop - start
+        if self._tail_rows:
+            values, _ = self._tail()
+            total += np.count_nonzero((values >= lo) & (values <= hi))
+        return int(total)
+
+    def lookup(self, lo, hi):
+        """Sorted seqs of the rows with a key in [lo, hi]"""
+        parts = []
+        for run in self.runs:
+            start, stop = run.span(lo, hi)
+            if stop > start:
+                parts.append(run.seqs[start:stop])
+        if self._tail_rows:
+            values, seqs = self._tail()
+            parts.append(seqs[(values >= lo) & (values <= hi)])
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def drop_before(self, min_seq):
+        """Drop runs holding only older seqs; the rest are filtered out on their next merge"""
+        self.min_seq = min_seq
+        self.runs = [run for run in self.runs if run.max_seq >= min_seq]
+        if self._tail_rows:
+            values, seqs = self._tail()
+            live = seqs >= min_seq
+            self._tail_values, self._tail_seqs = [values[live]], [seqs[live]]
+            self._tail_rows = int(live.sum())
+
+# === Log Index ===
+class LogIndex:
+    """In-process secondary indexes over the newest archived logs, keyed by storage seq.
+
+    Timestamp, status code, anomaly label, ip, url (byte prefix) and tenant each get a
+    ``_FieldIndex``; numeric fields are also kept as forward columns by seq. A search
+    materializes the posting list of its most selective filter and checks the other
+    filters against the forward columns (or intersects posting lists for the strings), so
+    its cost follows the matching rows rather than the size of the archive.
+
+    The index lives in memory (about ``INDEX_BYTES_PER_ROW`` bytes per log), so with
+    ``max_rows`` only the newest logs are kept: ``min_seq`` rises as older ones are
+    evicted, and ``page`` finds matches below it by scanning the archive's segments.
+    """
+
+    def __init__(self, max_rows=None):
+        self.fields = {name: _FieldIndex() for name in ("timestamp", "status_code", "anomaly", "ip", "url", "tenant")}
+        self.max_rows = max_rows
+        self.base_seq = None
+        self.min_seq = 0
+        self._forward = {name: np.zeros(0, dtype=dtype) for name, (dtype, _) in _FORWARD_COLUMNS.items()}
+        self._batches = []  # [first seq, last seq, rows] of each added batch, by first seq
+        self._live_rows = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_archive(cls, archive, max_rows=None):
+        """Index the newest segments already in the archive, up to ``max_rows`` logs"""
+        index = cls(max_rows)
+        start = time.perf_counter()
+        segments = archive.segments()
+        first, rows = len(segments), 0
+        while first > 0 and (not max_rows or rows + len(segments[first - 1]) <= max_rows):
+            first -= 1
+            rows += len(segments[first])
+        if first:
+            index.min_seq = segments[first].first_seq if first < len(segments) else segments[-1].last_seq + 1
+        for segment in segments[first:]:
+            index.add_segment(segment)
+        with index._lock:
+            for field in index.fields.values():
+                field.flush()
+        logger.info(f"Indexed {len(index.fields['timestamp'])} archived logs in {time.perf_counter() - start:.2f}s")
+        return index
+
+    def add_segment(self, segment, indexed=()):
+        """Index the rows of an archive segment, except those with seqs in the ``indexed``
+        segments' ranges"""
+        seqs = np.array(segment.column("seq"))
+        rows = slice(None)
+        if indexed:
+            known = np.zeros(len(seqs), dtype=bool)
+            for other in indexed:
+                known |= (seqs >= other.first_seq) & (seqs <= other.last_seq)
+            rows = np.flatnonzero(~known)
+        columns = {name: np.array(segment.column(name)[rows]) for name in _FORWARD_COLUMNS}
+        for name, width in INDEX_KEY_BYTES.items():
+            keys = _string_keys(segment.values(name), width)
+            columns[name] = keys[segment.column(name)[rows]]
+        self.add(seqs[rows], columns)
+
+    def add(self, seqs, columns):
+        with self._lock:
+            if self.min_seq and len(seqs) and int(seqs.min()) < self.min_seq:
+                # Logs older than the index holds (e.g. another worker's, arriving late)
+                live = seqs >= self.min_seq
+                seqs, columns = seqs[live], {name: values[live] for name, values in columns.items()}
+            if not len(seqs):
+                return
+            if self.base_seq is None:
+                self.base_seq = int(seqs.min())
+            self._store_forward(seqs, columns)
+            for name, field in self.fields.items():
+                field.add(columns[name], seqs)
+            bisect.insort(self._batches, [int(seqs.min()), int(seqs.max()), len(seqs)])
+            self._live_rows += len(seqs)
+            if self.max_rows and self._live_rows > self.max_rows:
+                self._evict()
+
+    def _evict(self):
+        """Forget the oldest batches until the index is back under ``max_rows``"""
+        excess = self._live_rows - self.max_rows
+        evicted = 0
+        while evicted < len(self._batches) - 1 and excess > 0:
+            excess -= self._batches[evicted][2]
+            evicted += 1
+        if evicted:
+            self.drop_before(self._batches[evicted][0])
+
+    def _store_forward(self, seqs, columns):
+        lowest = int(seqs.min())
+        if lowest < self.base_seq:  # another worker's older logs arrived late
+            shift = self.base_seq - lowest
+            self._forward = {
+                name: np.concatenate([np.full(shift, missing, dtype=dtype), self._forward[name]])
+                for name, (dtype, missing) in _FORWARD_COLUMNS.items()
+            }
+            self.base_seq = lowest
+        positions = seqs - self.base_seq
+        needed = int(positions.max()) + 1
+        for name, (dtype, missing) in _FORWARD_COLUMNS.items():
+            array = self._forward[name]
+            if needed > len(array):
+                grown = np.full(max(needed, 2 * len(array)), missing, dtype=dtype)
+                grown[:len(array)] = array
+                array = self._forward[name] = grown
+            array[positions] = columns[name]
+
+    def drop_before(self, min_seq):
+        """Forget logs with seq < ``min_seq`` (dropped from the archive by retention)"""
+        with self._lock:
+            self.min_seq = max(self.min_seq, min_seq)
+            dropped = 0
+            while dropped < len(self._batches) and self._batches[dropped][1] < self.min_seq:
+                self._live_rows -= self._batches[dropped][2]
+                dropped += 1
+            del self._batches[:dropped]
+            for field in self.fields.values():
+                field.drop_before(self.min_seq)
+            if self.base_seq is not None and self.min_seq - self.base_seq > len(self._forward["timestamp"]) // 2:
+                shift = self.min_seq - self.base_seq
+                self._forward = {name: array[shift:].copy() for name, array in self._forward.items()}
+                self.base_seq = self.min_seq
+
+    def parse_filters(self, since=None, until=None, ip=None, status=None, url_prefix=None, anomaly_only=False,
+                      tenant=None):
+        """(field, lo, hi) key ranges for the given filters"""
+        filters = []
+        if since is not None or until is not None:
+            lo = to_epoch_ns(since) if since is not None else NAT + 1
+            hi = to_epoch_ns(until) if until is not None else np.iinfo(np.int64).max
+            if lo == NAT or hi == NAT:
+                raise ValueError("since / until must be ISO 8601 timestamps")
+            filters.append(("timestamp", lo, hi))
+        if status is not None:
+            status = str(status).lower()
+            if len(status) == 3 and status.endswith("xx") and status[0].isdigit():
+                filters.append(("status_code", int(status[0]) * 100, int(status[0]) * 100 + 99))
+            elif status.isdigit():
+                filters.append(("status_code", int(status), int(status)))
+            else:
+                raise ValueError("status must be a status code like 404 or a class like 5xx")
+        if anomaly_only:
+            filters.append(("anomaly", -1, -1))
+        if ip:
+            key = _string_keys([ip], INDEX_KEY_BYTES["ip"])[0]
+            filters.append(("ip", key, key))
+        if tenant:
+            key = _string_keys([tenant], INDEX_KEY_BYTES["tenant"])[0]
+            filters.append(("tenant", key, key))
+        if url_prefix:
+            width = INDEX_KEY_BYTES["url"]
+            key = _string_keys([url_prefix], width)[0]
+            filters.append(("url", key, key.ljust(width, b"\xff")))
+        return filters
+
+    def covers(self, seq):
+        """Whether a log is recent enough to be in the index"""
+        return seq >= self.min_seq
+
+    def search(self, before=None, **filters):
+        """Seqs of indexed logs matching all filters (and below ``before``), newest first.
+
+        Returns None when no indexed filter is given.
+        """
+        ranges = self.parse_filters(**filters)
+        if not ranges:
+            return None
+        with self._lock:
+            return self._search(ranges, before)
+
+    def _search(self, ranges, before):
+        ranges = sorted(ranges, key=lambda r: self.fields[r[0]].count(r[1], r[2]))
+        name, lo, hi = ranges[0]
+        seqs = self.fields[name].lookup(lo, hi)
+        seqs = seqs[seqs >= self.min_seq]
+        if before is not None:
+            seqs = seqs[seqs < before]
+        for name, lo, hi in ranges[1:]:
+            if not len(seqs):
+                break
+            if name in self._forward:
+                values = self._forward[name][seqs - self.base_seq]
+                seqs = seqs[(values >= lo) & (values <= hi)]
+            else:
+                seqs = np.intersect1d(seqs, self.fields[name].lookup(lo, hi), assume_unique=True)
+        return seqs[::-1]
+
+    def page(self, archive, limit=100, before=None, url_prefix=None, **filters):
+        """Newest-first page of archived logs matching the filters, like ``LogArchive.page``:
+        from the index, then from a scan of the segments older than it holds"""
+        ranges = self.parse_filters(url_prefix=url_prefix, **filters)
+        with self._lock:
+            floor = self.min_seq
+            seqs = self._search(ranges, before)
+        records, next_cursor = self.fetch_page(archive, seqs, limit, url_prefix)
+        if next_cursor is not None or not floor:
+            return records, next_cursor
+        older = self.scan(archive, ranges, floor if before is None else min(before, floor),
+                          limit + 1 - len(records), url_prefix)
+        records.extend(older)
+        has_more = len(records) > limit
+        records = records[:limit]
+        return records, records[-1]["seq"] if has_more else None
+
+    def scan(self, archive, ranges, before, wanted, url_prefix=None):
+        """Up to ``wanted`` records of archived logs with ``seq < before`` matching ``ranges``,
+        newest first, read from the segments' columns instead of the index"""
+        for attempt in range(3):
+            try:
+                return self._scan(archive, ranges, before, wanted, url_prefix)
+            except FileNotFoundError:
+                # A compaction replaced a segment while we were reading, retry on the new list
+                if attempt == 2:
+                    raise
+
+    def _scan(self, archive, ranges, before, wanted, url_prefix):
+        check_url = url_prefix and len(url_prefix.encode("utf-8", "surrogatepass")) > INDEX_KEY_BYTES["url"]
+        records = []
+        for segment in reversed(archive.segments()):
+            if len(records) >= wanted:
+                break
+            if segment.first_seq >= before:
+                continue
+            mask = segment.column("seq") < before
+            for name, lo, hi in ranges:
+                if name in INDEX_KEY_BYTES:
+                    values = _string_keys(segment.values(name), INDEX_KEY_BYTES[name])[segment.column(name)]
+                else:
+                    values = segment.column(name)
+                mask &= (values >= lo) & (values <= hi)
+            rows = np.flatnonzero(mask)[::-1]
+            for start in range(0, len(rows), 256):
+                found = segment.to_records(rows[start:start + 256])
+                if check_url:
+                    found = [record for record in found if (record["url"] or "").startswith(url_prefix)]
+                records.extend(found[:wanted - len(records)])
+                if len(records) >= wanted:
+                    break
+        return records
+
+    def record_matches(self, record, ranges):
+        """Whether a log record (e.g. one returned by a vector search) matches ``ranges``,
+        for logs older than the index holds"""
+        for name, lo, hi in ranges:
+            value = record.get(name)
+            if name == "timestamp":
+                value = to_epoch_ns(value)
+            elif name in INDEX_KEY_BYTES:
+                value = _string_keys([value], INDEX_KEY_BYTES[name])[0]
+            elif value is None:
+                value = _FORWARD_COLUMNS[name][1]
+            if not lo <= value <= hi:
+                return False
+        return True
+
+    def fetch_page(self, archive, seqs, limit=100, url_prefix=None):
+        """Page of archived logs for ``search`` results, like ``LogArchive.page``"""
+        # Index keys are truncated, so long prefixes are confirmed on the records
+        check_url = url_prefix and len(url_prefix.encode("utf-8", "surrogatepass")) > INDEX_KEY_BYTES["url"]
+        wanted = limit + 1
+        records = []
+        start = 0
+        while start < len(seqs) and len(records) < wanted:
+            chunk = seqs[start:start + max(wanted, 256)]
+            start += len(chunk)
+            found = archive.lookup(chunk)
+            if check_url:
+                found = [record for record in found if (record["url"] or "").startswith(url_prefix)]
+            records.extend(found[:wanted - len(records)])
+        has_more = len(records) > limit
+        records = records[:limit]
+        return records, records[-1]["seq"] if has_more else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self.fields["timestamp"]),
+                "max_rows": self.max_rows,
+                "min_seq": self.min_seq,
+                "runs": {name: len(field.runs) for name, field in self.fields.items()},
+                "index_bytes": int(
+                    sum(run.keys.nbytes + run.offsets.nbytes + run.seqs.nbytes
+                        for field in self.fields.values() for run in field.runs)
+                    + sum(array.nbytes for array in self._forward.values())
+                ),
+            }
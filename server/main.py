@@ -1,47 +1,48 @@
 import asyncio
+import hmac
 import json
 import os
-import pickle
-import re
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from starlette.requests import ClientDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import pandas as pd
+from fastapi.responses import JSONResponse, Response
 import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.ensemble import IsolationForest
 import chromadb
 from chromadb.config import Settings
-from groq import Groq
 import uvicorn
 import logging
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
+from ring_buffer import NAT, ColumnarLogBuffer, format_epoch_ns, to_epoch_ns
+from windowing import EventTimeWindows
+from features import DEFAULT_TENANT, prepare_log_features, prepare_log_features_batch, select_rows, tenant_id
+from scoring import MODEL_FEATURES, ScoringExecutor
+from feature_store import JOINED_WINDOW_FEATURES, FeatureStore
+from model_lifecycle import ModelManager
+from batching import MicroBatcher
+from archive import LogArchive
+from log_index import LogIndex
+from rollups import ALL_TENANTS, RollupStore
+from diagnostics import configure_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, PIPELINE_STAGE_SECONDS, REGISTRY as metrics, MetricsMiddleware, timed
+from summary_store import SummaryStore
+from broadcast import ConnectionManager
+from flow_control import IngestLimiter
+from llm_gateway import GroqBackend, LLMGateway, StubBackend
+from shared_state import SharedState
+from tenants import TENANT_HLL_PRECISION, TenantRegistry, parse_weights
+from serialization import FastJSONResponse, anomaly_details, dumps, dumps_text, parse_profile, scored_batch_payload, scored_log_payload
+from stream_ingest import NDJSONStreamingResponse, error_report, iter_ndjson_chunks
+from storage import LogSequence, WriteBehindQueue, decode_log_document, encode_log_document, fetch_log_page
 
 load_dotenv()
 
 API_KEY=os.getenv('API_KEY')
 
-def convert_timestamps_to_iso(obj):
-    """Recursively convert MongoDB Timestamp objects to ISO format strings"""
-    if isinstance(obj, dict):
-        return {key: convert_timestamps_to_iso(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_timestamps_to_iso(item) for item in obj]
-    elif isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    elif hasattr(obj, 'isoformat'):  # For datetime objects
-        return obj.isoformat()
-    return obj
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Changed from INFO to DEBUG for more verbose output
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
 logger = logging.getLogger(__name__)
 
 # === Setup ===
@@ -55,18 +56,122 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # === Environment Variables ===
 GROQ_API_KEY = os.getenv("GROQ_API_KEY",API_KEY)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # Root level, changeable at runtime through /logging
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
+LOG_RATE_LIMIT_PER_SECOND = int(os.getenv("LOG_RATE_LIMIT_PER_SECOND", 10))  # Records per logging call site below ERROR, 0 is unlimited
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))  # Records waiting for the writer thread, newer ones are dropped
 SUMMARY_INTERVAL_MINUTES = 3
+SUMMARY_WINDOW_SECONDS = float(os.getenv("SUMMARY_WINDOW_SECONDS", SUMMARY_INTERVAL_MINUTES * 60))  # Event-time window per summary
+SUMMARY_WINDOW_SLIDE_SECONDS = float(os.getenv("SUMMARY_WINDOW_SLIDE_SECONDS", 0))  # Hopping windows start this often, 0 is tumbling
+SUMMARY_ALLOWED_LATENESS_SECONDS = float(os.getenv("SUMMARY_ALLOWED_LATENESS_SECONDS", 30))  # Out-of-order logs still summarized
+SUMMARY_IDLE_FLUSH_SECONDS = float(os.getenv("SUMMARY_IDLE_FLUSH_SECONDS", SUMMARY_WINDOW_SECONDS))  # Close open windows after no logs this long
 SUMMARY_FILE_PATH = os.path.join(os.path.dirname(__file__), "log_summaries", "continuous_summary.txt")
 SERVER_PORT = int(os.getenv("PORT", 5000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))  # uvicorn worker processes; >1 shares state via SHARED_STATE_DIR
+SHARED_STATE_DIR = os.getenv(  # Empty keeps all state in this process
+    "SHARED_STATE_DIR", os.path.join(os.path.dirname(__file__), "shared_state") if SERVER_WORKERS > 1 else ""
+)
+SHARED_STATE_SYNC_SECONDS = float(os.getenv("SHARED_STATE_SYNC_SECONDS", 2))  # Aggregate hand-over and broadcast relay
   # Changed from 5000 to 5001
 APPLICATION_BACKEND_URL = "http://localhost:5000"  # Application backend URL
+LOG_BUFFER_MAX_ROWS = int(os.getenv("LOG_BUFFER_MAX_ROWS", 100_000))  # Max logs kept in memory
+LOG_BUFFER_MAX_MB = float(os.getenv("LOG_BUFFER_MAX_MB", 0))  # Optional memory cap for the buffer arrays
+SUMMARY_TOP_K = int(os.getenv("SUMMARY_TOP_K", 64))  # Endpoints tracked by the top-k sketch
+SCORING_EXECUTOR = os.getenv("SCORING_EXECUTOR", "thread")  # "thread" or "process"
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", os.cpu_count() or 1))
+SCORING_MAX_IN_FLIGHT = int(os.getenv("SCORING_MAX_IN_FLIGHT", 2 * SCORING_WORKERS))  # Batches queued or running
+SCORING_QUANTUM_LOGS = int(os.getenv("SCORING_QUANTUM_LOGS", 256))  # Logs a tenant scores per fair-scheduling turn
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(__file__), "models", "versions"))  # Versioned refits
+MODEL_RESERVOIR_SIZE = int(os.getenv("MODEL_RESERVOIR_SIZE", 10_000))  # Recent feature vectors kept for refits
+MODEL_MIN_REFIT_SAMPLES = int(os.getenv("MODEL_MIN_REFIT_SAMPLES", 256))
+MODEL_REFIT_INTERVAL_MINUTES = float(os.getenv("MODEL_REFIT_INTERVAL_MINUTES", 60))  # 0 disables scheduled refits
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", 5))
+FEATURE_STORE_MAX_KEYS = int(os.getenv("FEATURE_STORE_MAX_KEYS", 10_000))  # Keys per field with rolling stats, 0 disables
+FEATURE_STORE_BUCKET_SECONDS = float(os.getenv("FEATURE_STORE_BUCKET_SECONDS", 15))  # Resolution of the 1m/5m/15m windows
+FEATURE_STORE_MODEL = os.getenv("FEATURE_STORE_MODEL", "false").lower() in ("1", "true", "yes")  # Refits also use window features
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", 256))  # Single-log messages scored together
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", 5))  # Max extra latency added by batching
+STORAGE_QUEUE_MAX = int(os.getenv("STORAGE_QUEUE_MAX", 50_000))  # Logs waiting for ChromaDB before ingest waits
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", 500))  # Logs written to ChromaDB per add()
+STORAGE_FLUSH_INTERVAL_MS = float(os.getenv("STORAGE_FLUSH_INTERVAL_MS", 500))  # Max time a log waits in the queue
+STORAGE_FLUSH_RETRIES = int(os.getenv("STORAGE_FLUSH_RETRIES", 3))  # Retries of a failed write, 0.5s apart and doubling
+STORAGE_DEAD_LETTER_PATH = os.getenv(  # NDJSON file for logs that could not be written; empty drops them
+    "STORAGE_DEAD_LETTER_PATH", os.path.join(os.path.dirname(__file__), "dead_letter", "storage.ndjson")
+)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))  # Empty disables the archive
+ARCHIVE_RETENTION_HOURS = float(os.getenv("ARCHIVE_RETENTION_HOURS", 168))  # Logs older than this are dropped
+LOG_INDEX_MAX_ROWS = int(os.getenv("LOG_INDEX_MAX_ROWS", 1_000_000))  # Newest archived logs indexed in memory (~270 bytes each), 0 is all
+ARCHIVE_MAINTENANCE_INTERVAL_MINUTES = float(os.getenv("ARCHIVE_MAINTENANCE_INTERVAL_MINUTES", 10))  # Retention (and compaction)
+ARCHIVE_COMPACT_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_COMPACT_INTERVAL_SECONDS", 60))  # Merging of small segments, 0 = with retention
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", 65_536))  # Logs the open hour's small segments are merged up to
+ARCHIVE_OPEN_COLUMNS = int(os.getenv("ARCHIVE_OPEN_COLUMNS", 1024))  # Segment column files kept memory-mapped
+ROLLUP_DB_PATH = os.getenv(  # Empty disables the summary rollups
+    "ROLLUP_DB_PATH", os.path.join(os.path.dirname(SUMMARY_FILE_PATH), "rollups.sqlite3")
+)
+ROLLUP_WINDOW_RETENTION_DAYS = float(os.getenv("ROLLUP_WINDOW_RETENTION_DAYS", 7))  # Summary windows kept once rolled up
+ROLLUP_HOUR_RETENTION_DAYS = float(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", 90))  # Hourly rollups kept, days are kept forever
+ROLLUP_COMPACT_INTERVAL_MINUTES = float(os.getenv("ROLLUP_COMPACT_INTERVAL_MINUTES", 5))  # Hour / day roll-up runs
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "")  # Empty keeps ChromaDB in memory
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")  # Chroma server shared by all workers, takes precedence over the above
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", 3000))  # Summary tokens sent to the LLM
+CHAT_RECENT_SUMMARIES = int(os.getenv("CHAT_RECENT_SUMMARIES", 3))  # Latest summaries always included if they fit
+CHAT_LOOKBACK_HOURS = float(os.getenv("CHAT_LOOKBACK_HOURS", 0))  # 0 searches every summary
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")  # "groq" or "stub" (local, for load tests)
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3-8b-8192")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))  # Completions running at once
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 256))  # Cached answers, 0 disables the cache
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 300))
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 200))
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", 64))  # Messages buffered per slow client
+BROADCAST_POLICY = os.getenv("BROADCAST_POLICY", "coalesce")  # "coalesce" or "drop_oldest"
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", 10_000))  # Logs accepted but not processed yet, all clients
+INGEST_CREDIT_WINDOW = int(os.getenv("INGEST_CREDIT_WINDOW", 512))  # Logs one /ws/application client may have in flight
+INGEST_SHED_POLICY = os.getenv("INGEST_SHED_POLICY", "degrade")  # "reject", "sample" or "degrade" (skip storage)
+INGEST_SHED_THRESHOLD = float(os.getenv("INGEST_SHED_THRESHOLD", 0.8))  # Fraction of the caps where shedding starts
+INGEST_SAMPLE_RATE = float(os.getenv("INGEST_SAMPLE_RATE", 0.1))  # Share of logs kept by the "sample" policy
+INGEST_STREAM_CHUNK_LOGS = int(os.getenv("INGEST_STREAM_CHUNK_LOGS", 1000))  # Logs scored per chunk of an NDJSON upload
+INGEST_STREAM_MAX_LINE_BYTES = int(os.getenv("INGEST_STREAM_MAX_LINE_BYTES", 1 << 20))  # Longer NDJSON lines are skipped
+TENANT_RATE_LIMIT = float(os.getenv("TENANT_RATE_LIMIT", 0))  # Logs/s accepted per tenant (API key), 0 is unlimited
+TENANT_BURST = float(os.getenv("TENANT_BURST", 0))  # Logs a tenant may send at once, 0 is one second's worth
+TENANT_BUFFER_MAX_ROWS = int(os.getenv("TENANT_BUFFER_MAX_ROWS", 1000))  # Recent logs kept in memory per tenant
+TENANT_BUFFER_MAX_MB = float(os.getenv("TENANT_BUFFER_MAX_MB", 0))  # Optional memory cap per tenant buffer
+TENANT_MAX = int(os.getenv("TENANT_MAX", 1000))  # Tenants tracked at once, the least recently seen beyond are forgotten
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")  # "tenant:weight,..." shares of scoring throughput, default 1
+TENANT_MODELS = os.getenv("TENANT_MODELS", "false").lower() in ("1", "true", "yes")  # One anomaly model per tenant
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")  # X-API-Key that reads every tenant's logs, rollups and summaries; empty disables
+TENANT_SUMMARY_DIR = os.path.join(os.path.dirname(SUMMARY_FILE_PATH), "tenants")  # <tenant>.txt summary streams
+
+# === Logging ===
+# Records are formatted and written by a background thread; None if the process
+# importing this module (e.g. the backfill) configured logging itself
+log_control = configure_logging(
+    level=LOG_LEVEL, fmt=LOG_FORMAT, rate_limit_per_second=LOG_RATE_LIMIT_PER_SECOND, queue_size=LOG_QUEUE_SIZE,
+)
 
 # === Initialize Clients ===
-groq_client = Groq(api_key=GROQ_API_KEY)
-chroma_client = chromadb.Client(Settings(anonymized_telemetry=False))
+if LLM_BACKEND == "stub":
+    llm_backend = StubBackend(latency_ms=LLM_STUB_LATENCY_MS)
+else:
+    llm_backend = GroqBackend(GROQ_API_KEY, model=LLM_MODEL, max_connections=LLM_MAX_CONCURRENCY)
+llm_gateway = LLMGateway(
+    llm_backend,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    timeout_seconds=LLM_TIMEOUT_SECONDS,
+    cache_size=LLM_CACHE_SIZE,
+    cache_ttl_seconds=LLM_CACHE_TTL_SECONDS,
+)
+if CHROMA_HOST:
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, settings=Settings(anonymized_telemetry=False))
+elif CHROMA_PERSIST_DIR:
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR, settings=Settings(anonymized_telemetry=False))
+else:
+    chroma_client = chromadb.Client(Settings(anonymized_telemetry=False))
 
 # === Initialize ChromaDB Collections ===
 try:
@@ -76,40 +181,236 @@ except Exception as e:
     logger.error(f"Failed to initialize ChromaDB logs collection: {e}")
     raise
 
+# === Initialize Log Archive ===
+log_archive = LogArchive(
+    ARCHIVE_DIR,
+    retention_hours=ARCHIVE_RETENTION_HOURS,
+    segment_rows=ARCHIVE_SEGMENT_ROWS,
+    open_columns=ARCHIVE_OPEN_COLUMNS,
+) if ARCHIVE_DIR else None
+log_index = LogIndex.from_archive(log_archive, max_rows=LOG_INDEX_MAX_ROWS) if log_archive else None
+
+# === Summary Rollups ===
+# Every summary window's aggregates, rolled up into hours and days for range queries;
+# overlapping (hopping) windows or ones that straddle hours would be counted twice
+rollup_store = None
+if ROLLUP_DB_PATH:
+    if SUMMARY_WINDOW_SLIDE_SECONDS in (0, SUMMARY_WINDOW_SECONDS) and 3600 % SUMMARY_WINDOW_SECONDS == 0:
+        rollup_store = RollupStore(
+            ROLLUP_DB_PATH,
+            retention_seconds={"window": ROLLUP_WINDOW_RETENTION_DAYS * 86400, "hour": ROLLUP_HOUR_RETENTION_DAYS * 86400},
+            top_k=SUMMARY_TOP_K,
+        )
+    else:
+        logger.warning("Summary rollups are disabled: they need tumbling summary windows that divide an hour")
+
+# === Shared State (multi-worker) ===
+# Workers share the seq counter, hand their summary aggregates to one leader and relay
+# its broadcasts; the archive, summary file and model versions are already on disk
+shared_state = SharedState(SHARED_STATE_DIR) if SHARED_STATE_DIR else None
+if shared_state is not None and not CHROMA_HOST:
+    logger.warning("ChromaDB is not shared between workers (CHROMA_HOST is not set): "
+                   "semantic /logs queries only see the logs the answering worker ingested")
+log_sequence = LogSequence(logs_col, floor=log_archive.last_seq if log_archive else 0, shared=shared_state)
+
+# === Streaming Feature Store ===
+# Rolling per-IP / URL / user-agent request, error and byte counts (GET /features), joined
+# onto each scored batch only when the model uses them
+feature_store = FeatureStore(
+    bucket_seconds=FEATURE_STORE_BUCKET_SECONDS, max_keys=FEATURE_STORE_MAX_KEYS
+) if FEATURE_STORE_MAX_KEYS > 0 else None
+model_window_features = feature_store is not None and FEATURE_STORE_MODEL
+model_n_features = len(MODEL_FEATURES) + (len(JOINED_WINDOW_FEATURES) if model_window_features else 0)
+
 # === Load Isolation Forest Model ===
 model_path = os.path.join(os.path.dirname(__file__), "models", "anamoly_Isolation_forest.pkl")
 try:
-    with open(model_path, "rb") as f:
-        iso_model = pickle.load(f)
-        logger.info(f"Loaded existing Isolation Forest model from {model_path}")
+    model_manager = ModelManager(
+        model_path,
+        MODEL_DIR,
+        reservoir_size=MODEL_RESERVOIR_SIZE,
+        min_refit_samples=MODEL_MIN_REFIT_SAMPLES,
+        keep_versions=MODEL_KEEP_VERSIONS,
+        n_features=model_n_features,
+    )
+    scoring_executor = ScoringExecutor(
+        model_manager,
+        mode=SCORING_EXECUTOR,
+        max_workers=SCORING_WORKERS,
+        max_in_flight=SCORING_MAX_IN_FLIGHT,
+        quantum=SCORING_QUANTUM_LOGS,
+        feature_store=feature_store,
+        joined=JOINED_WINDOW_FEATURES if model_window_features else (),
+        model_window_features=model_window_features,
+    )
 except Exception as e:
     logger.error(f"Failed to load Isolation Forest model: {e}")
     raise
 
 # === Connected Clients Manager ===
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+manager = ConnectionManager(max_queue=BROADCAST_QUEUE_SIZE, policy=BROADCAST_POLICY)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# === Variables to track log processing ===
+log_buffer = ColumnarLogBuffer(
+    max_rows=LOG_BUFFER_MAX_ROWS,
+    max_bytes=LOG_BUFFER_MAX_MB * 1024 * 1024 if LOG_BUFFER_MAX_MB else None,
+)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def new_summary_windows(fired_until=None, **aggregator_options):
+    """Event-time summary windows, treating those ending by ``fired_until`` as summarized"""
+    windows = EventTimeWindows(
+        SUMMARY_WINDOW_SECONDS,
+        slide_seconds=SUMMARY_WINDOW_SLIDE_SECONDS or None,
+        allowed_lateness_seconds=SUMMARY_ALLOWED_LATENESS_SECONDS,
+        idle_seconds=SUMMARY_IDLE_FLUSH_SECONDS,
+        **aggregator_options,
+    )
+    windows.close_until(fired_until)
+    return windows
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+# Logs are folded into the summary window of their timestamp as they are recorded;
+# summary_due wakes the summary task when the watermark closes a window
+summary_windows = new_summary_windows(top_k=SUMMARY_TOP_K)
+summary_due = asyncio.Event()
 
-manager = ConnectionManager()
+# === Tenants ===
+def tenant_model_manager(tenant):
+    """A tenant's own anomaly model, starting from the base model (TENANT_MODELS only)"""
+    if not TENANT_MODELS or tenant == DEFAULT_TENANT:
+        return None
+    return ModelManager(
+        model_path,
+        os.path.join(MODEL_DIR, "tenants", tenant),
+        reservoir_size=MODEL_RESERVOIR_SIZE,
+        min_refit_samples=MODEL_MIN_REFIT_SAMPLES,
+        keep_versions=MODEL_KEEP_VERSIONS,
+        n_features=model_n_features,
+    )
 
-# === Variables to track log processing ===
-last_summary_time = datetime.now()
-log_buffer = []
+# Each tenant gets its own bounded buffer, summary aggregates, quota and scheduling weight
+tenants = TenantRegistry(
+    TENANT_SUMMARY_DIR,
+    lambda: new_summary_windows(summary_windows.fired_until, top_k=SUMMARY_TOP_K, hll_precision=TENANT_HLL_PRECISION),
+    buffer_rows=TENANT_BUFFER_MAX_ROWS,
+    buffer_bytes=TENANT_BUFFER_MAX_MB * 1024 * 1024 if TENANT_BUFFER_MAX_MB else None,
+    rate=TENANT_RATE_LIMIT,
+    burst=TENANT_BURST or None,
+    weights=parse_weights(TENANT_WEIGHTS),
+    max_tenants=TENANT_MAX,
+    model_factory=tenant_model_manager,
+)
+
+# === Metrics ===
+# Hot-path counters and stage timings; everything else is read from the components' own
+# counters when /metrics is scraped
+logs_recorded = metrics.counter("logs_recorded", "Scored logs added to the buffer and summaries")
+anomalies_detected = metrics.counter("anomalies_detected", "Scored logs labelled anomalous")
+logs_throttled = metrics.counter("logs_throttled", "Logs dropped for being over their tenant's rate quota")
+archive_seconds = PIPELINE_STAGE_SECONDS.labels("archive")
+summary_seconds = PIPELINE_STAGE_SECONDS.labels("summary")
+
+metrics.gauge("log_buffer_rows", "Logs in the in-memory buffer", lambda: len(log_buffer))
+metrics.gauge("storage_queue_depth", "Logs waiting to be written to the archive and ChromaDB", lambda: len(storage_queue))
+metrics.gauge("microbatch_queue_depth", "Single-log messages waiting to be scored", lambda: single_log_batcher.stats()["queued"])
+metrics.gauge("ingest_pending_logs", "Logs accepted from ingest clients but not processed yet", lambda: ingest_limiter.pending)
+metrics.gauge("scoring_batches_in_flight", "Scoring batches queued or running", lambda: scoring_executor.in_flight)
+metrics.gauge("broadcast_queued_messages", "Broadcast messages waiting in client queues", lambda: manager.stats()["queued"])
+metrics.gauge(
+    "websocket_connections", "Open WebSocket connections", lambda: {
+        "ws": len(manager.active_connections), "application": len(ingest_limiter.windows),
+    }, ("endpoint",),
+)
+metrics.gauge("tenants", "Tenants tracked by this worker", lambda: len(tenants))
+metrics.gauge("summary_open_windows", "Summary windows not closed by the watermark yet", lambda: len(summary_windows.windows))
+metrics.counter_callback("logs_stored", "Logs written by the storage queue", lambda: storage_queue.flushed)
+metrics.counter_callback("logs_store_failed", "Logs the storage queue failed to write", lambda: storage_queue.failed)
+metrics.counter_callback("logs_dead_lettered", "Logs written to the dead-letter file instead of storage",
+                         lambda: storage_queue.dead_lettered)
+metrics.counter_callback(
+    "logs_shed", "Ingested logs shed under load, by action", lambda: {
+        "rejected": ingest_limiter.rejected, "sampled": ingest_limiter.sampled_out, "degraded": ingest_limiter.degraded,
+    }, ("action",),
+)
+metrics.counter_callback("broadcasts", "Messages broadcast to WebSocket clients", lambda: manager.broadcasts)
+metrics.counter_callback("summary_late_logs", "Logs too late for their summary window", lambda: summary_windows.late)
+
+def record_logs(scored_logs):
+    """Add scored logs to the in-memory buffer and their summary windows"""
+    logs_recorded.inc(len(scored_logs))
+    anomalies_detected.inc(sum(1 for log in scored_logs if log.get("anomaly") == -1))
+    log_buffer.extend(scored_logs)
+    summary_windows.add(scored_logs)
+    if tenants.record(scored_logs) | summary_windows.due():
+        summary_due.set()
+
+def _tenants_of(logs_data):
+    if isinstance(logs_data, dict):
+        return logs_data["tenant"]
+    return [log.get("tenant", DEFAULT_TENANT) for log in logs_data]
+
+def _positions_by_tenant(tenant_ids):
+    positions = {}
+    for i, tenant in enumerate(tenant_ids):
+        positions.setdefault(tenant, []).append(i)
+    return positions
+
+def _take(logs_data, positions):
+    if isinstance(logs_data, dict):
+        return select_rows(logs_data, positions)
+    return [logs_data[i] for i in positions]
+
+def throttle_logs(logs_data):
+    """Drop the logs over their tenant's rate quota (the newest of each tenant's share).
+    Takes feature columns or records; returns ``(kept, {tenant: logs throttled})``"""
+    tenant_ids = _tenants_of(logs_data)
+    positions = _positions_by_tenant(tenant_ids)
+    kept, throttled = [], {}
+    for tenant, rows in positions.items():
+        admitted = tenants.throttle(tenant, len(rows))
+        kept.extend(rows[:admitted])
+        if admitted < len(rows):
+            throttled[tenant] = len(rows) - admitted
+            logs_throttled.inc(len(rows) - admitted)
+    if not throttled:
+        return logs_data, throttled
+    kept.sort()
+    return _take(logs_data, kept), throttled
+
+def throttle_notice(throttled):
+    """Fields telling a client how many logs were throttled and when to retry"""
+    return {
+        "throttled": sum(throttled.values()),
+        "retry_after_ms": max(tenants.get(tenant).bucket.retry_after_ms() for tenant in throttled),
+    }
+
+async def score_tenant_logs(tenant_id, logs_data):
+    tenant = tenants.get(tenant_id)
+    return await scoring_executor.detect_anomalies(
+        logs_data, tenant=tenant_id, weight=tenant.weight, models=tenant.models
+    )
+
+@timed(PIPELINE_STAGE_SECONDS.labels("score"))
+async def score_logs(logs_data):
+    """Score feature columns or records, each tenant's logs taking their fair turn for a
+    scoring slot (and their tenant's own model, if any); results keep the input order"""
+    tenant_ids = _tenants_of(logs_data)
+    if not len(tenant_ids):
+        return []
+    positions = _positions_by_tenant(tenant_ids)
+    if len(positions) == 1:
+        return await score_tenant_logs(tenant_ids[0], logs_data)
+    parts = await asyncio.gather(*(
+        score_tenant_logs(tenant, _take(logs_data, rows)) for tenant, rows in positions.items()
+    ))
+    scored = [None] * len(tenant_ids)
+    for rows, part in zip(positions.values(), parts):
+        for i, log in zip(rows, part):
+            scored[i] = log
+    return scored
 
 # Ensure summary file directory exists
 os.makedirs(os.path.dirname(SUMMARY_FILE_PATH), exist_ok=True)
+os.makedirs(TENANT_SUMMARY_DIR, exist_ok=True)
 
 # Initialize summary file if it doesn't exist
 if not os.path.exists(SUMMARY_FILE_PATH):
@@ -117,175 +418,59 @@ if not os.path.exists(SUMMARY_FILE_PATH):
         f.write(f"--- SYSTEM STARTED AT {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
         f.write("Waiting for logs to process...\n\n\n\n")
 
-# === Feature Engineering Functions ===
-def prepare_log_features(log_dict):
-    """Extract and engineer features from a log entry"""
-    
-    # Handle different possible structures in the log data
-    if isinstance(log_dict, str):
-        try:
-            log_dict = json.loads(log_dict)
-        except:
-            # If it's still a string, try to parse it more aggressively
-            log_dict = {
-                "raw": log_dict,
-                "timestamp": datetime.now().isoformat()
-            }
-    
-    # Normalize field names (handle both camelCase and snake_case)
-    normalized = {}
-    for k, v in log_dict.items():
-        key = k.lower().replace(" ", "_")
-        normalized[key] = v
-    
-    # Create a feature dict with all relevant fields
-    features = {
-        "timestamp": normalized.get("timestamp", datetime.now().isoformat()),
-        "ip": normalized.get("ip", "unknown"),
-        "method": normalized.get("method", "GET"),
-        "url": normalized.get("url", normalized.get("originalurl", "/")),
-        "protocol": normalized.get("protocol", "HTTP/1.1"),
-        "status_code": int(normalized.get("statuscode", normalized.get("status_code", 200))),
-        "bytes_sent": int(normalized.get("bytessent", normalized.get("bytes_sent", 0))),
-        "user_agent": normalized.get("useragent", normalized.get("user_agent", "unknown")),
-    }
-    
-    # Add engineered features
-    features["url_length"] = len(features["url"])
-    features["url_depth"] = features["url"].count("/")
-    features["num_encoded_chars"] = len(re.findall(r'%[0-9A-Fa-f]{2}', features["url"]))
-    features["num_special_chars"] = len(re.findall(r'[|,;]', features["url"]))
-    
-    return features
+# Parsed and indexed view of the summary file, used to build /chat context
+summary_store = SummaryStore(SUMMARY_FILE_PATH)
 
-# === Anomaly Detection ===
-def detect_anomalies(logs_data):
-    """Detect anomalies in log data"""
-    if not logs_data:
-        return []
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(logs_data)
-    
-    # Ensure timestamp is datetime
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    
-    # Prepare features for model
-    categorical_cols = ["method", "protocol"]
-    for col in categorical_cols:
-        df[col] = LabelEncoder().fit_transform(df[col])
-    
-    # Select features for model
-    X = df[[
-    'url_length',
-    'url_depth',
-    'num_encoded_chars',
-    'num_special_chars',
-    'bytes_sent',
-    'status_code']]
-    
-    # Use our model to predict
-    global iso_model
-    
-    # If we have enough data, refit the model occasionally
-    if len(df) > 50 and not hasattr(iso_model, "fitted_"):
-        iso_model.fit(X)
-        iso_model.fitted_ = True
-        # Save the model
-        with open(model_path, "wb") as f:
-            pickle.dump(iso_model, f)
-        logger.info("Refitted and saved Isolation Forest model")
-    
-    # Predict anomalies
-    df["anomaly"] = iso_model.predict(X)
-    df["anomaly_score"] = iso_model.decision_function(X)
-    
-    return df.to_dict(orient="records")
-
-# === Summarize Logs ===
-def summarize_logs(logs_df):
-    """Generate a summary of logs"""
-    # Convert to DataFrame if it's a list
-    if isinstance(logs_df, list):
-        if not logs_df:  # Check if the list is empty
-            return {
-                "message": "No logs to summarize"
-            }
-        logs_df = pd.DataFrame(logs_df)
-    
-    # Check if DataFrame is empty after conversion
-    if isinstance(logs_df, pd.DataFrame) and logs_df.empty:
-        return {
-            "message": "No logs to summarize"
-        }
-    
-    # Ensure timestamp is datetime
-    logs_df["timestamp"] = pd.to_datetime(logs_df["timestamp"])
-    
-    # Calculate summary statistics
-    try:
-        time_range_start = logs_df["timestamp"].min()
-        time_range_end = logs_df["timestamp"].max()
-        
-        # Count by method
-        method_counts = logs_df["method"].value_counts().to_dict()
-        
-        # Count by URL
-        top_endpoints = logs_df["url"].value_counts().head(5).to_dict()
-        
-        # Count by status code
-        status_counts = logs_df["status_code"].value_counts().to_dict()
-        
-        # Anomaly information
-        anomaly_count = (logs_df["anomaly"] == -1).sum() if "anomaly" in logs_df.columns else 0
-        
-        # Detailed anomaly logs
-        anomaly_logs = []
-        if "anomaly" in logs_df.columns:
-            anomalies = logs_df[logs_df["anomaly"] == -1]
-            for _, row in anomalies.iterrows():
-                anomaly_logs.append(f"{row['timestamp'].strftime('%Y-%m-%dT%H:%M:%S')} - ANOMALY: {row['method']} {row['url']} {row['status_code']}")
-        
-        return {
-            "time_range_start": time_range_start,
-            "time_range_end": time_range_end,
-            "total_logs": len(logs_df),
-            "anomaly_count": anomaly_count,
-            "top_endpoints": top_endpoints,
-            "method_counts": method_counts,
-            "status_counts": status_counts,
-            "anomaly_logs": anomaly_logs
-        }
-    except Exception as e:
-        logger.error(f"Error generating summary: {e}", exc_info=True)
-        return {
-            "error": str(e),
-            "message": "Failed to generate summary"
-        }
+# === Store Logs ===
+def store_logs(batch):
+    """Persist a batch of scored logs to the archive and to ChromaDB (for semantic search).
+    When the storage queue retries the batch, the seqs reserved and the stores that
+    succeeded the first time are kept in its ``state``."""
+    state = batch.state
+    if "seqs" not in state:
+        state["seqs"] = log_sequence.reserve(len(batch))
+        state["stored_at"] = datetime.now(timezone.utc)
+    seqs, stored_at = state["seqs"], state["stored_at"]
+    if log_archive is not None and not state.get("archived"):
+        start = time.perf_counter_ns()
+        try:
+            segment = log_archive.append(batch, seqs, stored_at)
+            state["archived"] = True
+            log_index.add_segment(segment)
+            archive_seconds.observe_ns(time.perf_counter_ns() - start)
+        except Exception as e:
+            logger.error(f"Failed to archive logs: {e}", exc_info=True)
+    if not state.get("chromadb"):
+        state["chromadb"] = store_logs_in_chromadb(batch, seqs, stored_at)
+    return state["chromadb"] and (log_archive is None or state.get("archived", False))
 
-# === Store Logs in ChromaDB ===
-def store_logs_in_chromadb(logs_with_anomalies):
+@timed(PIPELINE_STAGE_SECONDS.labels("store_chromadb"))
+def store_logs_in_chromadb(logs_with_anomalies, seqs, stored_at):
     """Store logs with anomaly detection in ChromaDB"""
     try:
         documents = []
         metadatas = []
         ids = []
         
-        for log in logs_with_anomalies:
+        for log, seq in zip(logs_with_anomalies, seqs):
             log_id = str(uuid.uuid4())
-            documents.append(str(log))
+            documents.append(encode_log_document(log))
             metadata = {
+                "seq": seq,  # Storage order, used for paging by recency
                 "timestamp": str(log["timestamp"]),
                 "ip": log["ip"],
                 "url": log["url"],
                 "method": log["method"],
                 "status_code": int(log["status_code"]),
-                "stored_at": datetime.now().isoformat(),  # Add storage timestamp
+                "tenant": log.get("tenant", DEFAULT_TENANT),
+                "stored_at": stored_at.isoformat(),  # Add storage timestamp
             }
             
             if "anomaly" in log:
                 metadata["anomaly_label"] = int(log["anomaly"])
                 metadata["anomaly_score"] = float(log["anomaly_score"])
+            if log.get("model_version") is not None:
+                metadata["model_version"] = int(log["model_version"])
             
             metadatas.append(metadata)
             ids.append(log_id)
@@ -295,12 +480,31 @@ def store_logs_in_chromadb(logs_with_anomalies):
             metadatas=metadatas,
             ids=ids
         )
-        logger.info(f"Stored {len(logs_with_anomalies)} logs in ChromaDB")
+        logger.info("Stored %d logs in ChromaDB", len(logs_with_anomalies))
         return True
     except Exception as e:
         logger.error(f"Failed to store logs in ChromaDB: {e}")
         return False
 
+def expire_logs(max_seq):
+    """Forget the logs the archive dropped for retention in the index and ChromaDB too"""
+    log_index.drop_before(max_seq + 1)
+    try:
+        logs_col.delete(where={"seq": {"$lte": max_seq}})
+        logger.info(f"Expired ChromaDB logs up to seq {max_seq}")
+    except Exception as e:
+        logger.error(f"Failed to expire ChromaDB logs: {e}")
+
+# Ingest only queues logs; storage writes happen in large batches in the background
+storage_queue = WriteBehindQueue(
+    store_logs,
+    max_queue=STORAGE_QUEUE_MAX,
+    batch_size=STORAGE_BATCH_SIZE,
+    flush_interval_ms=STORAGE_FLUSH_INTERVAL_MS,
+    retries=STORAGE_FLUSH_RETRIES,
+    dead_letter_path=STORAGE_DEAD_LETTER_PATH,
+)
+
 # === Clear Logs from ChromaDB ===
 def clear_logs_from_chromadb():
     """Clear logs from ChromaDB - DISABLED to preserve historical logs"""
@@ -308,13 +512,14 @@ def clear_logs_from_chromadb():
     return True
 
 # === Append Summary to File ===
-def append_summary_to_file(summary):
-    """Append summary to log_summary.txt file"""
+def append_summary_to_file(summary, path=SUMMARY_FILE_PATH):
+    """Append summary to log_summary.txt file (or a tenant's summary file)"""
     try:
-        with open(SUMMARY_FILE_PATH, "a") as f:
+        with open(path, "a") as f:
             f.write(f"--- SUMMARY FOR {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
             f.write(f"Time Range: {summary['time_range_start']} to {summary['time_range_end']}\n")
             f.write(f"Total Logs: {summary['total_logs']}\n")
+            f.write(f"Distinct IPs: {summary['distinct_ips']}\n")
             f.write(f"Anomalies Detected: {summary['anomaly_count']}\n\n")
             
             f.write("Top Endpoints:\n")
@@ -340,69 +545,264 @@ def append_summary_to_file(summary):
             
             f.write("--------------------------------------------------\n\n")
         
-        logger.info("Appended summary to log_summary.txt")
+        logger.info(f"Appended summary to {os.path.basename(path)}")
         return True
     except Exception as e:
         logger.error(f"Failed to append summary to file: {e}")
         return False
 
-# === Process Logs and Generate Summary ===
-async def process_logs_and_generate_summary():
-    """Process logs and generate summary if needed"""
-    global last_summary_time
-    global log_buffer
-    
-    current_time = datetime.now()
-    
-    # Check if it's time to generate a summary
-    time_since_last_summary = (current_time - last_summary_time).total_seconds() / 60
-    
-    logger.debug(f"Time since last summary: {time_since_last_summary:.2f} minutes. Buffer size: {len(log_buffer)} logs")
+# === Multi-Worker Coordination ===
+async def broadcast_to_all_workers(message, tenant=None):
+    """Broadcast to the clients of every worker, not just the ones connected to this one"""
+    if shared_state is None:
+        await manager.broadcast(message, tenant)
+    else:
+        await asyncio.to_thread(shared_state.publish, (tenant, message))
+
+def take_partial():
+    """This worker's open summary windows since the last hand-over, overall and per tenant"""
+    return {"all": summary_windows.take_state(), "tenants": tenants.take_states()}
+
+def merge_partial(partial):
+    summary_windows.merge(partial["all"])
+    tenants.merge_states(partial["tenants"])
+
+def tenant_models():
+    return [tenant.models for tenant in tenants if tenant.models is not None]
+
+async def refit_tenant_models(interval_minutes):
+    """Refit every tenant's own model every ``interval_minutes`` while its logs keep arriving"""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        for models in tenant_models():
+            try:
+                await models.refit()
+            except Exception as e:
+                logger.error(f"Scheduled tenant model refit failed: {e}", exc_info=True)
+
+def apply_archive_changes(added, dropped):
+    """Index segments other workers wrote and forget the logs the leader expired"""
+    for segment in added:
+        log_index.add_segment(segment, indexed=dropped)
+    # Dropped segments not replaced by a compacted copy were removed by retention
+    expired = [s for s in dropped if not any(a.first_seq <= s.first_seq and s.last_seq <= a.last_seq for a in added)]
+    if expired:
+        log_index.drop_before(max(segment.last_seq for segment in expired) + 1)
+
+def become_leader():
+    """Start the work only one worker may do: summaries, archive maintenance and scheduled refits"""
+    if shared_state is not None:
+        fired_until = shared_state.get("summary_fired_until")
+        if fired_until:
+            summary_windows.close_until(int(fired_until))
+    asyncio.create_task(background_processing())
+    logger.info("Started background processing")
+    if MODEL_REFIT_INTERVAL_MINUTES > 0:
+        asyncio.create_task(model_manager.run_schedule(MODEL_REFIT_INTERVAL_MINUTES))
+        if TENANT_MODELS:
+            asyncio.create_task(refit_tenant_models(MODEL_REFIT_INTERVAL_MINUTES))
+        logger.info(f"Scheduled model refits every {MODEL_REFIT_INTERVAL_MINUTES} minutes")
+    if log_archive is not None and ARCHIVE_MAINTENANCE_INTERVAL_MINUTES > 0:
+        asyncio.create_task(log_archive.run_maintenance(
+            ARCHIVE_MAINTENANCE_INTERVAL_MINUTES, expire_logs, compact_seconds=ARCHIVE_COMPACT_INTERVAL_SECONDS
+        ))
+        logger.info(f"Scheduled archive maintenance every {ARCHIVE_MAINTENANCE_INTERVAL_MINUTES} minutes")
+    if rollup_store is not None and ROLLUP_COMPACT_INTERVAL_MINUTES > 0:
+        asyncio.create_task(rollup_store.run_compaction(ROLLUP_COMPACT_INTERVAL_MINUTES))
+        logger.info(f"Scheduled summary rollups every {ROLLUP_COMPACT_INTERVAL_MINUTES} minutes")
+
+async def sync_shared_state():
+    """Every few seconds: hand this worker's summary aggregates to the leader, relay the
+    leader's broadcasts to this worker's clients, pick up archive segments and model
+    versions from other workers, and take over as leader if the leader has exited"""
+    last_event_id = await asyncio.to_thread(shared_state.last_event_id)
+    while True:
+        try:
+            if not shared_state.leader.held and await asyncio.to_thread(shared_state.leader.try_acquire):
+                become_leader()
+            # The leader keeps its own windows, they close where they are
+            if summary_windows and not shared_state.leader.held:
+                await asyncio.to_thread(shared_state.push_partial, os.getpid(), take_partial())
+            for event_id, (tenant, message) in await asyncio.to_thread(shared_state.events_after, last_event_id):
+                last_event_id = event_id
+                await manager.broadcast(message, tenant)
+            if log_archive is not None:
+                added, dropped = await asyncio.to_thread(log_archive.refresh)
+                if added or dropped:
+                    await asyncio.to_thread(apply_archive_changes, added, dropped)
+            version = await asyncio.to_thread(model_manager.reload_if_changed)
+            if version is not None:
+                logger.info(f"Switched to model v{version} published by another worker")
+            for models in tenant_models():
+                await asyncio.to_thread(models.reload_if_changed)
+        except Exception as e:
+            logger.error(f"Shared state sync failed: {e}", exc_info=True)
+        await asyncio.sleep(SHARED_STATE_SYNC_SECONDS)
+
+# === Event-Time Summaries ===
+async def fire_summaries():
+    """Write and broadcast a summary for every event-time window the watermark has closed"""
+    # With several workers the leader summarizes everyone's logs from their partials
+    if shared_state is not None:
+        for partial in await asyncio.to_thread(shared_state.take_partials):
+            merge_partial(partial)
     
-    if time_since_last_summary >= SUMMARY_INTERVAL_MINUTES and log_buffer:
-        logger.info(f"Summary condition met: {time_since_last_summary:.2f} minutes since last summary, buffer has {len(log_buffer)} logs")
+    fired = summary_windows.fire() if summary_windows.due() else []
+    for start, end, summary, state in fired:
+        started = time.perf_counter_ns()
         try:
-            logger.info(f"Generating summary for {len(log_buffer)} logs")
-            
-            # Process anomalies
-            logs_with_anomalies = detect_anomalies(log_buffer)
-            logger.debug(f"Anomaly detection complete: {sum(1 for log in logs_with_anomalies if log.get('anomaly', 0) == -1)} anomalies found")
+            logger.info(f"Summarizing window {summary['time_range_start']} to {summary['time_range_end']}: "
+                        f"{summary['total_logs']} logs")
             
-            # Generate summary
-            summary = summarize_logs(logs_with_anomalies)
-            logger.debug(f"Summary generated: {summary}")
-            
-            # Append summary to file
+            # Logs were scored and aggregated on ingest, so this is just a snapshot
             success = append_summary_to_file(summary)
             logger.info(f"Summary appended to file: {success}")
             
             # Don't clear logs from ChromaDB - we disabled this function
-            clear_success = clear_logs_from_chromadb()
-            logger.info(f"ChromaDB preserved: {clear_success}")
-            
-            # Don't reset buffer - keep historical logs
-            # old_buffer_size = len(log_buffer)
-            # log_buffer = []
-            # logger.debug(f"Log buffer reset: {old_buffer_size} logs cleared")
-            logger.debug(f"Keeping log buffer intact with {len(log_buffer)} logs to preserve history")
+            clear_logs_from_chromadb()
             
-            # Update last summary time
-            last_summary_time = current_time
-            logger.info(f"Last summary time updated to: {last_summary_time}")
+            if rollup_store is not None:
+                await asyncio.to_thread(rollup_store.add, ALL_TENANTS, start, end, state)
             
             # Broadcast summary to connected clients
-            await manager.broadcast({
+            await broadcast_to_all_workers({
                 "type": "summary",
                 "data": summary
             })
-            
-            logger.info("Summary generated and broadcast to clients")
+            summary_seconds.observe_ns(time.perf_counter_ns() - started)
+        except Exception as e:
+            logger.error(f"Failed to write or broadcast summary: {e}", exc_info=True)
+    if fired and shared_state is not None:
+        await asyncio.to_thread(shared_state.set, "summary_fired_until", summary_windows.fired_until)
+    
+    # Each tenant's own summary stream, sent only to that tenant's clients; clients
+    # without an API key get the summaries above
+    for tenant, start, end, tenant_summary, state in tenants.fire_summaries():
+        try:
+            append_summary_to_file(tenant_summary, tenants.summary_path(tenant))
+            if rollup_store is not None:
+                await asyncio.to_thread(rollup_store.add, tenant, start, end, state)
+            if tenant != DEFAULT_TENANT:
+                await broadcast_to_all_workers({"type": "summary", "tenant": tenant, "data": tenant_summary}, tenant)
         except Exception as e:
-            logger.error(f"Failed to process logs and generate summary: {e}", exc_info=True)
-    elif time_since_last_summary < SUMMARY_INTERVAL_MINUTES:
-        logger.debug(f"Not enough time elapsed for summary. Waiting {SUMMARY_INTERVAL_MINUTES - time_since_last_summary:.2f} more minutes")
-    elif not log_buffer:
-        logger.debug("Log buffer is empty, no summary to generate")
+            logger.error(f"Failed to write or broadcast summary for tenant {tenant}: {e}", exc_info=True)
+
+def summary_timeout():
+    """Seconds the summary task may sleep before open windows close for lack of logs"""
+    deadlines = [d for d in (summary_windows.idle_deadline(), tenants.idle_deadline()) if d is not None]
+    timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+    if shared_state is not None:  # other workers' partials arrive every sync
+        timeout = SHARED_STATE_SYNC_SECONDS if timeout is None else min(timeout, SHARED_STATE_SYNC_SECONDS)
+    return timeout
+
+# === Ingest Flow Control ===
+ingest_limiter = IngestLimiter(
+    max_pending=INGEST_MAX_PENDING,
+    credit_window=INGEST_CREDIT_WINDOW,
+    policy=INGEST_SHED_POLICY,
+    shed_threshold=INGEST_SHED_THRESHOLD,
+    sample_rate=INGEST_SAMPLE_RATE,
+    pressure=lambda: len(storage_queue) >= STORAGE_QUEUE_MAX * INGEST_SHED_THRESHOLD,
+)
+
+# === Micro-Batching of Single-Log Messages ===
+async def process_single_log_batch(items):
+    """Score, record and store single-log WebSocket messages from all connections as one batch.
+    
+    Items are (log, store) pairs; logs shed to degraded ingestion are not stored.
+    """
+    logs_with_anomalies = await score_logs([log for log, _ in items])
+    record_logs(logs_with_anomalies)
+    stored = [log for log, (_, store) in zip(logs_with_anomalies, items) if store]
+    if stored:
+        await storage_queue.enqueue(stored)
+    logger.debug("Processed micro-batch of %d single logs", len(items))
+
+    return logs_with_anomalies
+
+single_log_batcher = MicroBatcher(
+    process_single_log_batch,
+    max_batch_size=MICROBATCH_MAX_SIZE,
+    max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+)
+
+async def send_log_reply(previous_reply, websocket, pending, build_response, flow=None, count=0):
+    """Send the reply for a micro-batched log once it is scored.
+    
+    Waits for the connection's previous reply first so replies keep message order
+    while the receive loop goes on reading frames. With a flow window, the ``count``
+    processed logs are released and any credits earned are granted after the reply.
+    """
+    if previous_reply is not None:
+        await asyncio.wait([previous_reply])
+    try:
+        response = build_response(await pending)
+    except Exception as e:
+        response = {"type": "error", "message": f"Failed to process log: {str(e)}"}
+    grant = ingest_limiter.release(flow, count) if flow is not None else 0
+    try:
+        await websocket.send_text(dumps_text(response))
+        if grant:
+            await websocket.send_json(flow.grant_message(grant))
+    except Exception as e:
+        logger.debug("Could not deliver log reply, client likely disconnected: %s", e)
+
+async def send_shed_notice(previous_reply, websocket, flow, admission):
+    """Tell an ingest client, in message order, how many logs of a frame were shed and how"""
+    if previous_reply is not None:
+        await asyncio.wait([previous_reply])
+    grant = ingest_limiter.grant(flow)
+    try:
+        await websocket.send_json({
+            "type": "shed",
+            "action": admission.shed_action,
+            "count": admission.shed_count,
+            "retry_after_ms": ingest_limiter.retry_after_ms(),
+        })
+        if grant:
+            await websocket.send_json(flow.grant_message(grant))
+    except Exception as e:
+        logger.debug("Could not deliver shed notice, client likely disconnected: %s", e)
+
+async def send_throttle_notice(previous_reply, websocket, tenant, flow=None):
+    """Tell a client, in message order, that a log was over its tenant's rate quota"""
+    if previous_reply is not None:
+        await asyncio.wait([previous_reply])
+    grant = ingest_limiter.release(flow, 1) if flow is not None else 0
+    try:
+        await websocket.send_json({"type": "throttled", "tenant": tenant, **throttle_notice({tenant: 1})})
+        if grant:
+            await websocket.send_json(flow.grant_message(grant))
+    except Exception as e:
+        logger.debug("Could not deliver throttle notice, client likely disconnected: %s", e)
+
+async def process_application_batch(logs_batch, store=True):
+    """Score, record and (unless ingestion is degraded) store a batch frame from the application backend.
+    
+    Logs over their tenant's rate quota are dropped; returns the scored logs and the
+    throttled counts by tenant.
+    """
+    processed_logs, throttled = throttle_logs(prepare_log_features_batch(logs_batch))
+    if throttled:
+        logger.warning("Throttled %d logs from %d tenants over their rate quota", sum(throttled.values()), len(throttled))
+    logs_with_anomalies = await score_logs(processed_logs)
+    record_logs(logs_with_anomalies)
+    if store and logs_with_anomalies:
+        await storage_queue.enqueue(logs_with_anomalies)
+        logger.debug("💾 Queued %d logs for ChromaDB", len(logs_with_anomalies))
+
+    return logs_with_anomalies, throttled
+
+def application_batch_response(logs_with_anomalies, throttled=None, profile="full"):
+    """Reply for a batch frame from the application backend, with is_anomaly flags"""
+    response = {"type": "logs_received", **scored_batch_payload(logs_with_anomalies, profile)}
+    if throttled:
+        response.update(throttle_notice(throttled))
+    return response
+
+def application_log_response(scored_log, profile="full"):
+    """Reply for a single log from the application backend, with an is_anomaly flag"""
+    return {"type": "log_received", **scored_log_payload(scored_log, profile)}
 
 # === Chat Request Model ===
 class ChatRequest(BaseModel):
@@ -431,6 +831,21 @@ class AnomalyResponse(BaseModel):
     anomaly_details: list
     prediction_time: str
 
+class LoggingSettings(BaseModel):
+    """Runtime logging changes; fields left out stay as they are"""
+    level: str = None
+    loggers: dict[str, str | None] = None  # logger name -> level, None to follow the root level
+    format: str = None
+    rate_limit_per_second: int = None
+
+def read_scope(request):
+    """Tenant whose logs and summaries a request may read: the ``X-API-Key``'s, the default
+    tenant's without a key, or None (every tenant) for ``ADMIN_API_KEY``"""
+    api_key = request.headers.get("x-api-key")
+    if ADMIN_API_KEY and api_key and hmac.compare_digest(api_key.encode(), ADMIN_API_KEY.encode()):
+        return None
+    return tenant_id(api_key)
+
 # === API Routes ===
 @app.get("/")
 async def root():
@@ -438,27 +853,156 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "storage": storage_queue.stats(),
+        "llm": llm_gateway.stats(),
+        "broadcast": manager.stats(),
+        "ingest": ingest_limiter.stats(),
+        "shared_state": shared_state.stats() if shared_state is not None else None,
+        "tenants": tenants.stats(),
+        "summaries": summary_windows.stats(),
+        "rollups": rollup_store.stats() if rollup_store is not None else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Counters, gauges and per-stage / per-endpoint latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/logging")
+async def logging_status():
+    """Log levels, format, rate limit and the records dropped or suppressed so far"""
+    if log_control is None:
+        return {"enabled": False}
+    return {"enabled": True, **log_control.stats()}
+
+@app.post("/logging")
+async def update_logging(settings: LoggingSettings):
+    """Change log levels (root or per logger), format or rate limit without a restart.
+    With several workers only the one answering is changed."""
+    if log_control is None:
+        return JSONResponse(status_code=409, content={"message": "Logging is configured outside the server"})
+    try:
+        log_control.configure(settings.level, settings.loggers, settings.format, settings.rate_limit_per_second)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    return {"enabled": True, **log_control.stats()}
+
+@app.get("/connections")
+async def connections_status():
+    """Connected WebSocket clients with their outbound queue depth and delivery lag"""
+    return manager.stats(per_client=True)
+
+@app.get("/tenants")
+async def tenants_status():
+    """Tenants seen by this worker with their quota use, buffered logs and model"""
+    return tenants.stats(per_tenant=True)
+
+@app.get("/archive")
+async def archive_status():
+    """On-disk log archive size, retention and maintenance state"""
+    if log_archive is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(log_archive.stats), "index": log_index.stats()}
+
+@app.get("/rollups")
+async def summary_rollups(request: Request, since: str = None, until: str = None, resolution: str = None):
+    """Summary of a time range from the rolled-up summary history
+    
+    Parameters:
+    - since / until: The range (ISO 8601), by default the last 24 hours
+    - resolution: "window", "hour" or "day" for one summary per window, hour or day
+      with logs in the range instead of one for the whole range
+    
+    Covers the ``X-API-Key`` header's tenant (the default tenant without one, every
+    tenant with ``ADMIN_API_KEY``). ``rows_read`` is how many stored rollups were merged
+    to answer.
+    """
+    if rollup_store is None:
+        return {"enabled": False}
+    tenant = read_scope(request)
+    end = to_epoch_ns(until) if until is not None else time.time_ns()
+    start = to_epoch_ns(since) if since is not None else end - 24 * 3600 * 1_000_000_000
+    if start == NAT or end == NAT:
+        return JSONResponse(status_code=400, content={"message": "since / until must be ISO 8601 timestamps"})
+    try:
+        result, rows_read = await asyncio.to_thread(
+            rollup_store.query, ALL_TENANTS if tenant is None else tenant, start, end, resolution
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    key = "summaries" if resolution else "summary"
+    return {"enabled": True, "since": format_epoch_ns(start), "until": format_epoch_ns(end),
+            "resolution": resolution, key: result, "rows_read": rows_read}
+
+@app.get("/model")
+async def model_status():
+    """Current anomaly model version and refit state"""
+    return model_manager.stats()
+
+@app.get("/features")
+async def window_features(ip: str = None, url: str = None, user_agent: str = None):
+    """Rolling 1m/5m/15m request, error and byte statistics of an IP, URL or user agent"""
+    if feature_store is None:
+        return {"enabled": False}
+    keys = {"ip": ip, "url": url, "user_agent": user_agent}
+    return {
+        "enabled": True,
+        **feature_store.stats(),
+        **{field: feature_store.lookup(field, key) for field, key in keys.items() if key is not None},
+    }
+
+@app.post("/model/refit")
+async def refit_model(force: bool = False):
+    """Refit the anomaly model on recent logs in the background and hot-swap it in"""
+    try:
+        version = await model_manager.refit(force=force)
+    except Exception as e:
+        logger.error(f"Model refit failed: {e}", exc_info=True)
+        return JSONResponse(
+            status_code=500,
+            content={"message": f"Model refit failed: {str(e)}"}
+        )
+    if version is None:
+        return JSONResponse(
+            status_code=409,
+            content={"message": "Not enough new logs to refit the model", **model_manager.stats()}
+        )
+    return {"message": "Model refitted", **model_manager.stats()}
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
-    """Chat endpoint that uses log summaries as context"""
+async def chat(request: ChatRequest, http_request: Request):
+    """Chat endpoint that uses log summaries as context: the X-API-Key tenant's own (the
+    default tenant's without a key, every tenant's with ADMIN_API_KEY)"""
     try:
         query = request.query
-        
-        # Read the log_summary.txt file
-        if not os.path.exists(SUMMARY_FILE_PATH):
+        tenant = read_scope(http_request)
+        store = tenants.summary_store(tenant) if tenant is not None else summary_store
+        if store is None:
             return JSONResponse(
                 status_code=404,
                 content={"message": "No log summaries available yet"}
             )
         
-        with open(SUMMARY_FILE_PATH, "r") as f:
-            log_summaries = f.read()
+        # Retrieve the most recent and most relevant summaries within the token budget
+        since = datetime.now() - timedelta(hours=CHAT_LOOKBACK_HOURS) if CHAT_LOOKBACK_HOURS > 0 else None
+        windows = await asyncio.to_thread(
+            store.select, query, CHAT_CONTEXT_TOKEN_BUDGET, CHAT_RECENT_SUMMARIES, since
+        )
+        if not windows:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "No log summaries available yet"}
+            )
+        log_summaries = "\n".join(window.text for window in windows)
+        logger.debug("Chat context: %d of %d summaries", len(windows), len(store.windows))
         
         # Create the prompt with the log summaries as context
         prompt = f"""
         You are a log analysis assistant. Answer the user's query based on the log summaries provided.
+        The summaries are the most recent ones and those most relevant to the query, oldest first.
         
         === Log Summaries ===
         {log_summaries}
@@ -469,15 +1013,19 @@ async def chat(request: ChatRequest):
         Please provide a concise and informative answer based only on the information in the log summaries.
         """
         
-        # Call the Groq API
-        response = groq_client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
+        # Ask the LLM without blocking the event loop; identical questions about the
+        # same summaries share one completion
+        cache_key = (" ".join(query.split()), tenant, store.version)
+        try:
+            answer = await llm_gateway.complete(prompt, cache_key=cache_key)
+        except asyncio.TimeoutError:
+            return JSONResponse(
+                status_code=504,
+                content={"message": f"The LLM did not answer within {LLM_TIMEOUT_SECONDS:g}s"}
+            )
         
         return {
-            "response": response.choices[0].message.content
+            "response": answer
         }
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
@@ -487,20 +1035,41 @@ async def chat(request: ChatRequest):
         )
 
 @app.post("/anomaly_detection")
-async def anomaly_detection(log_batch: LogBatch):
+async def anomaly_detection(request: Request, profile: str = "full"):
     """Anomaly detection endpoint for real-time detection of anomalies in logs.
     
-    This endpoint accepts a batch of log entries and returns anomaly detection results
-    along with historical context.
+    This endpoint accepts a batch of log entries (shaped like ``LogBatch``) and returns
+    anomaly detection results along with historical context. The raw JSON goes straight
+    to the batch feature extractor instead of building a pydantic model per log.
+    ``profile`` trims the response: ``full`` echoes every scored log and the 100 most
+    recent buffered logs, ``anomalies`` only the anomaly details, ``counts`` only totals.
+    Logs without an ``apiKey`` belong to the ``X-API-Key`` header's tenant, whose recent
+    logs are then the historical context; logs over their tenant's rate quota are
+    dropped, and if nothing is left the answer is 429.
     """
     try:
-        logger.debug(f"Received anomaly detection request with {len(log_batch.logs)} logs")
         start_time = datetime.now()
+        try:
+            profile = parse_profile(profile)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"message": str(e)})
+        try:
+            payload = await request.json()
+            raw_logs = payload["logs"]
+            if not isinstance(raw_logs, list):
+                raise TypeError("'logs' must be a list")
+        except Exception as e:
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"Invalid request body, expected {{\"logs\": [...]}}: {str(e)}"}
+            )
+        logger.debug("Received anomaly detection request with %d logs", len(raw_logs))
         
         # Extract and process logs from the request
+        api_key = request.headers.get("x-api-key")
         try:
-            logs_data = [prepare_log_features(log.dict()) for log in log_batch.logs]
-            logger.debug(f"Processed {len(logs_data)} logs through feature engineering")
+            logs_data = prepare_log_features_batch(raw_logs, tenant_id(api_key))
+            logger.debug("Processed %d logs through feature engineering", len(raw_logs))
         except Exception as e:
             logger.error(f"Error processing log features: {e}")
             return JSONResponse(
@@ -508,17 +1077,26 @@ async def anomaly_detection(log_batch: LogBatch):
                 content={"message": f"Error processing logs: {str(e)}"}
             )
         
-        if not logs_data:
+        if not raw_logs:
             return JSONResponse(
                 status_code=400,
                 content={"message": "No valid logs provided"}
             )
         
+        logs_data, throttled = throttle_logs(logs_data)
+        if throttled and not len(logs_data["url"]):
+            notice = throttle_notice(throttled)
+            return JSONResponse(
+                status_code=429,
+                content={"message": "Rate quota exceeded", **notice},
+                headers={"Retry-After": str(max(1, -(-notice["retry_after_ms"] // 1000)))}
+            )
+        
         # Process anomalies using the Isolation Forest model
         try:
-            logs_with_anomalies = detect_anomalies(logs_data)
+            logs_with_anomalies = await score_logs(logs_data)
             anomaly_count = sum(1 for log in logs_with_anomalies if log.get("anomaly", 0) == -1)
-            logger.debug(f"Detected {anomaly_count} anomalies in {len(logs_with_anomalies)} logs")
+            logger.debug("Detected %d anomalies in %d logs", anomaly_count, len(logs_with_anomalies))
         except Exception as e:
             logger.error(f"Error in anomaly detection: {e}")
             return JSONResponse(
@@ -528,17 +1106,7 @@ async def anomaly_detection(log_batch: LogBatch):
         
         # Extract anomaly details
         try:
-            anomaly_details = [
-                {
-                    "timestamp": log.get("timestamp"),
-                    "ip": log.get("ip"),
-                    "method": log.get("method"),
-                    "url": log.get("url"),
-                    "status_code": log.get("status_code"),
-                    "anomaly_score": log.get("anomaly_score")
-                }
-                for log in logs_with_anomalies if log.get("anomaly", 0) == -1
-            ]
+            details = anomaly_details(logs_with_anomalies) if profile != "counts" else None
         except Exception as e:
             logger.error(f"Error extracting anomaly details: {e}")
             return JSONResponse(
@@ -549,37 +1117,35 @@ async def anomaly_detection(log_batch: LogBatch):
         # Add logs to buffer and ChromaDB (if not empty)
         if logs_with_anomalies:
             try:
-                global log_buffer
-                log_buffer.extend(logs_with_anomalies)
-                store_result = store_logs_in_chromadb(logs_with_anomalies)
-                logger.debug(f"Stored logs in ChromaDB: {store_result}")
+                record_logs(logs_with_anomalies)
+                await storage_queue.enqueue(logs_with_anomalies)
+                logger.debug("Queued %d logs for ChromaDB", len(logs_with_anomalies))
             except Exception as e:
                 logger.error(f"Error storing logs: {e}")
                 # Don't return error here, continue processing
         
-        # Get historical context from log buffer
-        historical_logs = log_buffer[-100:]  # Get last 100 logs for context
-        
-        # Check if we need to generate a summary (asynchronously)
-        asyncio.create_task(process_logs_and_generate_summary())
-        
-        # Prepare response
+        # Prepare response, with only what the profile asks for
+        current_analysis = {
+            "total_logs": len(logs_with_anomalies),
+            "anomalies_detected": anomaly_count,
+        }
+        if throttled:
+            current_analysis.update(throttle_notice(throttled))
+        context_buffer = tenants.get(tenant_id(api_key)).buffer if api_key else log_buffer
+        historical_context = {"total_logs_in_buffer": len(context_buffer)}
+        if details is not None:
+            current_analysis["anomaly_details"] = details
+        if profile == "full":
+            current_analysis["logs_with_features"] = logs_with_anomalies
+            historical_context["recent_logs"] = context_buffer[-100:].to_records()  # Last 100 logs for context
         response = {
-            "current_analysis": {
-                "total_logs": len(logs_with_anomalies),
-                "anomalies_detected": anomaly_count,
-                "anomaly_details": anomaly_details,
-                "logs_with_features": logs_with_anomalies,
-            },
-            "historical_context": {
-                "total_logs_in_buffer": len(log_buffer),
-                "recent_logs": historical_logs,
-            },
+            "current_analysis": current_analysis,
+            "historical_context": historical_context,
             "prediction_time": (datetime.now() - start_time).total_seconds()
         }
         
-        logger.debug(f"Completed anomaly detection request in {response['prediction_time']} seconds")
-        return response
+        logger.debug("Completed anomaly detection request in %s seconds", response["prediction_time"])
+        return FastJSONResponse(response)
     
     except Exception as e:
         logger.error(f"Error in anomaly detection endpoint: {e}", exc_info=True)
@@ -588,54 +1154,188 @@ async def anomaly_detection(log_batch: LogBatch):
             content={"message": f"Error: {str(e)}"}
         )
 
+@app.post("/ingest")
+async def ingest_ndjson(request: Request, profile: str = "anomalies"):
+    """Streaming bulk ingest: an NDJSON body (one log object per line) of any size.
+    
+    Logs are parsed, scored, recorded and stored in chunks of ``INGEST_STREAM_CHUNK_LOGS``
+    while the upload is still arriving, and one NDJSON result line is streamed back per
+    chunk with its anomalies (per ``profile``), skipped lines and running totals, then a
+    final line with ``"done": true``. Memory use is bounded by the chunk size; a slow
+    reader of the results slows down the upload instead of buffering. Logs without an
+    ``apiKey`` belong to the ``X-API-Key`` header's tenant; logs over their tenant's
+    rate quota are dropped and counted as ``throttled``.
+    """
+    try:
+        profile = parse_profile(profile)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    default_tenant = tenant_id(request.headers.get("x-api-key"))
+    
+    async def results():
+        totals = {"logs": 0, "anomalies": 0, "errors": 0, "throttled": 0, "chunks": 0}
+        start_time = datetime.now()
+        try:
+            async for raw_logs, errors in iter_ndjson_chunks(
+                request.stream(), INGEST_STREAM_CHUNK_LOGS, INGEST_STREAM_MAX_LINE_BYTES,
+            ):
+                scored, throttled = [], {}
+                if raw_logs:
+                    logs_data, throttled = throttle_logs(prepare_log_features_batch(raw_logs, default_tenant))
+                    scored = await score_logs(logs_data)
+                    record_logs(scored)
+                    if scored:
+                        await storage_queue.enqueue(scored)
+                payload = scored_batch_payload(scored, profile)
+                if throttled:
+                    payload.update(throttle_notice(throttled))
+                totals["logs"] += payload["total_logs"]
+                totals["anomalies"] += payload["anomalies_detected"]
+                totals["errors"] += len(errors)
+                totals["throttled"] += sum(throttled.values())
+                totals["chunks"] += 1
+                line = {"chunk": totals["chunks"], **payload, "totals": dict(totals)}
+                if errors:
+                    line["errors"] = error_report(errors)
+                yield dumps(line) + b"\n"
+        except ClientDisconnect:
+            logger.warning(f"NDJSON ingest client disconnected after {totals['logs']} logs")
+            return
+        except Exception as e:
+            logger.error(f"NDJSON ingest failed after {totals['logs']} logs: {e}", exc_info=True)
+            yield dumps({"error": str(e), "totals": totals}) + b"\n"
+            return
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"NDJSON ingest of {totals['logs']} logs in {totals['chunks']} chunks took {elapsed:.2f}s")
+        yield dumps({"done": True, "totals": totals, "elapsed_seconds": elapsed}) + b"\n"
+    
+    return NDJSONStreamingResponse(results())
+
+def _chroma_where(where_filter):
+    """ChromaDB ``where`` for equality filters: several conditions must be combined with $and"""
+    if len(where_filter) > 1:
+        return {"$and": [{key: value} for key, value in where_filter.items()]}
+    return where_filter or None
+
 @app.get("/logs")
-async def get_logs(limit: int = 100, anomaly_only: bool = False, query: str = None):
+async def get_logs(request: Request, limit: int = 100, anomaly_only: bool = False, query: str = None, before: int = None,
+                   since: str = None, until: str = None, ip: str = None, status: str = None,
+                   url_prefix: str = None):
     """Retrieve logs from ChromaDB with optional filtering
     
-    This endpoint provides access to historical log data stored in ChromaDB.
+    This endpoint provides access to historical log data from the archive and ChromaDB.
     Parameters:
     - limit: Maximum number of logs to retrieve (default 100)
     - anomaly_only: If true, returns only anomalous logs (default false)
     - query: Optional search query to filter logs
+    - before: Cursor from a previous page's ``next_cursor``, returns the logs stored before it
+    - since / until: Only logs with a timestamp in this range (ISO 8601, inclusive)
+    - ip: Only logs from this client IP
+    - status: Only logs with this status code (e.g. 404) or class (e.g. 5xx)
+    - url_prefix: Only logs whose URL starts with this prefix
+    
+    Only the ``X-API-Key`` header's tenant's logs are returned (the default tenant's
+    without a key, every tenant's with ``ADMIN_API_KEY``).
+    Without a query, logs are read newest first by storage order (from the memory-mapped
+    archive, or by metadata filters on ChromaDB when the archive is disabled) and
+    ``next_cursor`` pages through older logs. A query runs a vector search. The field
+    filters are answered from the archive's secondary indexes and also narrow the
+    results of a query.
     """
+    tenant = read_scope(request)
+    index_filters = {
+        name: value
+        for name, value in (("since", since), ("until", until), ("ip", ip), ("status", status),
+                            ("url_prefix", url_prefix), ("tenant", tenant))
+        if value is not None
+    }
+    # The archive and ChromaDB filter on the tenant themselves
+    tenant_only = not query and log_archive is not None and list(index_filters) == ["tenant"]
+    if log_index is None or tenant_only:
+        index_filters.pop("tenant", None)
+    matches = None
+    if index_filters:
+        if log_index is None:
+            return JSONResponse(
+                status_code=400,
+                content={"message": "Field filters need the log archive (ARCHIVE_DIR)"}
+            )
+        try:
+            index_ranges = log_index.parse_filters(anomaly_only=anomaly_only, **index_filters)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"message": str(e)})
+        if query:
+            matches = await asyncio.to_thread(log_index.search, anomaly_only=anomaly_only, **index_filters)
+    
     try:
         # Prepare query parameters
         where_filter = {}
         if anomaly_only:
             where_filter["anomaly_label"] = -1
+        if tenant:
+            where_filter["tenant"] = tenant
         
-        # Query ChromaDB
-        results = logs_col.query(
-            query_texts=query if query else None,
-            n_results=limit,
-            where=where_filter if where_filter else None
-        )
+        next_cursor = None
+        if not query and log_archive is not None:
+            if index_filters:
+                logs, next_cursor = await asyncio.to_thread(
+                    log_index.page, log_archive, limit, before, anomaly_only=anomaly_only, **index_filters
+                )
+            else:
+                logs, next_cursor = await asyncio.to_thread(log_archive.page, limit, before, anomaly_only, tenant)
+            return {
+                "total": len(logs),
+                "logs": logs,
+                "next_cursor": next_cursor,
+            }
+        
+        if query:
+            results = await asyncio.to_thread(
+                logs_col.query,
+                query_texts=query,
+                n_results=limit,
+                where=_chroma_where(where_filter)
+            )
+            documents = results['documents'][0] if results['documents'] else []
+            metadatas = results['metadatas'][0] if results['metadatas'] else [{}] * len(documents)
+        else:
+            rows, next_cursor = await asyncio.to_thread(
+                fetch_log_page, logs_col, log_sequence.last, limit, before, where_filter
+            )
+            documents = [document for _, document, _ in rows]
+            metadatas = [metadata for _, _, metadata in rows]
         
         # Parse results
         logs = []
+        for i, (document, metadata) in enumerate(zip(documents, metadatas)):
+            try:
+                log_data = decode_log_document(document)
+                log_data['stored_at'] = metadata.get('stored_at')
+                if 'seq' in metadata:
+                    log_data['seq'] = metadata['seq']
+                logs.append(log_data)
+            except Exception as e:
+                logger.error(f"Error parsing log result {i}: {e}")
         
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i in range(len(results['documents'][0])):
-                try:
-                    # Extract the log from the document string
-                    log_str = results['documents'][0][i]
-                    log_data = eval(log_str)  # Convert string representation back to dict
-                    
-                    # Add metadata
-                    if results['metadatas'] and len(results['metadatas'][0]) > i:
-                        metadata = results['metadatas'][0][i]
-                        log_data['stored_at'] = metadata.get('stored_at')
-                    
-                    logs.append(log_data)
-                except Exception as e:
-                    logger.error(f"Error parsing log result {i}: {e}")
+        if matches is not None:
+            seqs = np.array([log.get('seq', -1) for log in logs], dtype=np.int64)
+            keep = np.isin(seqs, matches).tolist()
+            # Logs older than the index holds are checked on their own fields
+            logs = [
+                log for log, seq, kept in zip(logs, seqs.tolist(), keep)
+                if (kept or (not log_index.covers(seq) and log_index.record_matches(log, index_ranges)))
+                and (not url_prefix or str(log.get('url', '')).startswith(url_prefix))
+            ]
         
-        # Sort by timestamp (newest first)
-        logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        if query:
+            # Sort by timestamp (newest first)
+            logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
         
         return {
             "total": len(logs),
-            "logs": logs
+            "logs": logs,
+            "next_cursor": next_cursor,
         }
     
     except Exception as e:
@@ -648,19 +1348,21 @@ async def get_logs(limit: int = 100, anomaly_only: bool = False, query: str = No
 # === WebSocket Routes ===
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
     client_id = str(uuid.uuid4())[:8]  # Generate a short client ID for logging
+    await manager.connect(websocket, client_id)
     logger.info(f"Client {client_id} connected via WebSocket")
+    reply = None  # Last pending log acknowledgement, keeps acks in order
+    tenant = DEFAULT_TENANT  # Set by auth, from the client's API key
     
     try:
         while True:
             # Receive and parse the message
             data = await websocket.receive_text()
-            logger.debug(f"Received data from client {client_id}: {data[:100]}...")
+            logger.debug("Received data from client %s: %.100s...", client_id, data)
             
             try:
                 message = json.loads(data)
-                logger.info(f"Client {client_id} sent message type: {message.get('type', 'unknown')}")
+                logger.debug("Client %s sent message type: %s", client_id, message.get("type", "unknown"))
                 
                 if message["type"] == "auth":
                     # Handle authentication
@@ -670,8 +1372,10 @@ async def websocket_endpoint(websocket: WebSocket):
                         await websocket.send_json({"type": "error", "message": "API key not provided"})
                     else:
                         # In a real implementation, you'd validate the API key
-                        # For now, we'll accept any key
-                        logger.info(f"Client {client_id} authenticated successfully")
+                        # For now, we'll accept any key; it selects the client's tenant
+                        tenant = tenant_id(api_key)
+                        manager.set_tenant(websocket, tenant)
+                        logger.info(f"Client {client_id} authenticated successfully as tenant {tenant}")
                         await websocket.send_json({"type": "auth_success", "message": "Authenticated successfully"})
                 
                 elif message["type"] == "log":
@@ -679,26 +1383,22 @@ async def websocket_endpoint(websocket: WebSocket):
                     log_data = message.get("log", {})
                     
                     if log_data:
-                        logger.info(f"Received log from client {client_id}: {str(log_data)[:100]}...")
-                        
-                        # Process the log data
-                        processed_log = prepare_log_features(log_data)
-                        
-                        # Add to buffer
-                        log_buffer.append(processed_log)
-                        logger.debug(f"Added log to buffer. Current buffer size: {len(log_buffer)}")
-                        
-                        # Store in ChromaDB
-                        store_logs_in_chromadb([processed_log])
+                        logger.debug("Received log from client %s: %.100s...", client_id, log_data)
                         
-                        # Check if we need to generate a summary
-                        await process_logs_and_generate_summary()
+                        # Process the log data; scoring and storage happen in a shared micro-batch
+                        processed_log = prepare_log_features(log_data, tenant)
+                        if not tenants.throttle(processed_log["tenant"], 1):
+                            reply = asyncio.create_task(send_throttle_notice(reply, websocket, processed_log["tenant"]))
+                            continue
+                        pending = await single_log_batcher.submit((processed_log, True))
                         
-                        # Acknowledge receipt
-                        await websocket.send_json({"type": "log_received", "message": "Log received and processed"})
-                        logger.debug(f"Sent acknowledgment to client {client_id}")
+                        # Acknowledge receipt once the batch is processed
+                        reply = asyncio.create_task(send_log_reply(
+                            reply, websocket, pending,
+                            lambda _: {"type": "log_received", "message": "Log received and processed"},
+                        ))
                 else:
-                    logger.warning(f"Client {client_id} sent unknown message type: {message.get('type', 'unknown')}")
+                    logger.warning("Client %s sent unknown message type: %s", client_id, message.get("type", "unknown"))
                     
             except json.JSONDecodeError:
                 logger.error(f"Client {client_id} sent invalid JSON data")
@@ -715,107 +1415,78 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.websocket("/ws/application")
 async def application_websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint specifically for the application backend"""
-    await manager.connect(websocket)
     app_client_id = str(uuid.uuid4())[:8]  # Generate a short client ID for logging
+    await manager.connect(websocket, app_client_id)
     logger.info(f"🔗 Application backend {app_client_id} connected via WebSocket")
-    print(f"\n{'='*50}\n🔗 APPLICATION BACKEND {app_client_id} CONNECTED\n{'='*50}\n")
+    reply = None  # Last pending reply, keeps replies in order
+    flow = ingest_limiter.open(app_client_id)
+    await websocket.send_json(flow.grant_message())  # Initial credits
+    # How much of each scored log to send back: ?profile=full|anomalies|counts
+    try:
+        profile = parse_profile(websocket.query_params.get("profile"))
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "message": f"{e}, using 'full'"})
+        profile = "full"
     
     try:
         while True:
             # Receive and parse the message from application backend
             data = await websocket.receive_text()
-            logger.info(f"📦 RECEIVED DATA FROM APPLICATION BACKEND {app_client_id}: {data[:200]}...")
-            print(f"\n📦 RECEIVED DATA FROM APPLICATION BACKEND: {data[:200]}...\n")
+            logger.debug("📦 Received data from application backend %s: %.200s...", app_client_id, data)
             
             try:
                 message = json.loads(data)
-                logger.info(f"📝 Application {app_client_id} message type: {message.keys() if isinstance(message, dict) else 'not a dict'}")
+                logger.debug("📝 Application %s message keys: %s", app_client_id,
+                             message.keys() if isinstance(message, dict) else type(message).__name__)
             except json.JSONDecodeError as e:
                 logger.error(f"❌ JSON decode error from application backend: {e}")
-                print(f"\n❌ JSON DECODE ERROR: {e}\n")
                 await websocket.send_json({"type": "error", "message": "Invalid JSON format"})
                 continue
             
-            # Process log data from application backend
+            # Process log data from application backend; frames are admitted against the
+            # connection's credits and processed without holding up the next frame
             if isinstance(message, dict) and "logs" in message:
                 # Handle batch logs
                 logs_batch = message["logs"]
-                logger.info(f"📚 Received batch of {len(logs_batch)} logs from application backend {app_client_id}")
-                
-                processed_logs = []
-                for log in logs_batch:
-                    processed_log = prepare_log_features(log)
-                    processed_logs.append(processed_log)
-                    log_buffer.append(processed_log)
-                
-                # Process for anomalies and broadcast results
-                logs_with_anomalies = detect_anomalies(processed_logs)
-                
-                # Transform logs to include is_anomaly flag
-                for log in logs_with_anomalies:
-                    log["is_anomaly"] = log.get("anomaly", 0) == -1
-                    # Keep anomaly_score but remove the raw anomaly value
-                    log.pop("anomaly", None)
-                
-                anomaly_count = sum(1 for log in logs_with_anomalies if log["is_anomaly"])
-                
-                # Convert timestamps before sending
-                response_data = {
-                    "type": "logs_received",
-                    "logs": logs_with_anomalies,
-                    "total_logs": len(logs_with_anomalies),
-                    "anomalies_detected": anomaly_count
-                }
-                
-                # Convert any timestamps in the response to ISO format
-                response_data = convert_timestamps_to_iso(response_data)
+                if not isinstance(logs_batch, list) or not all(isinstance(log, dict) for log in logs_batch):
+                    await websocket.send_json({"type": "error", "message": "'logs' must be a list of log objects"})
+                    continue
+                logger.debug("📚 Received batch of %d logs from application backend %s", len(logs_batch), app_client_id)
                 
-                # Send response with detailed log information
-                await websocket.send_json(response_data)
-                
-                # Store in ChromaDB
-                if processed_logs:
-                    store_result = store_logs_in_chromadb(logs_with_anomalies)
-                    logger.info(f"💾 Stored {len(processed_logs)} logs in ChromaDB: {store_result}")
-                
-                # Check if we need to generate a summary
-                await process_logs_and_generate_summary()
+                admission = ingest_limiter.admit(flow, len(logs_batch))
+                if admission.shed_action is not None:
+                    logger.warning("Shed batch from application backend %s: %d logs %s",
+                                   app_client_id, admission.shed_count, admission.shed_action)
+                    reply = asyncio.create_task(send_shed_notice(reply, websocket, flow, admission))
+                if admission.keep:
+                    kept_logs = [logs_batch[i] for i in admission.keep]
+                    pending = asyncio.ensure_future(process_application_batch(kept_logs, store=admission.store))
+                    reply = asyncio.create_task(send_log_reply(
+                        reply, websocket, pending,
+                        lambda result: application_batch_response(*result, profile), flow, len(kept_logs),
+                    ))
             
             elif isinstance(message, dict) and "log" in message:
-                # Handle single log
-                log_data = message["log"]
-                processed_log = prepare_log_features(log_data)
-                
-                # Process for anomalies
-                log_with_anomaly = detect_anomalies([processed_log])
-                
-                # Transform to include is_anomaly flag
-                if log_with_anomaly:
-                    log_with_anomaly[0]["is_anomaly"] = log_with_anomaly[0].get("anomaly", 0) == -1
-                    log_with_anomaly[0].pop("anomaly", None)
-                
-                # Add to buffer and store
-                log_buffer.append(processed_log)
-                store_result = store_logs_in_chromadb(log_with_anomaly)
-                
-                # Convert timestamps before sending
-                response_data = {
-                    "type": "log_received",
-                    "log": log_with_anomaly[0] if log_with_anomaly else processed_log,
-                    "is_anomaly": log_with_anomaly[0]["is_anomaly"] if log_with_anomaly else False
-                }
-                
-                # Convert any timestamps in the response to ISO format
-                response_data = convert_timestamps_to_iso(response_data)
-                
-                # Send response
-                await websocket.send_json(response_data)
-                
-                # Check if we need to generate a summary
-                await process_logs_and_generate_summary()
+                # Handle single log: score and store it in a micro-batch shared with
+                # other connections, reply without holding up the next frame
+                if not isinstance(message["log"], dict):
+                    await websocket.send_json({"type": "error", "message": "'log' must be a log object"})
+                    continue
+                processed_log = prepare_log_features(message["log"])
+                admission = ingest_limiter.admit(flow, 1)
+                if admission.shed_action is not None:
+                    reply = asyncio.create_task(send_shed_notice(reply, websocket, flow, admission))
+                if admission.keep and not tenants.throttle(processed_log["tenant"], 1):
+                    reply = asyncio.create_task(send_throttle_notice(reply, websocket, processed_log["tenant"], flow))
+                elif admission.keep:
+                    pending = await single_log_batcher.submit((processed_log, admission.store))
+                    reply = asyncio.create_task(send_log_reply(
+                        reply, websocket, pending,
+                        lambda scored: application_log_response(scored, profile), flow, 1,
+                    ))
             else:
-                logger.warning(f"⚠️ Unrecognized message format from application backend {app_client_id}: {message.keys() if isinstance(message, dict) else type(message)}")
-                print(f"\n⚠️ UNRECOGNIZED MESSAGE FORMAT: {message.keys() if isinstance(message, dict) else type(message)}\n")
+                logger.warning("⚠️ Unrecognized message format from application backend %s: %s", app_client_id,
+                               message.keys() if isinstance(message, dict) else type(message).__name__)
                 await websocket.send_json({
                     "type": "error",
                     "message": "Unrecognized message format. Expected 'logs' or 'log' field."
@@ -823,27 +1494,68 @@ async def application_websocket_endpoint(websocket: WebSocket):
     
     except WebSocketDisconnect:
         manager.disconnect(websocket)
+        ingest_limiter.close(flow)
         logger.info(f"🔌 Application backend {app_client_id} disconnected")
-        print(f"\n{'='*50}\n🔌 APPLICATION BACKEND {app_client_id} DISCONNECTED\n{'='*50}\n")
     except Exception as e:
         logger.error(f"❌ Error in application WebSocket for client {app_client_id}: {e}", exc_info=True)
-        print(f"\n❌ ERROR IN APPLICATION WEBSOCKET: {e}\n")
         manager.disconnect(websocket)
+        ingest_limiter.close(flow)
 
 # === Background Tasks ===
+def lock_archive():
+    """Claim the archive before handing out seqs: alone, or beside processes sharing the
+    seq counter. Logs a backfill wrote since the archive was opened are picked up."""
+    log_archive.lock_writers(shared=shared_state is not None)
+    apply_archive_changes(*log_archive.refresh())
+    log_sequence.advance(log_archive.last_seq)
+
 @app.on_event("startup")
 async def startup_event():
-    # Start background processing
-    asyncio.create_task(background_processing())
-    logger.info("Started background processing")
+    if log_archive is not None:
+        lock_archive()
+    if shared_state is None:
+        become_leader()
+    else:
+        # The leader is elected (and re-elected) by the sync loop
+        asyncio.create_task(sync_shared_state())
+        logger.info(f"Worker {os.getpid()} sharing state through {SHARED_STATE_DIR}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await single_log_batcher.stop()
+    await storage_queue.stop()
+    await llm_gateway.aclose()
+    await manager.stop()
+    scoring_executor.shutdown()
+    model_manager.shutdown()
+    logger.info("Stopped scoring workers")
+    for models in tenant_models():
+        models.shutdown()
+    if shared_state is not None:
+        if summary_windows:
+            shared_state.push_partial(os.getpid(), take_partial())
+        shared_state.close()
+    if rollup_store is not None:
+        rollup_store.close()
+    if log_control is not None:
+        log_control.stop()
 
 async def background_processing():
-    """Background task to process logs and generate summaries"""
+    """Summarize windows as the watermark closes them: woken by record_logs when one
+    is due, or by timeout when open windows go idle"""
     while True:
-        await process_logs_and_generate_summary()
-        await asyncio.sleep(10)  # Check every 10 seconds
+        try:
+            await asyncio.wait_for(summary_due.wait(), summary_timeout())
+        except asyncio.TimeoutError:
+            pass
+        summary_due.clear()
+        await fire_summaries()
 
 # === Main Function ===
 if __name__ == "__main__":
-    print("runnig")
-    uvicorn.run("main:app", host="0.0.0.0", port=SERVER_PORT, reload=True)
\ No newline at end of file
+    logger.info("Starting server on port %d", SERVER_PORT)
+    if SERVER_WORKERS > 1:
+        # The workers share the listening socket, so connections (and their ingest) are spread across them
+        uvicorn.run("main:app", host="0.0.0.0", port=SERVER_PORT, workers=SERVER_WORKERS)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=SERVER_PORT, reload=True)
\ No newline at end of file
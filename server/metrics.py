@@ -0,0 +1,283 @@
+import functools
+import inspect
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency histogram layout: one bucket below 2**MIN_BITS ns (about 1 µs), then
+# SUB_BUCKETS linear buckets per power of two up to 2**(MIN_BITS + OCTAVES) ns
+# (about 69 s), so every bucket is within 1 / SUB_BUCKETS of its bounds
+MIN_BITS = 10
+OCTAVES = 26
+SUB_BITS = 2
+SUB_BUCKETS = 1 << SUB_BITS
+
+def _bucket_bounds_ns():
+    bounds = [1 << MIN_BITS]
+    for bits in range(MIN_BITS + 1, MIN_BITS + OCTAVES + 1):
+        low, step = 1 << (bits - 1), 1 << (bits - 1 - SUB_BITS)
+        bounds.extend(low + (sub + 1) * step for sub in range(SUB_BUCKETS))
+    return bounds
+
+BUCKET_BOUNDS_NS = _bucket_bounds_ns()
+_LE_LABELS = [f'le="{bound / 1e9!r}"' for bound in BUCKET_BOUNDS_NS] + ['le="+Inf"']
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+# === Metrics ===
+class Metric:
+    """A named metric family; ``labels(*values)`` returns the child for one label set.
+    Children are created once and kept, so hot paths look theirs up at import time."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}  # label values (strings) -> child
+        self._lookup = {}  # label values as passed to labels() -> child
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._lookup.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            key = tuple(str(value) for value in values)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            self._lookup[values] = child
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(Metric):
+    """Monotonic count. ``inc`` is a plain attribute add: no lock, which the GIL makes
+    safe on the event loop; increments racing from other threads may rarely be lost."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}_total{_labels(self.labelnames, values)} {_number(child.value)}")
+        return lines
+
+class _HistogramValue:
+    __slots__ = ("counts", "sum_ns")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_NS) + 1)  # the last one is above every bound
+        self.sum_ns = 0
+
+    def observe_ns(self, ns):
+        """Record a duration in nanoseconds (e.g. a ``time.perf_counter_ns()`` difference)"""
+        bits = ns.bit_length()
+        if bits <= MIN_BITS:
+            index = 0
+        elif bits > MIN_BITS + OCTAVES:
+            index = len(BUCKET_BOUNDS_NS)
+        else:
+            index = 1 + (bits - MIN_BITS - 1) * SUB_BUCKETS + ((ns >> (bits - 1 - SUB_BITS)) & (SUB_BUCKETS - 1))
+        self.counts[index] += 1
+        self.sum_ns += ns
+
+    def observe(self, seconds):
+        self.observe_ns(max(0, int(seconds * 1e9)))
+
+class Histogram(Metric):
+    """Latency distribution in log-linear (HDR-style) buckets with a bounded relative
+    error. Recording is a bit-length, a shift and two list adds, no lock and no search."""
+
+    kind = "histogram"
+
+    def _new_child(self):
+        return _HistogramValue()
+
+    def observe_ns(self, ns):
+        self._default.observe_ns(ns)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for le, count in zip(_LE_LABELS, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(child.sum_ns / 1e9)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+class Gauge(Metric):
+    """Value read at scrape time from ``callback()``: a number, or a dict from label
+    values (a tuple, or a single value for one label) to numbers. Costs nothing until
+    scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind="gauge"):
+        self.callback = callback
+        self.kind = kind
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} could not be read: {e}")
+            return []
+        name = f"{self.name}_total" if self.kind == "counter" else self.name
+        lines = self.header()
+        if isinstance(value, dict):
+            for values, number in value.items():
+                values = values if isinstance(values, tuple) else (values,)
+                lines.append(f"{name}{_labels(self.labelnames, values)} {_number(number)}")
+        else:
+            lines.append(f"{name} {_number(value)}")
+        return lines
+
+# === Registry ===
+class MetricsRegistry:
+    """The metrics of this process, rendered together for ``GET /metrics``"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=()):
+        return self._register(Histogram(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self._register(Gauge(name, documentation, callback, labelnames))
+
+    def counter_callback(self, name, documentation, callback, labelnames=()):
+        """A counter some component already keeps, read at scrape time like a gauge"""
+        return self._register(Gauge(name, documentation, callback, labelnames, kind="counter"))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# Shared by the modules that time a pipeline stage
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    "log_pipeline_stage_seconds", "Time spent in each stage of the log pipeline", ("stage",)
+)
+
+def timed(histogram):
+    """Decorator recording each call's duration (sync or async) in ``histogram``,
+    a histogram child like ``PIPELINE_STAGE_SECONDS.labels("score")``"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_call(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe_ns(time.perf_counter_ns() - start)
+        else:
+            @functools.wraps(func)
+            def timed_call(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe_ns(time.perf_counter_ns() - start)
+        return timed_call
+    return decorate
+
+# === HTTP Middleware ===
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method and route template, and
+    counting responses by status. WebSocket connections pass through untouched."""
+
+    def __init__(self, app, registry=REGISTRY):
+        self.app = app
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency, until the response body is sent",
+            ("method", "route"),
+        )
+        self.responses = registry.counter("http_responses", "HTTP responses", ("route", "status"))
+        self._routes = {}  # (method, route) -> (latency child, {status: response counter child})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter_ns()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "unmatched")
+            children = self._routes.get(key)
+            if children is None:
+                children = self._routes[key] = (self.latency.labels(*key), {})
+            children[0].observe_ns(elapsed)
+            counter = children[1].get(status)
+            if counter is None:
+                counter = children[1][status] = self.responses.labels(key[1], status)
+            counter.value += 1
@@ -0,0 +1,291 @@
+import asyncio
+import glob
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from sklearn.base import clone
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, which runs a single worker
+    fcntl = None
+
+from scoring import MODEL_FEATURES, load_model, make_scorer, save_model
+
+logger = logging.getLogger(__name__)
+
+# A loaded model version; replaced as a whole so readers never see a half-swapped model
+ModelVersion = namedtuple("ModelVersion", ["version", "path", "scorer", "loaded_at"])
+
+_VERSION_FILE = re.compile(r"isolation_forest_v(\d+)\.pkl$")
+
+# === Reservoir Sample ===
+class ReservoirSample:
+    """Fixed-size uniform sample of feature vectors (Algorithm R, vectorized per batch)"""
+
+    def __init__(self, capacity, n_features, seed=None):
+        self.capacity = capacity
+        self.rows = np.zeros((capacity, n_features), dtype=np.float32)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.seen, self.capacity)
+
+    def add(self, X):
+        with self._lock:
+            n = len(X)
+            free = max(0, min(self.capacity - self.seen, n))
+            if free:
+                self.rows[self.seen:self.seen + free] = X[:free]
+            if n > free:
+                # Row k of the stream replaces a random slot with probability capacity / (k + 1)
+                positions = np.arange(self.seen + free, self.seen + n)
+                slots = self._rng.integers(0, positions + 1)
+                keep = slots < self.capacity
+                self.rows[slots[keep]] = X[free:][keep]
+            self.seen += n
+
+    def snapshot(self):
+        with self._lock:
+            return self.rows[:len(self)].copy()
+
+    def age(self):
+        """Let new data count as much as everything sampled so far (biases towards recent traffic)"""
+        with self._lock:
+            self.seen = min(self.seen, self.capacity)
+
+# === Model Manager ===
+class ModelManager:
+    """Versioned IsolationForest models with background refits and atomic hot-swap.
+
+    Every refit fits a clone of the live model on a reservoir sample of recently scored
+    feature vectors in a dedicated background thread, writes it to
+    ``<model_dir>/isolation_forest_v<N>.pkl``, points ``CURRENT`` at it and then swaps
+    ``current`` in a single assignment. Scoring keeps using the previous version until
+    the swap, so ingest never waits for a fit. Version 0 is the bundled base model.
+    ``n_features`` is the width of the sampled vectors, wider than ``MODEL_FEATURES``
+    when refits also use streaming window features.
+
+    Several worker processes may share ``model_dir``: a refit claims its version number
+    by creating the file exclusively, ``CURRENT`` only ever moves forward, and each
+    process records the version it scores with under ``loaded/<pid>`` so no other
+    process prunes it.
+    """
+
+    def __init__(self, base_model_path, model_dir, reservoir_size=10_000, min_refit_samples=256,
+                 keep_versions=5, n_features=len(MODEL_FEATURES)):
+        self.base_model_path = base_model_path
+        self.model_dir = model_dir
+        self.min_refit_samples = min_refit_samples
+        self.keep_versions = keep_versions
+        self.reservoir = ReservoirSample(reservoir_size, n_features)
+        self.samples_at_last_refit = 0
+        self.last_refit = None
+        self.last_refit_seconds = None
+        self._refit_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-refit")
+        self._refit_task = None
+        os.makedirs(model_dir, exist_ok=True)
+        self.current = self._load_current()
+
+    def _pointer_path(self):
+        return os.path.join(self.model_dir, "CURRENT")
+
+    def _loaded_dir(self):
+        return os.path.join(self.model_dir, "loaded")
+
+    def path_for(self, version):
+        if version == 0:
+            return self.base_model_path
+        return os.path.join(self.model_dir, f"isolation_forest_v{version:04d}.pkl")
+
+    def _versions_on_disk(self):
+        versions = []
+        for path in glob.glob(os.path.join(self.model_dir, "isolation_forest_v*.pkl")):
+            match = _VERSION_FILE.search(path)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def _read_pointer(self):
+        try:
+            with open(self._pointer_path()) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            logger.warning("Ignoring unreadable model pointer, using the base model")
+            return 0
+
+    def _load_current(self, version=None):
+        version = self._read_pointer() if version is None else version
+        path = self.path_for(version)
+        model = ModelVersion(version, path, make_scorer(load_model(path)), datetime.now())
+        self._mark_loaded(version)
+        logger.info(f"Loaded Isolation Forest model v{version} from {path}")
+        return model
+
+    def _mark_loaded(self, version):
+        """Record the version this process scores with, so others don't prune it"""
+        os.makedirs(self._loaded_dir(), exist_ok=True)
+        path = os.path.join(self._loaded_dir(), str(os.getpid()))
+        with open(f"{path}.tmp", "w") as f:
+            f.write(f"{version}\n")
+        os.replace(f"{path}.tmp", path)
+
+    def _versions_in_use(self):
+        """Versions loaded by live processes sharing ``model_dir``; markers of exited ones are removed"""
+        versions = []
+        try:
+            names = os.listdir(self._loaded_dir())
+        except FileNotFoundError:
+            return versions
+        for name in names:
+            if not name.isdigit():
+                continue
+            path = os.path.join(self._loaded_dir(), name)
+            try:
+                os.kill(int(name), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    versions.append(int(f.read().strip()))
+            except (OSError, ValueError):
+                pass
+        return versions
+
+    def reload_if_changed(self):
+        """Swap in the version ``CURRENT`` points at if another process published one;
+        returns the new version, or None"""
+        version = self._read_pointer()
+        if version == self.current.version:
+            return None
+        try:
+            self.current = self._load_current(version)
+        except (OSError, EOFError) as e:  # pruned or still being written, try again next time
+            logger.warning(f"Could not load model v{version} published by another worker: {e}")
+            return None
+        return version
+
+    def observe(self, X):
+        """Feed freshly scored feature vectors into the refit sample"""
+        self.reservoir.add(X)
+
+    def _fit_and_publish(self, X):
+        started = datetime.now()
+        model = clone(self.current.scorer.model)
+        model.fit(X)
+        scorer = make_scorer(model)
+
+        version = self._reserve_version()
+        path = self.path_for(version)
+        save_model(model, path)
+        self._publish(version)
+
+        # Hot-swap: one reference assignment, batches already dispatched keep the old scorer
+        self.current = ModelVersion(version, path, scorer, datetime.now())
+        self._mark_loaded(version)
+        self.last_refit = self.current.loaded_at
+        self.last_refit_seconds = (self.last_refit - started).total_seconds()
+        self._prune()
+        logger.info(f"Refitted Isolation Forest model v{version} on {len(X)} samples "
+                    f"in {self.last_refit_seconds:.2f}s")
+        return version
+
+    def _reserve_version(self):
+        """Claim the next free version number by creating its file exclusively, so workers
+        refitting at the same time never write the same version"""
+        while True:
+            version = max(self._versions_on_disk() + [self.current.version]) + 1
+            try:
+                fd = os.open(self.path_for(version), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            return version
+
+    def _publish(self, version):
+        """Point ``CURRENT`` at ``version`` unless another worker published a newer one"""
+        lock_fd = os.open(f"{self._pointer_path()}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            if self._read_pointer() >= version:
+                return
+            pointer_tmp = f"{self._pointer_path()}.tmp"
+            with open(pointer_tmp, "w") as f:
+                f.write(f"{version}\n")
+            os.replace(pointer_tmp, self._pointer_path())
+        finally:
+            os.close(lock_fd)
+
+    def _prune(self):
+        """Remove versions beyond the newest ``keep_versions`` that no live process has loaded"""
+        oldest_in_use = min(self._versions_in_use() + [self.current.version])
+        for version in self._versions_on_disk()[:-self.keep_versions]:
+            if version < oldest_in_use:
+                try:
+                    os.remove(self.path_for(version))
+                except OSError as e:
+                    logger.warning(f"Could not remove old model v{version}: {e}")
+
+    async def refit(self, force=False):
+        """Refit in the background; returns the new version, or None if skipped"""
+        if self._refit_task is not None and not self._refit_task.done():
+            return await asyncio.shield(self._refit_task)
+        sample_count = len(self.reservoir)
+        if sample_count < self.min_refit_samples:
+            logger.info(f"Skipping model refit: {sample_count}/{self.min_refit_samples} samples collected")
+            return None
+        if not force and self.reservoir.seen == self.samples_at_last_refit:
+            logger.debug("Skipping model refit: no new logs since the last refit")
+            return None
+
+        X = self.reservoir.snapshot()
+        self.reservoir.age()
+        self.samples_at_last_refit = self.reservoir.seen
+        loop = asyncio.get_running_loop()
+        self._refit_task = asyncio.ensure_future(loop.run_in_executor(self._refit_pool, self._fit_and_publish, X))
+        return await asyncio.shield(self._refit_task)
+
+    async def run_schedule(self, interval_minutes):
+        """Refit every ``interval_minutes`` while new logs keep arriving"""
+        while True:
+            await asyncio.sleep(interval_minutes * 60)
+            try:
+                await self.refit()
+            except Exception as e:
+                logger.error(f"Scheduled model refit failed: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            "version": self.current.version,
+            "path": os.path.basename(self.current.path),
+            "loaded_at": self.current.loaded_at.isoformat(),
+            "reservoir_samples": len(self.reservoir),
+            "samples_seen": self.reservoir.seen,
+            "last_refit": self.last_refit.isoformat() if self.last_refit else None,
+            "last_refit_seconds": self.last_refit_seconds,
+            "refit_running": self._refit_task is not None and not self._refit_task.done(),
+        }
+
+    def shutdown(self):
+        self._refit_pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            os.remove(os.path.join(self._loaded_dir(), str(os.getpid())))
+        except OSError:
+            pass
@@ -0,0 +1,277 @@
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Sentinel stored in the timestamp column when a log has no parseable timestamp
+NAT = np.iinfo(np.int64).min
+
+# Numeric columns and their storage dtypes
+NUMERIC_COLUMNS = {
+    "timestamp": np.int64,  # nanoseconds since the epoch (UTC)
+    "status_code": np.int32,
+    "bytes_sent": np.int64,
+    "url_length": np.int32,
+    "url_depth": np.int32,
+    "num_encoded_chars": np.int32,
+    "num_special_chars": np.int32,
+    "anomaly": np.int8,  # 0 = not scored yet, otherwise the model label (1 / -1)
+    "anomaly_score": np.float64,
+}
+
+# Low/medium cardinality string columns, stored as int32 dictionary codes
+CATEGORICAL_COLUMNS = ("ip", "method", "url", "protocol", "user_agent", "tenant")
+
+# Order of the keys in the records handed back to callers
+RECORD_FIELDS = (
+    "timestamp", "ip", "method", "url", "protocol", "status_code", "bytes_sent",
+    "user_agent", "url_length", "url_depth", "num_encoded_chars", "num_special_chars", "tenant",
+)
+
+# === Timestamp Helpers ===
+def to_epoch_ns(value):
+    """Convert an ISO string / datetime to UTC epoch nanoseconds (naive times are taken as UTC)"""
+    if value is None or value == "":
+        return NAT
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if isinstance(value, pd.Timestamp):
+            if pd.isna(value):
+                return NAT
+            value = value if value.tzinfo else value.tz_localize("UTC")
+            return int(value.value)
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+            return (delta.days * 86_400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1_000
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return NAT
+    if pd.isna(ts):
+        return NAT
+    return int((ts if ts.tzinfo else ts.tz_localize("UTC")).value)
+
+def format_epoch_ns(ns):
+    """Render epoch nanoseconds back to an ISO 8601 string (None for missing timestamps)"""
+    if ns == NAT:
+        return None
+    return datetime.fromtimestamp(ns // 1_000 / 1_000_000, tz=timezone.utc).isoformat()
+
+# === Dictionary Encoding ===
+class _Dictionary:
+    """Reference-counted value <-> code mapping; codes are recycled once no row uses them.
+    ``lookup`` mirrors ``values`` as an object array so decoding is one take, however
+    large the dictionary."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+        self.refcounts = []
+        self.free = []
+        self.lookup = np.empty(16, dtype=object)
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            if self.free:
+                code = self.free.pop()
+                self.values[code] = value
+            else:
+                code = len(self.values)
+                self.values.append(value)
+                self.refcounts.append(0)
+                if code == len(self.lookup):
+                    self.lookup = np.concatenate([self.lookup, np.empty(code, dtype=object)])
+            self.lookup[code] = value
+            self.codes[value] = code
+        self.refcounts[code] += 1
+        return code
+
+    def release(self, code):
+        self.refcounts[code] -= 1
+        if self.refcounts[code] == 0:
+            del self.codes[self.values[code]]
+            self.values[code] = None
+            self.lookup[code] = None
+            self.free.append(code)
+
+    def decode(self, codes):
+        return self.lookup[codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+# === Buffer View ===
+class LogBufferView:
+    """A contiguous window of a ColumnarLogBuffer.
+
+    Columns are NumPy views into the buffer, not copies, so a view is only valid
+    until the buffer has wrapped past it; consume it right away.
+    """
+
+    def __init__(self, buffer, columns, first_seq):
+        self._buffer = buffer
+        self.columns = columns
+        self.first_seq = first_seq
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def column(self, name):
+        """Return a column with categorical codes decoded back to their values"""
+        if name in CATEGORICAL_COLUMNS:
+            return self._buffer._dictionaries[name].decode(self.columns[name])
+        return self.columns[name]
+
+    def to_records(self):
+        """Materialize the window as a list of log dicts (oldest first)"""
+        n = len(self)
+        if n == 0:
+            return []
+        fields = {name: self.column(name).tolist() for name in RECORD_FIELDS}
+        fields["timestamp"] = [format_epoch_ns(ns) for ns in fields["timestamp"]]
+        anomaly = self.columns["anomaly"].tolist()
+        anomaly_score = self.columns["anomaly_score"].tolist()
+
+        records = []
+        for i in range(n):
+            record = {name: fields[name][i] for name in RECORD_FIELDS}
+            if anomaly[i]:
+                record["anomaly"] = anomaly[i]
+                record["anomaly_score"] = anomaly_score[i]
+            records.append(record)
+        return records
+
+# === Columnar Ring Buffer ===
+class ColumnarLogBuffer:
+    """Fixed-capacity, column-oriented ring buffer of processed logs.
+
+    Numeric features live in NumPy arrays and string fields are dictionary encoded.
+    Every row is written twice (at ``i`` and ``i + capacity``) so that any window of
+    up to ``capacity`` most recent rows is a single contiguous, zero-copy slice.
+    Appending is O(1); once full, the oldest row is overwritten.
+    """
+
+    def __init__(self, max_rows=100_000, max_bytes=None):
+        if max_bytes:
+            max_rows = min(max_rows, max(1, int(max_bytes) // self.row_nbytes()))
+        if max_rows < 1:
+            raise ValueError("max_rows must be at least 1")
+        self.capacity = int(max_rows)
+        self._numeric = {
+            name: np.zeros(2 * self.capacity, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()
+        }
+        self._codes = {
+            name: np.zeros(2 * self.capacity, dtype=np.int32) for name in CATEGORICAL_COLUMNS
+        }
+        self._dictionaries = {name: _Dictionary() for name in CATEGORICAL_COLUMNS}
+        self._size = 0
+        self.total_appended = 0  # sequence number of the next row
+        logger.info(f"Log buffer initialized with capacity for {self.capacity} logs")
+
+    @staticmethod
+    def row_nbytes():
+        """Bytes of array storage per row (both copies), excluding dictionary values"""
+        width = sum(np.dtype(dtype).itemsize for dtype in NUMERIC_COLUMNS.values())
+        width += len(CATEGORICAL_COLUMNS) * np.dtype(np.int32).itemsize
+        return 2 * width
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    @property
+    def first_seq(self):
+        """Sequence number of the oldest row still held"""
+        return self.total_appended - self._size
+
+    def append(self, log):
+        """Append one processed log dict, evicting the oldest row when full"""
+        pos = self.total_appended % self.capacity
+        mirror = pos + self.capacity
+
+        for name in CATEGORICAL_COLUMNS:
+            codes = self._codes[name]
+            dictionary = self._dictionaries[name]
+            if self._size == self.capacity:
+                dictionary.release(codes[pos])
+            code = dictionary.encode(log.get(name))
+            codes[pos] = code
+            codes[mirror] = code
+
+        values = self._numeric
+        ts = to_epoch_ns(log.get("timestamp"))
+        values["timestamp"][pos] = values["timestamp"][mirror] = ts
+        for name in ("status_code", "bytes_sent", "url_length", "url_depth",
+                     "num_encoded_chars", "num_special_chars"):
+            value = log.get(name) or 0
+            values[name][pos] = values[name][mirror] = value
+        anomaly = log.get("anomaly") or 0
+        score = log.get("anomaly_score")
+        score = float(score) if anomaly and score is not None else np.nan
+        values["anomaly"][pos] = values["anomaly"][mirror] = anomaly
+        values["anomaly_score"][pos] = values["anomaly_score"][mirror] = score
+
+        self.total_appended += 1
+        if self._size < self.capacity:
+            self._size += 1
+
+    def extend(self, logs):
+        for log in logs:
+            self.append(log)
+
+    def _window(self, start, stop):
+        """View over logical rows [start, stop) where 0 is the oldest row held"""
+        start = max(0, min(start, self._size))
+        stop = max(start, min(stop, self._size))
+        offset = (self.first_seq + start) % self.capacity
+        length = stop - start
+        columns = {name: array[offset:offset + length] for name, array in self._numeric.items()}
+        columns.update({name: array[offset:offset + length] for name, array in self._codes.items()})
+        return LogBufferView(self, columns, self.first_seq + start)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("ColumnarLogBuffer only supports slicing, e.g. buffer[-100:]")
+        start, stop, step = key.indices(self._size)
+        if step != 1:
+            raise ValueError("ColumnarLogBuffer slices must have a step of 1")
+        return self._window(start, stop)
+
+    def tail(self, n):
+        """Zero-copy view of the ``n`` most recent rows"""
+        return self._window(self._size - n, self._size)
+
+    def since(self, seq):
+        """Zero-copy view of the rows appended at or after sequence number ``seq``"""
+        return self._window(seq - self.first_seq, self._size)
+
+    def clear(self):
+        window = self.tail(self._size)
+        for name in CATEGORICAL_COLUMNS:
+            dictionary = self._dictionaries[name]
+            for code in window.columns[name].tolist():
+                dictionary.release(code)
+        self._size = 0
+
+    def stats(self):
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "total_appended": self.total_appended,
+            "array_bytes": self.row_nbytes() * self.capacity,
+            "distinct_values": {name: len(d) for name, d in self._dictionaries.items()},
+        }
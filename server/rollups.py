@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from aggregator import StreamingAggregator
+from ring_buffer import format_epoch_ns
+
+logger = logging.getLogger(__name__)
+
+# Tenant key of the overall summary stream (every tenant's logs)
+ALL_TENANTS = "*"
+# Rollup levels above the summary windows, finest first: (name, size in seconds)
+ROLLUP_LEVELS = (("hour", 3600), ("day", 86400))
+RESOLUTIONS = ("window",) + tuple(name for name, _ in ROLLUP_LEVELS)
+# Most buckets one series query may return
+MAX_ROLLUP_BUCKETS = 2000
+
+_NS = 1_000_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (tenant TEXT NOT NULL, level TEXT NOT NULL, start INTEGER NOT NULL,
+                                    end INTEGER NOT NULL, state BLOB NOT NULL,
+                                    PRIMARY KEY (tenant, level, start)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS compacted (tenant TEXT NOT NULL, level TEXT NOT NULL, until INTEGER NOT NULL,
+                                      PRIMARY KEY (tenant, level)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS expired (tenant TEXT NOT NULL, level TEXT NOT NULL, until INTEGER NOT NULL,
+                                    PRIMARY KEY (tenant, level)) WITHOUT ROWID;
+"""
+
+def _dumps(state):
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+def _loads(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+def merge_states(states, top_k=64):
+    """One StreamingAggregator holding the merge of ``states`` (all of one HLL precision)"""
+    aggregator = None
+    for state in states:
+        if aggregator is None:
+            precision = len(state["distinct_ips"]).bit_length() - 1
+            aggregator = StreamingAggregator(top_k=top_k, hll_precision=precision)
+        aggregator.merge(state)
+    return aggregator
+
+# === Rollup Store ===
+class RollupStore:
+    """Summary history as mergeable aggregates, rolled up from windows into hours and days.
+
+    Every closed summary window is stored as its ``StreamingAggregator`` state (counters,
+    Space-Saving top endpoints, HyperLogLog of IPs), per tenant. ``compact`` merges the
+    windows of each finished hour into one hour row, and finished hours into day rows;
+    ``compacted.until`` records how far each level is complete, so a missing row there
+    means no logs rather than not compacted yet. A range query takes whole days from the
+    day level, the partial days at its edges from hours and the partial hours from
+    windows, so it reads a few dozen rows plus one per day, whatever the range.
+    Windows and hours are dropped after their retention once rolled up (``expired.until``);
+    range edges that fall there are rounded to the hours or days starting in the range.
+
+    Window sizes must divide an hour and windows must not overlap (tumbling), or the
+    rollups would count logs twice.
+    """
+
+    def __init__(self, path, retention_seconds=None, top_k=64):
+        self.path = path
+        self.retention_seconds = retention_seconds or {}  # level -> seconds, missing keeps forever
+        self.top_k = top_k
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self.windows_added = 0
+        self.rows_compacted = 0
+        self.rows_expired = 0
+        self.last_compaction = None
+
+    # === Writes ===
+    def add(self, tenant, start, end, state):
+        """Store one closed summary window (merged into the row if it was stored before)"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT state FROM rollups WHERE tenant = ? AND level = 'window' AND start = ?", (tenant, start)
+                ).fetchone()
+                if row is not None:
+                    state = merge_states([_loads(row[0]), state], self.top_k).state()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rollups (tenant, level, start, end, state) VALUES (?, 'window', ?, ?, ?)",
+                    (tenant, start, end, _dumps(state)),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self.windows_added += 1
+
+    def _compacted_until(self, tenant, level):
+        row = self._db.execute("SELECT until FROM compacted WHERE tenant = ? AND level = ?", (tenant, level)).fetchone()
+        return row[0] if row else None
+
+    def _compact_level(self, tenant, source, level, size):
+        """Roll ``source`` rows up into ``level`` rows as far as the source is complete"""
+        if source == "window":
+            # Windows close in order, so every window ending before the newest one is in
+            (complete,) = self._db.execute(
+                "SELECT MAX(end) FROM rollups WHERE tenant = ? AND level = 'window'", (tenant,)
+            ).fetchone()
+        else:
+            complete = self._compacted_until(tenant, source)
+        if complete is None:
+            return 0
+        target = complete - complete % size
+        done = self._compacted_until(tenant, level)
+        if done is None:
+            (first,) = self._db.execute(
+                "SELECT MIN(start) FROM rollups WHERE tenant = ? AND level = ?", (tenant, source)
+            ).fetchone()
+            if first is None:
+                return 0
+            done = first - first % size
+        if done >= target:
+            return 0
+        groups = {}
+        for start, blob in self._db.execute(
+            "SELECT start, state FROM rollups WHERE tenant = ? AND level = ? AND start >= ? AND start < ? ORDER BY start",
+            (tenant, source, done, target),
+        ):
+            groups.setdefault(start - start % size, []).append(_loads(blob))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO rollups (tenant, level, start, end, state) VALUES (?, ?, ?, ?, ?)",
+            [(tenant, level, start, start + size, _dumps(merge_states(states, self.top_k).state()))
+             for start, states in groups.items()],
+        )
+        self._db.execute(
+            "INSERT INTO compacted (tenant, level, until) VALUES (?, ?, ?) "
+            "ON CONFLICT(tenant, level) DO UPDATE SET until = excluded.until",
+            (tenant, level, target),
+        )
+        return len(groups)
+
+    def compact(self):
+        """Roll finished hours and days up for every tenant, then apply retention"""
+        now = time.time_ns()
+        with self._lock:
+            tenants = [row[0] for row in self._db.execute("SELECT DISTINCT tenant FROM rollups")]
+            compacted = expired = 0
+            for tenant in tenants:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    source = "window"
+                    for level, seconds in ROLLUP_LEVELS:
+                        compacted += self._compact_level(tenant, source, level, seconds * _NS)
+                        source = level
+                    expired += self._expire(tenant, now)
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        self.rows_compacted += compacted
+        self.rows_expired += expired
+        self.last_compaction = datetime.now()
+        if compacted or expired:
+            logger.info(f"Rolled up {compacted} rollup rows, expired {expired}")
+        return compacted
+
+    def _expire(self, tenant, now):
+        """Drop rows past their level's retention, once the next level holds them"""
+        expired = 0
+        levels = RESOLUTIONS
+        for level, parent in zip(levels, levels[1:]):
+            retention = self.retention_seconds.get(level)
+            rolled_up = self._compacted_until(tenant, parent)
+            if not retention or rolled_up is None:
+                continue
+            cutoff = min(now - int(retention * _NS), rolled_up)
+            cutoff -= cutoff % (dict(ROLLUP_LEVELS)[parent] * _NS)
+            expired += self._db.execute(
+                "DELETE FROM rollups WHERE tenant = ? AND level = ? AND start < ?", (tenant, level, cutoff)
+            ).rowcount
+            self._db.execute(
+                "INSERT INTO expired (tenant, level, until) VALUES (?, ?, ?) "
+                "ON CONFLICT(tenant, level) DO UPDATE SET until = MAX(until, excluded.until)",
+                (tenant, level, cutoff),
+            )
+        return expired
+
+    async def run_compaction(self, interval_minutes):
+        """Compact every ``interval_minutes``"""
+        while True:
+            await asyncio.sleep(interval_minutes * 60)
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.error(f"Rollup compaction failed: {e}", exc_info=True)
+
+    # === Queries ===
+    def _rows(self, tenant, level, start, end):
+        """States of the ``level`` rows starting in ``[start, end)``"""
+        rows = self._db.execute(
+            "SELECT state FROM rollups WHERE tenant = ? AND level = ? AND start >= ? AND start < ?",
+            (tenant, level, start, end),
+        ).fetchall()
+        return [_loads(blob) for (blob,) in rows]
+
+    def _cover(self, tenant, start, end, depth, compacted, expired):
+        """States covering ``[start, end)``, from the coarsest complete rows at or below
+        ``RESOLUTIONS[depth]`` (rows only partly in the range are taken by their start)"""
+        if start >= end:
+            return []
+        if depth == 0:
+            return self._rows(tenant, "window", start, end)
+        level, seconds = ROLLUP_LEVELS[depth - 1]
+        size = seconds * _NS
+        gone = expired.get(RESOLUTIONS[depth - 1])
+        if gone is not None and start < gone:
+            # The finer rows are gone here, round to this level's
+            cut = min(end, gone)
+            return self._rows(tenant, level, start, cut) + self._cover(tenant, cut, end, depth, compacted, expired)
+        until = compacted.get(level)
+        lo = -(-start // size) * size
+        hi = min(end - end % size, until) if until is not None else lo
+        if lo >= hi:
+            return self._cover(tenant, start, end, depth - 1, compacted, expired)
+        return (self._rows(tenant, level, lo, hi)
+                + self._cover(tenant, start, lo, depth - 1, compacted, expired)
+                + self._cover(tenant, hi, end, depth - 1, compacted, expired))
+
+    def _summary(self, states, start, end):
+        aggregator = merge_states(states, self.top_k)
+        summary = aggregator.snapshot() if aggregator is not None else {"message": "No logs to summarize"}
+        summary["time_range_start"] = format_epoch_ns(start)
+        summary["time_range_end"] = format_epoch_ns(end)
+        return summary
+
+    def query(self, tenant, start, end, resolution=None):
+        """Summary of ``[start, end)`` (epoch ns), or with ``resolution`` a list of summaries
+        of each window, hour or day in it; returns ``(result, rows read)``"""
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        with self._lock:
+            compacted, expired = (
+                dict(self._db.execute(f"SELECT level, until FROM {table} WHERE tenant = ?", (tenant,)).fetchall())
+                for table in ("compacted", "expired")
+            )
+            if resolution is None:
+                states = self._cover(tenant, start, end, len(ROLLUP_LEVELS), compacted, expired)
+                return self._summary(states, start, end), len(states)
+            if resolution == "window":
+                rows = self._db.execute(
+                    "SELECT start, end, state FROM rollups WHERE tenant = ? AND level = 'window' "
+                    "AND start >= ? AND start < ? ORDER BY start LIMIT ?",
+                    (tenant, start, end, MAX_ROLLUP_BUCKETS + 1),
+                ).fetchall()
+                if len(rows) > MAX_ROLLUP_BUCKETS:
+                    raise ValueError(f"More than {MAX_ROLLUP_BUCKETS} windows in range, use a coarser resolution")
+                return [self._summary([_loads(blob)], s, e) for s, e, blob in rows], len(rows)
+
+            depth = RESOLUTIONS.index(resolution)
+            size = ROLLUP_LEVELS[depth - 1][1] * _NS
+            first = start - start % size
+            if (end - first) // size >= MAX_ROLLUP_BUCKETS:
+                raise ValueError(f"More than {MAX_ROLLUP_BUCKETS} {resolution}s in range, use a coarser resolution")
+            # Complete buckets come from their own rows in one read, the rest from finer rows
+            until = compacted.get(resolution)
+            stored = {}
+            if until is not None:
+                stored = {
+                    s: _loads(blob) for s, blob in self._db.execute(
+                        "SELECT start, state FROM rollups WHERE tenant = ? AND level = ? AND start >= ? AND start < ?",
+                        (tenant, resolution, first, min(end, until)),
+                    )
+                }
+            buckets, read = [], len(stored)
+            for bucket in range(first, end, size):
+                lo, hi = max(bucket, start), min(bucket + size, end)
+                if lo == bucket and hi == bucket + size and until is not None and hi <= until:
+                    states = [stored[bucket]] if bucket in stored else []
+                else:
+                    states = self._cover(tenant, lo, hi, depth - 1, compacted, expired)
+                    read += len(states)
+                if states:
+                    buckets.append(self._summary(states, lo, hi))
+            return buckets, read
+
+    def stats(self):
+        with self._lock:
+            rows = dict(self._db.execute("SELECT level, COUNT(*) FROM rollups GROUP BY level").fetchall())
+        return {
+            "rows": {level: rows.get(level, 0) for level in RESOLUTIONS},
+            "windows_added": self.windows_added,
+            "rows_compacted": self.rows_compacted,
+            "rows_expired": self.rows_expired,
+            "last_compaction": self.last_compaction.isoformat() if self.last_compaction else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+# Private helper, imported so path lengths match sklearn's own scoring to the last bit
+from sklearn.ensemble._iforest import _average_path_length
+
+from features import feature_columns_to_records
+
+logger = logging.getLogger(__name__)
+
+# Features the Isolation Forest model is trained on, in column order
+MODEL_FEATURES = [
+    'url_length',
+    'url_depth',
+    'num_encoded_chars',
+    'num_special_chars',
+    'bytes_sent',
+    'status_code']
+
+# Rows traversed at once by ForestScorer, bounds the (rows x trees) scratch arrays
+SCORING_CHUNK_ROWS = 4096
+
+# === Model Persistence ===
+def load_model(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def save_model(model, path):
+    """Pickle a model next to ``path`` and atomically move it into place"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(model, f)
+    os.replace(tmp_path, path)
+
+# === Scoring Engines ===
+class SklearnScorer:
+    """Scores through the model's own ``decision_function``, once per batch"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def decision_function(self, X):
+        return self.model.decision_function(X)
+
+    def score(self, X):
+        """Anomaly scores and labels (-1 anomaly / 1 normal) for a feature matrix.
+
+        Extra trailing columns (window features a model was not fitted on) are ignored.
+        """
+        n_features = self.model.n_features_in_
+        if X.shape[1] < n_features:
+            raise ValueError(f"The model expects {n_features} features, got {X.shape[1]}; "
+                             f"it was fitted with streaming window features (FEATURE_STORE_MODEL)")
+        scores = self.decision_function(X[:, :n_features])
+        return np.where(scores < 0, -1, 1), scores
+
+class ForestScorer(SklearnScorer):
+    """IsolationForest scoring on the fitted trees flattened into flat NumPy arrays.
+
+    All trees are walked together, one level per step, so a batch costs a fixed number
+    of array operations instead of two sklearn calls per tree for ``predict`` and
+    ``decision_function``. Path lengths are accumulated in the same order and with the
+    same operations as sklearn, so scores are bit-for-bit identical.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        n_features = model.n_features_in_
+        subsample_features = model._max_features != n_features
+
+        features, thresholds, lefts, rights, leaf_values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree, tree_features in zip(model.estimators_, model.estimators_features_):
+            t = tree.tree_
+            is_leaf = t.children_left == -1
+            node_ids = np.arange(t.node_count)
+
+            # Number of nodes on the path from the root, i.e. what decision_path sums to
+            children_left, children_right = t.children_left.tolist(), t.children_right.tolist()
+            counts = [1] * t.node_count
+            for node in range(t.node_count):  # children always come after their parent
+                if children_left[node] != -1:
+                    counts[children_left[node]] = counts[children_right[node]] = counts[node] + 1
+            path_nodes = np.array(counts, dtype=np.int64)
+            max_depth = max(max_depth, int(path_nodes.max()) - 1)
+
+            feature = np.asarray(tree_features)[t.feature] if subsample_features else t.feature.copy()
+            feature[is_leaf] = 0
+            threshold = t.threshold.copy()
+            threshold[is_leaf] = np.inf
+            # Leaves point at themselves so extra traversal steps are no-ops
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(np.where(is_leaf, node_ids, t.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, t.children_right) + offset)
+            leaf_values.append(path_nodes + _average_path_length(t.n_node_samples) - 1.0)
+            roots.append(offset)
+            offset += t.node_count
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.leaf_value = np.concatenate(leaf_values)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.denominator = len(model.estimators_) * _average_path_length([model.max_samples_])
+        self.offset = model.offset_
+
+    def _path_lengths(self, X):
+        nodes = np.tile(self.roots, (len(X), 1))
+        rows = np.arange(len(X))[:, None]
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        # cumsum adds tree by tree, in the same order as sklearn's running total
+        return np.cumsum(self.leaf_value[nodes], axis=1)[:, -1]
+
+    def decision_function(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return np.zeros(0)
+        depths = np.concatenate([
+            self._path_lengths(X[start:start + SCORING_CHUNK_ROWS])
+            for start in range(0, len(X), SCORING_CHUNK_ROWS)
+        ])
+        scores = 2 ** (
+            -np.divide(depths, self.denominator, out=np.ones_like(depths), where=self.denominator != 0)
+        )
+        return -scores - self.offset
+
+def make_scorer(model):
+    """Flattened-forest scorer for the model, or plain sklearn scoring if it can't be flattened"""
+    try:
+        return ForestScorer(model)
+    except (AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"Falling back to sklearn scoring, could not flatten model: {e}")
+        return SklearnScorer(model)
+
+def feature_matrix(logs_data):
+    """Contiguous float32 matrix of the model features from feature records or columns"""
+    if isinstance(logs_data, dict):
+        return np.column_stack([np.asarray(logs_data[name], dtype=np.float32) for name in MODEL_FEATURES])
+    X = np.empty((len(logs_data), len(MODEL_FEATURES)), dtype=np.float32)
+    for i, log in enumerate(logs_data):
+        X[i] = [log[name] for name in MODEL_FEATURES]
+    return X
+
+# === Anomaly Detection ===
+def detect_anomalies(logs_data, scorer, X=None, model_version=None, joined=None):
+    """Detect anomalies in log data (a list of feature dicts or a dict of feature columns)
+
+    Returns the logs as dicts with ``anomaly`` (-1 / 1), ``anomaly_score`` and the
+    ``model_version`` that scored them added, plus any ``joined`` feature columns.
+    """
+    records = feature_columns_to_records(logs_data) if isinstance(logs_data, dict) else logs_data
+    if not records:
+        return []
+    if X is None:
+        X = feature_matrix(logs_data)
+
+    labels, scores = scorer.score(X)
+    return attach_scores(records, labels, scores, model_version, joined)
+
+def attach_scores(records, labels, scores, model_version=None, joined=None):
+    if joined:
+        names = list(joined)
+        rows = zip(*(column.tolist() for column in joined.values()))
+        records = [{**log, **dict(zip(names, row))} for log, row in zip(records, rows)]
+    return [
+        {**log, "anomaly": label, "anomaly_score": score, "model_version": model_version}
+        for log, label, score in zip(records, labels.tolist(), scores.tolist())
+    ]
+
+# === Worker State ===
+# Worker processes keep the scorers of the last few model files they were asked for
+# (one per tenant with per-tenant models) and load a file only the first time.
+WORKER_CACHED_MODELS = 8
+_worker_models = OrderedDict()  # path -> scorer
+
+def _score_in_worker(X, version, path):
+    scorer = _worker_models.get(path)
+    if scorer is None:
+        scorer = _worker_models[path] = make_scorer(load_model(path))
+        logger.info(f"Worker {os.getpid()} loaded Isolation Forest model v{version} from {path}")
+        while len(_worker_models) > WORKER_CACHED_MODELS:
+            _worker_models.popitem(last=False)
+    _worker_models.move_to_end(path)
+    return scorer.score(X)
+
+# === Fair Scheduling ===
+class FairSlots:
+    """Scoring slots shared between tenants by weighted deficit round robin.
+
+    While every slot is busy, waiting batches queue per tenant. A freed slot goes to the
+    tenant at the head of the round once its deficit covers its next batch's size in
+    logs; otherwise it earns ``quantum * weight`` logs of credit and the turn passes on.
+    So each backlogged tenant gets a share of scoring throughput in proportion to its
+    weight, however many batches it queues, and a small tenant's batch waits behind at
+    most one round rather than a large tenant's whole backlog.
+    """
+
+    def __init__(self, capacity, quantum=256):
+        self.capacity = capacity
+        self.quantum = quantum
+        self.in_use = 0
+        self._queues = OrderedDict()  # tenant -> deque of (future, cost), in round order
+        self._deficits = {}
+        self._weights = {}
+
+    def waiting(self, tenant=None):
+        if tenant is not None:
+            return len(self._queues.get(tenant, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, tenant, cost, weight=1.0):
+        if self.in_use < self.capacity and not self._queues:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append((future, cost))
+        self._weights[tenant] = max(weight, 1e-3)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just as the waiter was cancelled
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_use < self.capacity and self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            while queue and queue[0][0].done():  # cancelled waiters
+                queue.popleft()
+            if not queue:
+                self._drop(tenant)
+                continue
+            future, cost = queue[0]
+            deficit = self._deficits.get(tenant, 0)
+            if deficit < cost:
+                self._deficits[tenant] = deficit + self.quantum * self._weights[tenant]
+                self._queues.move_to_end(tenant)
+                continue
+            queue.popleft()
+            self._deficits[tenant] = deficit - cost
+            self.in_use += 1
+            future.set_result(None)
+            if not queue:
+                self._drop(tenant)
+
+    def _drop(self, tenant):
+        # An idle tenant's unused deficit is forfeited, as in DRR
+        del self._queues[tenant]
+        self._deficits.pop(tenant, None)
+        self._weights.pop(tenant, None)
+
+# === Scoring Executor ===
+class ScoringExecutor:
+    """Runs anomaly scoring in a thread or process pool so it never blocks the event loop.
+
+    ``models`` is the ModelManager whose current version scores each batch; the version
+    is picked when a batch is dispatched, so a hot-swap never affects a batch in flight.
+    ``mode="thread"`` shares the live scorer across threads (NumPy releases the GIL for
+    most of the tree traversal). ``mode="process"`` sends only the feature matrix and the
+    model version to worker processes, which load each version once. At most
+    ``max_in_flight`` batches are queued or running at once; further callers wait for a
+    slot, taking turns by tenant (see ``FairSlots``).
+
+    With a ``feature_store``, each batch is counted in it and its ``joined`` window
+    features are added to the scored logs; with ``model_window_features`` they are also
+    appended to the feature matrix, for models refitted on them.
+    """
+
+    def __init__(self, models, mode="thread", max_workers=None, max_in_flight=None, quantum=256,
+                 feature_store=None, joined=(), model_window_features=False):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown scoring executor mode: {mode}")
+        self.models = models
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self._pool = None
+        self._slots = FairSlots(self.max_in_flight, quantum=quantum)
+        self.in_flight = 0
+        self.feature_store = feature_store
+        self.joined = tuple(joined)
+        self.model_window_features = model_window_features
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scoring")
+            logger.info(f"Started {self.mode} scoring pool with {self.max_workers} workers "
+                        f"({self.max_in_flight} batches in flight max)")
+        return self._pool
+
+    async def detect_anomalies(self, logs_data, tenant=None, weight=1.0, models=None):
+        """Score a batch off the event loop; same inputs and output as ``detect_anomalies``.
+
+        ``tenant`` and ``weight`` place the batch in the fair queue for a slot; ``models``
+        overrides the executor's ModelManager (for tenants with their own model).
+        """
+        X = feature_matrix(logs_data)
+        if not len(X):
+            return []
+        joined = None
+        if self.feature_store is not None:
+            window = self.feature_store.update(logs_data)
+            joined = {name: window[name] for name in self.joined} or None
+            if self.model_window_features:
+                X = np.column_stack([X, *joined.values()])
+        models = models or self.models
+        models.observe(X)
+
+        await self._slots.acquire(tenant, len(X), weight)
+        try:
+            model = models.current
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                if self.mode == "thread":
+                    return await loop.run_in_executor(
+                        self._ensure_pool(), detect_anomalies, logs_data, model.scorer, X, model.version, joined
+                    )
+                labels, scores = await loop.run_in_executor(
+                    self._ensure_pool(), _score_in_worker, X, model.version, model.path
+                )
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._slots.release()
+
+        records = feature_columns_to_records(logs_data) if isinstance(logs_data, dict) else logs_data
+        return attach_scores(records, labels, scores, model.version, joined)
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
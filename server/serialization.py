@@ -0,0 +1,92 @@
+import logging
+import re
+
+import numpy as np
+import orjson
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# How much of a scored batch a client wants back:
+# full: every log, anomalies: only anomalous logs, counts: totals only
+RESPONSE_PROFILES = ("full", "anomalies", "counts")
+
+# Fields echoed for each anomaly in anomaly_details
+ANOMALY_DETAIL_FIELDS = ("timestamp", "ip", "method", "url", "status_code", "anomaly_score")
+
+# === Encoding ===
+def _default(value):
+    """Values the fast path doesn't know: NumPy scalars, date-likes, anything else as str"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def dumps(obj):
+    """Encode to compact JSON bytes; datetimes (pandas Timestamps included) become ISO strings"""
+    return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+loads = orjson.loads
+
+def dumps_text(obj):
+    """Same as ``dumps`` as a str, for WebSocket text frames"""
+    return dumps(obj).decode("utf-8")
+
+class FastJSONResponse(Response):
+    """JSONResponse encoded with ``dumps`` instead of the stdlib encoder"""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+# === Response Profiles ===
+def parse_profile(profile, default="full"):
+    """Validate a requested response profile; raises ValueError for unknown ones"""
+    if not profile:
+        return default
+    if profile not in RESPONSE_PROFILES:
+        raise ValueError(f"Unknown response profile {profile!r}, expected one of {RESPONSE_PROFILES}")
+    return profile
+
+def is_anomaly(log):
+    return log.get("anomaly", 0) == -1
+
+# The label ``attach_scores`` puts right before the score, as ``dumps`` writes it
+_ANOMALY_LABEL = re.compile(rb'"anomaly":(-?\d+),"anomaly_score":')
+
+def _flag_label(match):
+    flag = b"true" if match.group(1) == b"-1" else b"false"
+    return b'"is_anomaly":' + flag + b',"anomaly_score":'
+
+def flagged_json(logs):
+    """Scored logs (a list, or one log) encoded once, with the raw anomaly label replaced
+    by an is_anomaly flag in the encoded bytes rather than in a copy of every log; embeds
+    as is in anything encoded by ``dumps``"""
+    return orjson.Fragment(_ANOMALY_LABEL.sub(_flag_label, dumps(logs)))
+
+def anomaly_details(scored_logs):
+    return [{name: log.get(name) for name in ANOMALY_DETAIL_FIELDS} for log in scored_logs if is_anomaly(log)]
+
+def scored_batch_payload(scored_logs, profile="full"):
+    """Reply body for a scored batch: the logs the profile asks for, flagged, plus counts"""
+    anomalous = [log for log in scored_logs if is_anomaly(log)]
+    payload = {"total_logs": len(scored_logs), "anomalies_detected": len(anomalous)}
+    if profile == "full":
+        payload["logs"] = flagged_json(scored_logs)
+    elif profile == "anomalies":
+        payload["logs"] = flagged_json(anomalous)
+    return payload
+
+def scored_log_payload(scored_log, profile="full"):
+    """Reply body for one scored log: the log itself unless the profile leaves it out"""
+    anomalous = is_anomaly(scored_log)
+    payload = {"is_anomaly": anomalous}
+    if profile == "full" or (profile == "anomalies" and anomalous):
+        payload["log"] = flagged_json(scored_log)
+    return payload
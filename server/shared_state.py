@@ -0,0 +1,183 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where only a single worker is supported
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Broadcast events older than this are pruned; workers poll far more often
+EVENT_TTL_SECONDS = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequence (id INTEGER PRIMARY KEY CHECK (id = 1), last INTEGER NOT NULL);
+INSERT OR IGNORE INTO sequence (id, last) VALUES (1, 0);
+CREATE TABLE IF NOT EXISTS partials (id INTEGER PRIMARY KEY, worker TEXT NOT NULL, created_at REAL NOT NULL,
+                                     payload BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, created_at REAL NOT NULL, payload BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# === Leader Election ===
+class LeaderLock:
+    """Leader election between the workers of one host with an exclusive ``flock``.
+
+    The first worker to take the lock keeps it for its lifetime; the kernel releases it
+    when that process exits (however it exits), and the next ``try_acquire`` by another
+    worker takes over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self.acquired_at = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """Take the lock if it is free; returns whether this process is the leader"""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            raise RuntimeError("Leader election needs fcntl (POSIX); run a single worker on this platform")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        self.acquired_at = time.time()
+        logger.info(f"Worker {os.getpid()} is now the leader")
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+# === Shared State ===
+class SharedState:
+    """State shared by the worker processes of one deployment, in a local SQLite database.
+
+    - the log ``seq`` counter, so every worker numbers its logs from one sequence
+    - partial summary aggregates each worker hands over for the leader to merge
+    - broadcast events the leader publishes and every worker relays to its own clients
+    - small ``meta`` values, like when the last summary was written
+
+    The database runs in WAL mode, so readers never wait for the writer; every write is
+    a short transaction.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "state.sqlite3")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self.leader = LeaderLock(os.path.join(directory, "leader.lock"))
+        self.partials_pushed = 0
+        self.partials_merged = 0
+        self.events_published = 0
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # === Sequence ===
+    def reserve_sequence(self, n, floor=0):
+        """First of the next ``n`` seqs, continuing after ``floor`` if that is higher"""
+        (last,), = self._write(
+            "UPDATE sequence SET last = MAX(last, ?) + ? WHERE id = 1 RETURNING last", (floor, n)
+        )
+        return last - n + 1
+
+    def last_seq(self):
+        with self._lock:
+            return self._db.execute("SELECT last FROM sequence WHERE id = 1").fetchone()[0]
+
+    # === Summary Partials ===
+    def push_partial(self, worker, state):
+        self._write(
+            "INSERT INTO partials (worker, created_at, payload) VALUES (?, ?, ?)",
+            (str(worker), time.time(), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)),
+        )
+        self.partials_pushed += 1
+
+    def take_partials(self):
+        """Remove and return every partial pushed so far, oldest first"""
+        rows = self._write("DELETE FROM partials RETURNING id, payload")
+        rows.sort()
+        self.partials_merged += len(rows)
+        return [pickle.loads(payload) for _, payload in rows]
+
+    # === Events ===
+    def publish(self, event):
+        """Queue a broadcast message for every worker to relay to its clients; returns its id"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                event_id = self._db.execute(
+                    "INSERT INTO events (created_at, payload) VALUES (?, ?)", (now, pickle.dumps(event))
+                ).lastrowid
+                self._db.execute("DELETE FROM events WHERE created_at < ?", (now - EVENT_TTL_SECONDS,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self.events_published += 1
+        return event_id
+
+    def last_event_id(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_after(self, event_id):
+        """``(id, event)`` pairs published after ``event_id``, in order"""
+        with self._lock:
+            rows = self._db.execute("SELECT id, payload FROM events WHERE id > ? ORDER BY id", (event_id,)).fetchall()
+        return [(row_id, pickle.loads(payload)) for row_id, payload in rows]
+
+    # === Meta ===
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, key, value):
+        self._write("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, str(value)))
+
+    def stats(self):
+        with self._lock:
+            pending = self._db.execute("SELECT COUNT(*) FROM partials").fetchone()[0]
+        return {
+            "worker": os.getpid(),
+            "leader": self.leader.held,
+            "leader_since": self.leader.acquired_at,
+            "last_seq": self.last_seq(),
+            "partials_pushed": self.partials_pushed,
+            "partials_merged": self.partials_merged,
+            "partials_pending": pending,
+            "events_published": self.events_published,
+        }
+
+    def close(self):
+        self.leader.release()
+        with self._lock:
+            self._db.close()
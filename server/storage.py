@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import orjson
+
+from serialization import dumps_text
+
+logger = logging.getLogger(__name__)
+
+# Queued by stop() behind the last real log to tell the writer to finish
+_STOP = object()
+
+# === Write-Behind Queue ===
+class WriteBatch(list):
+    """Logs handed to ``flush_fn`` together. ``state`` is kept across retries of the batch,
+    so ``flush_fn`` can remember what it already wrote; a ``"seqs"`` entry is reported
+    if the batch is given up on."""
+
+    def __init__(self, logs=()):
+        super().__init__(logs)
+        self.state = {}
+
+class WriteBehindQueue:
+    """Bounded write-behind queue that hands logs to storage in large batches.
+
+    ``enqueue`` returns as soon as the logs are queued (it only waits while the queue
+    is full), and a single background writer calls the blocking ``flush_fn`` in a
+    thread with a ``WriteBatch`` of up to ``batch_size`` logs, or whatever arrived within
+    ``flush_interval_ms`` of the first queued log. ``flush_fn`` returns True on success.
+    A failed batch is retried up to ``retries`` times, waiting ``retry_backoff_ms`` and
+    then twice as long each time (the queue fills meanwhile, which sheds ingest); after
+    that its logs are appended to ``dead_letter_path`` (NDJSON) if given.
+    """
+
+    def __init__(self, flush_fn, max_queue=50_000, batch_size=500, flush_interval_ms=500, retries=3,
+                 retry_backoff_ms=500, dead_letter_path=None):
+        self.flush_fn = flush_fn
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.retries = retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.dead_letter_path = dead_letter_path
+        self._queue = None
+        self._writer = None
+        self.flushed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.flushes = 0
+        self.last_flush_seconds = None
+        self.total_flush_seconds = 0.0
+        self.last_batch_size = 0
+
+    def __len__(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def _ensure_started(self):
+        if self._writer is None or self._writer.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._writer = asyncio.create_task(self._run())
+
+    async def enqueue(self, logs):
+        """Queue logs for storage without waiting for them to be written"""
+        self._ensure_started()
+        for log in logs:
+            try:
+                self._queue.put_nowait(log)
+            except asyncio.QueueFull:
+                await self._queue.put(log)
+
+    async def _collect(self):
+        """Next batch to write, and whether the writer was asked to stop after it"""
+        item = await self._queue.get()
+        if item is _STOP:
+            return WriteBatch(), True
+        batch = WriteBatch([item])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _flush(self, batch):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                ok = await asyncio.to_thread(self.flush_fn, batch)
+            except Exception as e:
+                logger.error(f"Write-behind flush of {len(batch)} logs failed: {e}", exc_info=True)
+                ok = False
+            self.last_flush_seconds = time.perf_counter() - start
+            self.total_flush_seconds += self.last_flush_seconds
+            self.flushes += 1
+            self.last_batch_size = len(batch)
+            if ok:
+                self.flushed += len(batch)
+                return
+        self.failed += len(batch)
+        seqs = batch.state.get("seqs")
+        lost = f"seqs {seqs[0]}-{seqs[-1]}" if seqs else "no seqs reserved"
+        if self.dead_letter_path:
+            try:
+                await asyncio.to_thread(self._dead_letter, batch, seqs)
+                self.dead_lettered += len(batch)
+                logger.error(f"Gave up writing {len(batch)} logs ({lost}) after {self.retries} retries, "
+                             f"appended them to {self.dead_letter_path}")
+                return
+            except OSError as e:
+                logger.error(f"Could not write {self.dead_letter_path}: {e}")
+        logger.error(f"Gave up writing {len(batch)} logs ({lost}) after {self.retries} retries, they are lost")
+
+    def _dead_letter(self, batch, seqs):
+        os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for i, log in enumerate(batch):
+                f.write(encode_log_document({**log, "seq": seqs[i]} if seqs else log) + "\n")
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def stop(self):
+        """Flush everything still queued, then stop the writer"""
+        if self._writer is None or self._writer.done():
+            return
+        pending = self._queue.qsize()
+        await self._queue.put(_STOP)
+        await self._writer
+        self._writer = None
+        logger.info(f"Write-behind queue drained ({pending} logs flushed on shutdown)")
+
+    def stats(self):
+        return {
+            "queue_depth": len(self),
+            "max_queue": self.max_queue,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "retried_flushes": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "flushes": self.flushes,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 2) if self.last_flush_seconds is not None else None,
+            "avg_flush_ms": round(self.total_flush_seconds / self.flushes * 1000, 2) if self.flushes else None,
+        }
+
+# === Document Encoding ===
+def encode_log_document(log):
+    """Compact JSON document for a stored log"""
+    return dumps_text(log)
+
+def decode_log_document(document):
+    """Parse a stored log document (JSON, as written by ``encode_log_document``)"""
+    return orjson.loads(document)
+
+# === Log Sequence ===
+class LogSequence:
+    """Dense, increasing ``seq`` numbers stored with each log, the key for paging by recency.
+
+    Resumes after the newest log already in the collection, which ChromaDB returns last
+    because ``get`` pages in insertion order, or after ``floor`` if that is higher.
+    With ``shared`` (a ``SharedState``) the numbers come from the counter all workers share.
+    """
+
+    def __init__(self, collection, floor=0, shared=None):
+        self._lock = threading.Lock()
+        self._last = max(floor, self._last_stored(collection))
+        self.shared = shared
+
+    @property
+    def last(self):
+        """Highest seq handed out so far (by any worker when shared)"""
+        if self.shared is not None:
+            return max(self._last, self.shared.last_seq())
+        return self._last
+
+    @staticmethod
+    def _last_stored(collection):
+        count = collection.count()
+        if not count:
+            return 0
+        newest = collection.get(offset=count - 1, limit=1, include=["metadatas"])
+        metadatas = newest["metadatas"] or [{}]
+        # Collections written before seq existed continue after their row count
+        return int(metadatas[0].get("seq", count))
+
+    def advance(self, floor):
+        """Continue after ``floor`` if it is higher, e.g. the archive's last seq once logs
+        another process wrote there are known"""
+        with self._lock:
+            self._last = max(self._last, floor)
+
+    def reserve(self, n):
+        """Next ``n`` sequence numbers"""
+        if self.shared is not None:
+            start = self.shared.reserve_sequence(n, floor=self._last)
+            return range(start, start + n)
+        with self._lock:
+            start = self._last + 1
+            self._last += n
+            return range(start, self._last + 1)
+
+# === Paged Retrieval ===
+def fetch_log_page(collection, latest_seq, limit=100, before=None, where=None):
+    """Newest-first page of stored logs with ``seq < before``, without a vector search.
+
+    Reads seq windows backwards from the cursor with metadata-filtered ``get`` calls,
+    widening the window by the match rate seen so far, so a page costs a few bounded
+    reads however long the history is. Returns ``(rows, next_cursor)``, where rows are
+    ``(seq, document, metadata)`` tuples and ``next_cursor`` is None on the last page.
+    """
+    upper = latest_seq + 1 if before is None else min(before, latest_seq + 1)
+    rows = []
+    span = limit
+    while upper > 1 and len(rows) < limit:
+        lower = max(1, upper - span)
+        conditions = [{"seq": {"$gte": lower}}, {"seq": {"$lt": upper}}]
+        if where:
+            conditions.extend({key: value} for key, value in where.items())
+        found = collection.get(where={"$and": conditions}, include=["documents", "metadatas"])
+        rows.extend(
+            (metadata["seq"], document, metadata)
+            for document, metadata in zip(found["documents"], found["metadatas"])
+        )
+        matched = len(found["documents"])
+        remaining = limit - len(rows)
+        # Size the next window for the rows still needed at the density just observed
+        span = span * 8 if not matched else max(span, min(span * 8, remaining * span // matched + 1))
+        upper = lower
+
+    rows.sort(key=lambda row: row[0], reverse=True)
+    has_more = len(rows) > limit or upper > 1
+    rows = rows[:limit]
+    next_cursor = rows[-1][0] if has_more and rows else None
+    return rows, next_cursor
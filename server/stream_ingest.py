@@ -0,0 +1,80 @@
+import logging
+
+from fastapi.responses import StreamingResponse
+
+from serialization import loads
+
+logger = logging.getLogger(__name__)
+
+# Per-line errors reported back for each chunk; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# === NDJSON Parsing ===
+async def iter_ndjson_chunks(body, chunk_size=1000, max_line_bytes=1 << 20):
+    """Parse an NDJSON byte stream into chunks of at most ``chunk_size`` log dicts.
+
+    Yields ``(logs, errors)`` as soon as a chunk is full (and once more at the end), so
+    at most one chunk plus one line is held in memory whatever the size of the body.
+    ``errors`` lists ``(line number, message)`` for lines that were skipped: invalid
+    JSON, anything but an object, or lines longer than ``max_line_bytes``.
+    """
+    logs, errors = [], []
+    pending = b""
+    line_number = 0
+    skipping = False  # inside an over-long line, dropping bytes up to its newline
+
+    def parse(line):
+        try:
+            log = loads(line)
+        except ValueError as e:
+            errors.append((line_number, f"invalid JSON: {e}"))
+            return
+        if isinstance(log, dict):
+            logs.append(log)
+        else:
+            errors.append((line_number, f"expected a JSON object, got {type(log).__name__}"))
+
+    async for data in body:
+        if not data:
+            continue
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            if skipping:
+                skipping = False
+            elif line.strip():
+                parse(line)
+            if len(logs) >= chunk_size:
+                yield logs, errors
+                logs, errors = [], []
+        if len(pending) > max_line_bytes:
+            if not skipping:
+                errors.append((line_number + 1, f"line longer than {max_line_bytes} bytes"))
+            skipping = True
+            pending = b""
+
+    if pending.strip() and not skipping:
+        line_number += 1
+        parse(pending)
+    if logs or errors:
+        yield logs, errors
+
+def error_report(errors):
+    return [{"line": line, "error": message} for line, message in errors[:MAX_REPORTED_ERRORS]]
+
+# === Streaming Response ===
+class NDJSONStreamingResponse(StreamingResponse):
+    """StreamingResponse that leaves the request body to the body iterator.
+
+    Under ASGI spec < 2.4 Starlette listens for client disconnects while streaming by
+    reading ``receive()``, which would swallow the upload the iterator is still
+    consuming; disconnects surface through ``request.stream()`` instead.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
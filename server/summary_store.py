@@ -0,0 +1,176 @@
+import bisect
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SEPARATOR = b"-" * 50 + b"\n"  # closes every block written by append_summary_to_file
+_HEADER = re.compile(r"--- SUMMARY FOR (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) ---")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+def estimate_tokens(text):
+    """Rough LLM token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+# === Summary Windows ===
+class SummaryWindow:
+    """One parsed summary block, with its term frequencies cached for scoring"""
+
+    __slots__ = ("written_at", "text", "term_counts", "length", "tokens")
+
+    def __init__(self, written_at, text):
+        self.written_at = written_at
+        self.text = text
+        terms = tokenize(text)
+        self.term_counts = Counter(terms)
+        self.length = len(terms)
+        self.tokens = estimate_tokens(text)
+
+# === Summary Store ===
+class SummaryStore:
+    """Incrementally parsed, BM25-indexed view of the append-only summary file.
+
+    ``refresh`` only reads the bytes appended since the last call (the whole file again
+    if it was truncated or replaced), so parsing and tokenizing cost is paid once per
+    summary. ``select`` picks the windows to put in a prompt: the most recent ones
+    first, then the best BM25 matches for the query, within a token budget.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.windows = []  # in file order, which is also written_at order
+        self._times = []  # written_at of each window, the time index
+        self._postings = {}  # term -> [(window position, term frequency)]
+        self._total_length = 0
+        self._offset = 0
+        self._file_id = None
+        self._pending = b""
+        self.version = 0  # changes whenever the parsed summaries do
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.windows, self._times, self._postings = [], [], {}
+        self._total_length = 0
+        self._offset = 0
+        self._pending = b""
+        self.version += 1
+
+    def refresh(self):
+        """Parse summaries appended since the last refresh; returns how many were added"""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                self._file_id = None
+                return 0
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id or stat.st_size < self._offset:
+                self._reset()
+                self._file_id = file_id
+            if stat.st_size == self._offset:
+                return 0
+
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            self._offset += len(data)
+            blocks = (self._pending + data).split(SUMMARY_SEPARATOR)
+            self._pending = blocks.pop()  # not terminated yet, completed by a later append
+
+            added = 0
+            for block in blocks:
+                window = self._parse(block.decode("utf-8", "replace"))
+                if window is not None:
+                    self._add(window)
+                    added += 1
+            if added:
+                logger.debug(f"Indexed {added} new summaries ({len(self.windows)} total)")
+            return added
+
+    @staticmethod
+    def _parse(block):
+        match = _HEADER.search(block)
+        if match is None:
+            return None  # e.g. the "SYSTEM STARTED" banner
+        written_at = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+        text = block[match.start():].rstrip() + "\n" + SUMMARY_SEPARATOR.decode()
+        return SummaryWindow(written_at, text)
+
+    def _add(self, window):
+        position = len(self.windows)
+        self.version += 1
+        self.windows.append(window)
+        self._times.append(window.written_at)
+        self._total_length += window.length
+        for term, count in window.term_counts.items():
+            self._postings.setdefault(term, []).append((position, count))
+
+    def _bm25(self, query, first):
+        """BM25 score of each window from position ``first`` on that matches the query"""
+        n = len(self.windows)
+        average_length = self._total_length / n
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            start = bisect.bisect_left(postings, (first, 0))
+            for position, count in postings[start:]:
+                length = self.windows[position].length
+                scores[position] += idf * count * (BM25_K1 + 1) / (
+                    count + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                )
+        return scores
+
+    def select(self, query, token_budget, recent=3, since=None):
+        """Windows for a prompt, oldest first: the ``recent`` latest, then the best matches,
+        then whatever recent history still fits.
+
+        ``since`` limits the candidates to summaries written at or after that time.
+        """
+        self.refresh()
+        with self._lock:
+            if not self.windows:
+                return []
+            first = bisect.bisect_left(self._times, since) if since is not None else 0
+            newest_first = range(len(self.windows) - 1, first - 1, -1)
+            scores = self._bm25(query, first)
+            ranked = sorted(scores, key=lambda position: (-scores[position], -position))
+
+            chosen, used = set(), 0
+            for candidates, filling in ((newest_first[:recent], False), (ranked, False), (newest_first, True)):
+                for position in candidates:
+                    if position in chosen:
+                        continue
+                    cost = self.windows[position].tokens
+                    if used + cost > token_budget:
+                        if filling:
+                            break  # older history only gets less relevant
+                        continue
+                    chosen.add(position)
+                    used += cost
+            return [self.windows[position] for position in sorted(chosen)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "summaries": len(self.windows),
+                "terms": len(self._postings),
+                "bytes_parsed": self._offset,
+                "first": self._times[0].isoformat() if self._times else None,
+                "last": self._times[-1].isoformat() if self._times else None,
+            }
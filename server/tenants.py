@@ -0,0 +1,231 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from features import DEFAULT_TENANT
+from ring_buffer import ColumnarLogBuffer
+from summary_store import SummaryStore
+
+logger = logging.getLogger(__name__)
+
+# Smaller HyperLogLog sketches than the global summary's, there can be many tenants
+TENANT_HLL_PRECISION = 12
+
+def parse_weights(spec):
+    """``"tenant:weight,tenant:weight"`` (from TENANT_WEIGHTS) as a dict"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        tenant, _, weight = item.rpartition(":")
+        if not tenant:
+            raise ValueError(f"Invalid tenant weight {item!r}, expected tenant:weight")
+        weights[tenant] = float(weight)
+    return weights
+
+# === Rate Limiting ===
+class TokenBucket:
+    """Logs-per-second quota with bursts of up to ``burst`` logs; ``rate`` 0 is unlimited"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, n):
+        """Take up to ``n`` tokens; returns how many logs are admitted"""
+        if not self.rate:
+            return n
+        self._refill()
+        admitted = min(n, int(self.tokens))
+        self.tokens -= admitted
+        return admitted
+
+    def retry_after_ms(self):
+        if not self.rate:
+            return 0
+        self._refill()
+        return max(0, round((1 - self.tokens) / self.rate * 1000))
+
+# === Tenant ===
+class Tenant:
+    """One tenant's slice of the pipeline: its recent logs, summary windows, quota,
+    scheduling weight and, optionally, its own anomaly model"""
+
+    def __init__(self, tenant_id, buffer_rows, buffer_bytes, summary_windows, rate, burst, weight, models=None):
+        self.id = tenant_id
+        self.buffer = ColumnarLogBuffer(max_rows=buffer_rows, max_bytes=buffer_bytes)
+        self.summary_windows = summary_windows
+        self.bucket = TokenBucket(rate, burst)
+        self.weight = weight
+        self.models = models
+        self.accepted = 0
+        self.throttled = 0
+        self.last_seen = time.monotonic()
+
+    @property
+    def idle(self):
+        """Nothing waiting to be summarized (a refitted model is reloaded from disk)"""
+        return not self.summary_windows
+
+    def stats(self):
+        return {
+            "tenant": self.id,
+            "weight": self.weight,
+            "accepted": self.accepted,
+            "throttled": self.throttled,
+            "buffered": len(self.buffer),
+            "pending_summary": len(self.summary_windows),
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+            "model_version": self.models.current.version if self.models is not None else None,
+        }
+
+# === Tenant Registry ===
+class TenantRegistry:
+    """Per-tenant pipelines, created on a tenant's first log.
+
+    Tenants are keyed by the hashed API key their logs carry (``DEFAULT_TENANT`` for
+    logs without one). Each gets a small bounded buffer and its own summary windows
+    (from ``window_factory()``), so one tenant's volume neither evicts another's recent
+    logs nor drowns out its summaries. At most ``max_tenants`` are kept; beyond that the least recently seen idle
+    tenant is forgotten, or if none is idle the least recently seen one, dropping the logs
+    in its open summary windows. ``model_factory(tenant_id)``, if given, builds a ModelManager
+    for each tenant's own model, persisted in its own model directory.
+    """
+
+    def __init__(self, summary_dir, window_factory, buffer_rows=1000, buffer_bytes=None, rate=0, burst=None,
+                 weights=None, max_tenants=1000, model_factory=None):
+        self.summary_dir = summary_dir
+        self.window_factory = window_factory
+        self.buffer_rows = buffer_rows
+        self.buffer_bytes = buffer_bytes
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights or {}
+        self.max_tenants = max_tenants
+        self.model_factory = model_factory
+        self._tenants = OrderedDict()  # tenant id -> Tenant, least recently seen first
+        self._summary_stores = OrderedDict()  # tenant id -> SummaryStore, opened by /chat
+        self.evicted = 0
+        self.evicted_pending = 0  # logs in open summary windows of evicted tenants
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def get(self, tenant_id):
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            models = self.model_factory(tenant_id) if self.model_factory is not None else None
+            tenant = self._tenants[tenant_id] = Tenant(
+                tenant_id, self.buffer_rows, self.buffer_bytes, self.window_factory(), self.rate, self.burst,
+                self.weights.get(tenant_id, 1.0), models,
+            )
+            logger.info(f"New tenant {tenant_id}")
+            self._evict()
+        else:
+            self._tenants.move_to_end(tenant_id)
+        tenant.last_seen = time.monotonic()
+        return tenant
+
+    def find(self, tenant_id):
+        """The tenant if it is known, without creating it"""
+        return self._tenants.get(tenant_id)
+
+    def _evict(self):
+        excess = len(self._tenants) - self.max_tenants
+        if excess <= 0:
+            return
+        # Never the tenant just added, which is the most recently seen
+        candidates = list(self._tenants.values())[:-1]
+        victims = [tenant for tenant in candidates if tenant.idle][:excess]
+        if len(victims) < excess:
+            chosen = {tenant.id for tenant in victims}
+            victims += [tenant for tenant in candidates if tenant.id not in chosen][:excess - len(victims)]
+        for tenant in victims:
+            del self._tenants[tenant.id]
+            if tenant.models is not None:
+                tenant.models.shutdown()
+            if not tenant.idle:
+                pending = len(tenant.summary_windows)
+                self.evicted_pending += pending
+                logger.warning(f"Evicted busy tenant {tenant.id} at the {self.max_tenants} tenant limit, "
+                               f"dropping {pending} logs from its open summary windows")
+            self.evicted += 1
+
+    def throttle(self, tenant_id, n):
+        """How many of ``n`` logs the tenant's rate quota admits right now"""
+        tenant = self.get(tenant_id)
+        admitted = tenant.bucket.take(n)
+        tenant.accepted += admitted
+        tenant.throttled += n - admitted
+        return admitted
+
+    def record(self, scored_logs):
+        """Add scored logs to their tenants' buffers and summary windows; returns whether
+        a tenant's window is ready to summarize"""
+        groups = {}
+        for log in scored_logs:
+            groups.setdefault(log.get("tenant", DEFAULT_TENANT), []).append(log)
+        due = False
+        for tenant_id, logs in groups.items():
+            tenant = self.get(tenant_id)
+            tenant.buffer.extend(logs)
+            tenant.summary_windows.add(logs)
+            due = due or tenant.summary_windows.due()
+        return due
+
+    def fire_summaries(self):
+        """``(tenant id, start, end, summary, state)`` for every tenant window the watermark has closed"""
+        return [(t.id, *window) for t in self if t.summary_windows.due() for window in t.summary_windows.fire()]
+
+    def idle_deadline(self):
+        """Earliest time a tenant's open windows close for lack of logs, or None"""
+        return min(filter(None, (t.summary_windows.idle_deadline() for t in self)), default=None)
+
+    def take_states(self):
+        """Every tenant's open summary windows as plain data, for the leader to merge"""
+        return {t.id: t.summary_windows.take_state() for t in self if t.summary_windows}
+
+    def merge_states(self, states):
+        for tenant_id, state in states.items():
+            self.get(tenant_id).summary_windows.merge(state)
+
+    def summary_path(self, tenant_id):
+        return os.path.join(self.summary_dir, f"{tenant_id}.txt")
+
+    def summary_store(self, tenant_id):
+        """The tenant's parsed summary stream, or None before its first summary.
+        Summaries may have been written by another worker, so this does not need the
+        tenant to be known here."""
+        store = self._summary_stores.get(tenant_id)
+        if store is None:
+            path = self.summary_path(tenant_id)
+            if not os.path.exists(path):
+                return None
+            store = self._summary_stores[tenant_id] = SummaryStore(path)
+            while len(self._summary_stores) > self.max_tenants:
+                self._summary_stores.popitem(last=False)
+        self._summary_stores.move_to_end(tenant_id)
+        return store
+
+    def stats(self, per_tenant=False):
+        stats = {
+            "tenants": len(self),
+            "max_tenants": self.max_tenants,
+            "evicted": self.evicted,
+            "evicted_pending_logs": self.evicted_pending,
+            "rate_limit": self.rate or None,
+            "accepted": sum(t.accepted for t in self._tenants.values()),
+            "throttled": sum(t.throttled for t in self._tenants.values()),
+        }
+        if per_tenant:
+            stats["by_tenant"] = [t.stats() for t in self._tenants.values()]
+        return stats
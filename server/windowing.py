@@ -0,0 +1,176 @@
+import logging
+import time
+
+from aggregator import StreamingAggregator
+from ring_buffer import NAT, format_epoch_ns, to_epoch_ns
+
+logger = logging.getLogger(__name__)
+
+# Open windows beyond this (timestamps scattered far apart) close the oldest early
+MAX_OPEN_WINDOWS = 64
+# Timestamps further ahead of the clock don't move the watermark; wide enough for
+# naive local timestamps read as UTC in any timezone
+MAX_FUTURE_SKEW_SECONDS = 24 * 3600
+
+_NS = 1_000_000_000
+
+# === Event-Time Windows ===
+class EventTimeWindows:
+    """Summary aggregates in tumbling or hopping windows of the logs' own timestamps.
+
+    Each log is folded into the window(s) ``[start, start + size)`` its ``timestamp``
+    falls in, with starts aligned to multiples of ``slide`` (``size`` for tumbling
+    windows). The watermark trails the newest timestamp seen by ``allowed_lateness``;
+    a window closes once the watermark passes its end, and logs for a closed window
+    are counted as late and left out. So a summary covers exactly the logs stamped
+    within its window, whatever order they arrived in, as long as they were no later
+    than the allowed lateness. Timestamps implausibly far ahead of the clock are
+    summarized but don't move the watermark. After ``idle_seconds`` without logs every
+    open window closes, so the last one isn't held back forever.
+
+    ``fire`` returns the windows ready to summarize; ``due`` tells cheaply whether there
+    are any. ``take_state`` / ``merge`` move open windows between processes like
+    ``StreamingAggregator``'s.
+    """
+
+    def __init__(self, size_seconds, slide_seconds=None, allowed_lateness_seconds=0, idle_seconds=None,
+                 clock=time.time, **aggregator_options):
+        self.size = int(size_seconds * _NS)
+        self.slide = int((slide_seconds or size_seconds) * _NS)
+        if self.slide > self.size:
+            raise ValueError("The window slide can't be longer than the window")
+        self.lateness = int(allowed_lateness_seconds * _NS)
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self.aggregator_options = aggregator_options
+        self.windows = {}  # start (epoch ns) -> StreamingAggregator
+        self.max_event = None  # newest timestamp that moves the watermark
+        self.fired_until = None  # end of the last closed window
+        self.last_event_at = None  # clock time of the last log
+        self.late = 0
+        self.untimed = 0
+        self.fired = 0
+
+    def __len__(self):
+        """Logs in open windows (a log in several hopping windows counts once per window)"""
+        return sum(len(window) for window in self.windows.values())
+
+    def __bool__(self):
+        return bool(self.windows)
+
+    def _window(self, start):
+        window = self.windows.get(start)
+        if window is None:
+            window = self.windows[start] = StreamingAggregator(**self.aggregator_options)
+        return window
+
+    def _closed(self, start):
+        return self.fired_until is not None and start + self.size <= self.fired_until
+
+    def add(self, logs):
+        """Fold scored logs into their windows"""
+        horizon = int((self.clock() + MAX_FUTURE_SKEW_SECONDS) * _NS)
+        added = False
+        for log in logs:
+            ts = to_epoch_ns(log.get("timestamp"))
+            if ts == NAT:
+                self.untimed += 1
+                continue
+            if ts <= horizon and (self.max_event is None or ts > self.max_event):
+                self.max_event = ts
+            start = ts - ts % self.slide
+            while start > ts - self.size:
+                if self._closed(start):
+                    self.late += 1
+                else:
+                    self._window(start).update(log, ts)
+                    added = True
+                start -= self.slide
+        if added:
+            self.last_event_at = self.clock()
+
+    def watermark(self):
+        """Event time up to which all logs are assumed to have arrived (epoch ns), or None"""
+        if self.windows and self.idle_seconds is not None and self.last_event_at is not None \
+                and self.clock() - self.last_event_at >= self.idle_seconds:
+            return max(self.windows) + self.size
+        if self.max_event is None:
+            return None
+        return self.max_event - self.lateness
+
+    def due(self):
+        """Whether ``fire`` would close any window now"""
+        if not self.windows:
+            return False
+        if len(self.windows) > MAX_OPEN_WINDOWS:
+            return True
+        watermark = self.watermark()
+        return watermark is not None and min(self.windows) + self.size <= watermark
+
+    def idle_deadline(self):
+        """Clock time at which the open windows close for lack of logs, or None"""
+        if not self.windows or self.idle_seconds is None or self.last_event_at is None:
+            return None
+        return self.last_event_at + self.idle_seconds
+
+    def fire(self):
+        """Close the windows the watermark has passed; returns ``(start, end, summary, state)``
+        for each, oldest first, with the summary's time range set to the window's and the
+        aggregator's ``state()`` for rollups"""
+        watermark = self.watermark()
+        starts = sorted(self.windows)
+        overflow = len(starts) - MAX_OPEN_WINDOWS
+        fired = []
+        for i, start in enumerate(starts):
+            end = start + self.size
+            if i >= overflow and (watermark is None or end > watermark):
+                break
+            window = self.windows.pop(start)
+            summary = window.snapshot()
+            summary["time_range_start"] = format_epoch_ns(start)
+            summary["time_range_end"] = format_epoch_ns(end)
+            fired.append((start, end, summary, window.state()))
+            self.fired_until = end if self.fired_until is None else max(self.fired_until, end)
+        self.fired += len(fired)
+        return fired
+
+    def close_until(self, fired_until):
+        """Treat windows ending at or before ``fired_until`` as already summarized"""
+        if fired_until is not None:
+            self.fired_until = fired_until if self.fired_until is None else max(self.fired_until, fired_until)
+
+    def take_state(self):
+        """Plain-data copy of the open windows, which are then dropped here"""
+        state = {
+            "windows": {start: window.state() for start, window in self.windows.items()},
+            "max_event": self.max_event,
+        }
+        self.windows = {}
+        return state
+
+    def merge(self, state):
+        """Fold in another process's open windows; those closed here already are late"""
+        for start, window_state in state["windows"].items():
+            if self._closed(start):
+                self.late += window_state["total_logs"]
+            else:
+                self._window(start).merge(window_state)
+        if state["windows"]:
+            self.last_event_at = self.clock()
+        if state["max_event"] is not None and (self.max_event is None or state["max_event"] > self.max_event):
+            self.max_event = state["max_event"]
+
+    def stats(self):
+        watermark = self.watermark()
+        return {
+            "window_seconds": self.size / _NS,
+            "slide_seconds": self.slide / _NS,
+            "allowed_lateness_seconds": self.lateness / _NS,
+            "open_windows": len(self.windows),
+            "pending_logs": len(self),
+            "watermark": format_epoch_ns(watermark) if watermark is not None else None,
+            "fired_until": format_epoch_ns(self.fired_until) if self.fired_until is not None else None,
+            "fired": self.fired,
+            "late": self.late,
+            "untimed": self.untimed,
+        }